@@ -0,0 +1,294 @@
+"""Versioned JSON API, /api/v1, over the same models as the HTML pages.
+
+Built so that one app screen is one request:
+
+    GET /api/v1/timeline                  home feed, authors and like state
+    GET /api/v1/users/<id>                profile, counts, latest messages
+    GET /api/v1/users/<id>/messages       more of a profile's messages
+    GET /api/v1/users/<id>/following      who they follow, a page at a time
+    GET /api/v1/users/<id>/followers      who follows them
+    GET /api/v1/users?ids=1,2,3           many users at once
+    GET /api/v1/likes?message_ids=4,5,6   which of these the viewer likes
+
+The logged-in user is the session's, as for the HTML pages.
+
+`?fields=` picks which fields of the endpoint's main objects to return
+(on a profile, `?message_fields=` those of its messages), `?user_fields=`
+those of each message's embedded author. Users are read
+with a SELECT of just the requested columns. Message feeds page with the
+same `?before=` / `?after=` cursors as the HTML feeds, follow lists with
+`?after=<user id>`; `?limit=` is capped at API_MAX_PAGE_SIZE. Responses
+are encoded with orjson when it is installed.
+"""
+
+from flask import Blueprint, current_app, g, request
+from sqlalchemy import select
+from werkzeug.exceptions import (BadRequest, HTTPException, NotFound,
+                                 Unauthorized)
+
+import timeline
+from models import db, Follows, Message, User
+from pagination import cursor_from_request, paginate
+from replicas import read_only
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+USER_FIELDS = ('id', 'username', 'image_url', 'header_image_url', 'bio',
+               'location', 'messages_count', 'following_count',
+               'followers_count', 'likes_count')
+# defaults for users embedded in messages and follow lists
+USER_SUMMARY_FIELDS = ('id', 'username', 'image_url')
+# `liked`: does the viewer like it; `user`: the author, as `user_fields`
+MESSAGE_FIELDS = ('id', 'text', 'timestamp', 'user_id', 'user', 'liked')
+
+
+def init_app(app):
+    """Register API config defaults and the blueprint."""
+
+    app.config.setdefault('API_MAX_PAGE_SIZE', 100)
+    # ids accepted by the bulk lookups
+    app.config.setdefault('API_MAX_IDS', 100)
+
+    app.register_blueprint(api)
+
+
+##############################################################################
+# Request parsing and responses
+
+
+def _fields(param, allowed, default):
+    value = request.args.get(param)
+    if not value:
+        return default
+
+    fields = tuple(dict.fromkeys(value.split(',')))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise BadRequest(f"Unknown {param}: {', '.join(unknown)}. "
+                         f"Choose from {', '.join(allowed)}.")
+    return fields
+
+
+def _ids(param):
+    try:
+        ids = [int(id) for id in request.args.get(param, '').split(',') if id]
+    except ValueError:
+        raise BadRequest(f"{param} must be comma-separated integers.")
+    if len(ids) > current_app.config['API_MAX_IDS']:
+        raise BadRequest(f"At most {current_app.config['API_MAX_IDS']} "
+                         f"{param} per request.")
+    return list(dict.fromkeys(ids))
+
+
+def _limit():
+    maximum = current_app.config['API_MAX_PAGE_SIZE']
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        return min(current_app.config['FEED_PAGE_SIZE'], maximum)
+    return max(1, min(limit, maximum))
+
+
+def _viewer():
+    if not g.user:
+        raise Unauthorized("Log in first.")
+    return g.user
+
+
+def _json(data, status=200):
+    if orjson is not None:
+        body = orjson.dumps(data)
+        return current_app.response_class(
+            body, status=status, mimetype='application/json')
+
+    response = current_app.json.response(data)
+    response.status_code = status
+    return response
+
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+    return _json(dict(error=error.description), error.code)
+
+
+##############################################################################
+# Serializing
+
+
+def _timestamp(value):
+    return value.isoformat() + 'Z'
+
+
+def _users(where, fields, order_by=()):
+    """Dicts of `fields` for active users matching `where`, one SELECT."""
+
+    columns = [getattr(User, field) for field in fields]
+    rows = db.session.execute(select(*columns)
+                              .where(where)
+                              .where(User.deleted_at.is_(None))
+                              .order_by(*order_by))
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _messages(messages, fields, user_fields, liked_ids=None):
+    """Dicts of `fields` for ORM messages (with authors loaded).
+
+    Messages by deleted users not yet purged are left out.
+    """
+
+    out = []
+    for msg in messages:
+        if msg.user.deleted_at is not None:
+            continue
+        item = {}
+        for field in fields:
+            if field == 'user':
+                author = msg.user
+                item['user'] = {name: getattr(author, name)
+                                for name in user_fields}
+            elif field == 'liked':
+                item['liked'] = msg.id in liked_ids
+            elif field == 'timestamp':
+                item['timestamp'] = _timestamp(msg.timestamp)
+            else:
+                item[field] = getattr(msg, field)
+        out.append(item)
+    return out
+
+
+def _message_page(page, fields_param='fields'):
+    """Messages of a Page, and the viewer's like state if asked for."""
+
+    fields = _fields(fields_param, MESSAGE_FIELDS, MESSAGE_FIELDS)
+    user_fields = _fields('user_fields', USER_FIELDS, USER_SUMMARY_FIELDS)
+
+    liked_ids = None
+    if 'liked' in fields:
+        liked_ids = (g.user.liked_ids_among(msg.id for msg in page)
+                     if g.user else set())
+
+    return dict(messages=_messages(page, fields, user_fields, liked_ids),
+                next=page.next_cursor, prev=page.prev_cursor)
+
+
+def _profile_messages(user_id):
+    direction, key = cursor_from_request()
+    return paginate(Message
+                    .query
+                    .filter(Message.user_id == user_id),
+                    Message.timestamp, Message.id,
+                    direction=direction, key=key, limit=_limit())
+
+
+##############################################################################
+# Endpoints
+
+
+@api.route('/timeline')
+@read_only
+def timeline_page():
+    """The viewer's home feed."""
+
+    viewer = _viewer()
+    direction, key = cursor_from_request()
+    page = timeline.home_feed(viewer.id, direction=direction, key=key,
+                              limit=_limit())
+    return _json(_message_page(page))
+
+
+@api.route('/users/<int:user_id>')
+@read_only
+def user_profile(user_id):
+    """A profile with its counts and first page of messages.
+
+    `fields` are the user's, `message_fields` the messages'. `following`
+    says whether the viewer follows them (null when logged out).
+    """
+
+    fields = _fields('fields', USER_FIELDS, USER_FIELDS)
+    found = _users(User.id == user_id, fields)
+    if not found:
+        raise NotFound(f"No user {user_id}.")
+
+    following = Follows.exists(g.user.id, user_id) if g.user else None
+    return _json(dict(user=found[0], following=following,
+                      **_message_page(_profile_messages(user_id),
+                                      'message_fields')))
+
+
+@api.route('/users/<int:user_id>/messages')
+@read_only
+def user_messages(user_id):
+    """More of a profile's messages."""
+
+    return _json(_message_page(_profile_messages(user_id)))
+
+
+@api.route('/users')
+@read_only
+def users_lookup():
+    """Many users by id, in the order asked for; unknown ids are left out."""
+
+    ids = _ids('ids')
+    fields = _fields('fields', USER_FIELDS, USER_SUMMARY_FIELDS)
+    # the id is needed to put rows in order, even if not asked for
+    selected = fields if 'id' in fields else ('id',) + fields
+
+    by_id = {user['id']: user for user in _users(User.id.in_(ids), selected)}
+    users = [by_id[id] for id in ids if id in by_id]
+    if selected is not fields:
+        for user in users:
+            del user['id']
+    return _json(dict(users=users))
+
+
+@api.route('/likes')
+@read_only
+def like_state():
+    """Which of `message_ids` the viewer likes, as {"<id>": bool}."""
+
+    viewer = _viewer()
+    ids = _ids('message_ids')
+    liked = viewer.liked_ids_among(ids) if ids else set()
+    return _json(dict(liked={str(id): id in liked for id in ids}))
+
+
+def _follow_page(user_id, own_column, other_column):
+    fields = _fields('fields', USER_FIELDS, USER_SUMMARY_FIELDS)
+    after = request.args.get('after', 0, type=int)
+    limit = _limit()
+
+    # walks the (own, other) index in order of the other user's id
+    ids = db.session.scalars(
+        select(other_column)
+        .where(own_column == user_id)
+        .where(other_column > after)
+        .order_by(other_column)
+        .limit(limit + 1)).all()
+    more = len(ids) > limit
+    ids = ids[:limit]
+
+    users = _users(User.id.in_(ids), fields, order_by=[User.id])
+    return _json(dict(users=users, next=ids[-1] if more else None))
+
+
+@api.route('/users/<int:user_id>/following')
+@read_only
+def user_following(user_id):
+    """Users `user_id` follows, by id."""
+
+    return _follow_page(user_id, Follows.user_following_id,
+                        Follows.user_being_followed_id)
+
+
+@api.route('/users/<int:user_id>/followers')
+@read_only
+def user_followers(user_id):
+    """Users following `user_id`, by id."""
+
+    return _follow_page(user_id, Follows.user_being_followed_id,
+                        Follows.user_following_id)
@@ -1,42 +1,98 @@
-import os
-
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Blueprint, Flask, abort, current_app, render_template,
+                   request, flash, redirect, session, g, jsonify, url_for)
+from sqlalchemy import func, select
 from sqlalchemy.exc import IntegrityError
-import pdb
-
+from sqlalchemy.orm import joinedload
+
+import api
+import config
+import counters
+import deletion
+import fragments
+import graph
+import hashing
+import http_cache
+import instrumentation
+import live
+import migrations
+import query_plans
+import recommendations
+import replicas
+import search
+import timeline
+import trending
+import user_cache
+import write_queue
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
+from hashing import HasherBusy
 from models import db, connect_db, User, Message, Likes, Follows
+from pagination import cursor_from_request, paginate
+from replicas import read_only
+from signals import (message_deleted, message_posted, profile_updated,
+                     user_created)
+from user_cache import CURR_USER_KEY, CurrentUser, UserGone
+
+bp = Blueprint('warbler', __name__)
+
+
+def create_app(profile=None, **settings):
+    """Build the app for `profile` (default: the WARBLER_ENV variable).
+
+    See config.py for the profiles; `settings` override the profile's.
+    """
 
-CURR_USER_KEY = "curr_user"
+    app = Flask(__name__)
+    app.config.from_object(config.get_profile(profile))
+    app.config.update(settings)
 
-app = Flask(__name__)
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+    replicas.init_app(app)
+    connect_db(app)
+    instrumentation.init_app(app)
+    hashing.init_app(app)
+    http_cache.init_app(app)
+    timeline.init_app(app)
+    live.init_app(app)
+    counters.init_app(app)
+    deletion.init_app(app)
+    user_cache.init_app(app)
+    fragments.init_app(app)
+    graph.init_app(app)
+    trending.init_app(app)
+    search.init_app(app)
+    migrations.init_app(app)
+    query_plans.init_app(app)
+    recommendations.init_app(app)
+    write_queue.init_app(app)
+    api.init_app(app)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-# app.config['DEBUG_TB_ENABLED'] = False
-toolbar = DebugToolbarExtension(app)
+    app.register_blueprint(bp)
+    return app
 
-connect_db(app)
+
+def _sender():
+    """The app, as the sender of model signals."""
+
+    return current_app._get_current_object()
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a lazy CurrentUser: it runs no query until something reads
+    it, and identity fields usually come from the cross-request cache.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = CurrentUser(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -55,7 +111,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -77,9 +133,11 @@ def signup():
                 email=form.email.data,
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
+            user_created.send(_sender(), user=user)
             db.session.commit()
 
         except IntegrityError:
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
@@ -91,7 +149,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -102,6 +160,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate() may have upgraded an outdated hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -111,7 +171,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
     if g.user:
@@ -125,101 +185,236 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
+@read_only
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username;
+    results are ranked by the search backend. Without 'q', users are
+    listed by id. Either way pages go on with ?after=<id of the last one>.
     """
 
-    search = request.args.get('q')
-
-    if not search:
-        users = User.query.all()
+    search_term = request.args.get('q')
+    per_page = current_app.config['USERS_PAGE_SIZE']
+    next_url = None
+
+    if not search_term:
+        after = request.args.get('after', 0, type=int)
+        users = (User
+                 .active()
+                 .filter(User.id > after)
+                 .order_by(User.id)
+                 .limit(per_page + 1)
+                 .all())
+        if len(users) > per_page:
+            users = users[:per_page]
+            next_url = url_for('.list_users', after=users[-1].id)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        results = search.get_backend().search(
+            search_term, after=request.args.get('after', type=int),
+            per_page=per_page)
+        users = results.users
+        if results.next_after is not None:
+            next_url = url_for('.list_users', q=search_term,
+                               after=results.next_after)
+
+    following_ids = (g.user.following_ids_among(user.id for user in users)
+                     if g.user else set())
+    return render_template('users/index.html', users=users,
+                           following_ids=following_ids, next_url=next_url)
+
+
+@bp.route('/users/suggestions')
+@read_only
+def suggested_users():
+    """People the logged-in user might follow.
+
+    From `flask recommend-follows`, or the live follow graph for users it
+    hasn't reached yet.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    per_page = current_app.config['USERS_PAGE_SIZE']
+    users = (recommendations.suggestions_for(g.user.id, per_page)
+             or graph.suggested_users(g.user.id, limit=per_page))
+    return render_template('users/index.html', users=users,
+                           following_ids=set(), next_url=None)
 
-    return render_template('users/index.html', users=users)
 
+@bp.route('/users/autocomplete')
+def autocomplete_users():
+    """JSON list of users whose username starts with the 'q' param."""
 
-@app.route('/users/<int:user_id>')
+    prefix = request.args.get('q', '').strip()
+    if not prefix:
+        return jsonify([])
+
+    matches = search.get_backend().autocomplete(
+        prefix, limit=current_app.config['AUTOCOMPLETE_LIMIT'])
+    return jsonify([dict(id=user_id, username=username, image_url=image_url)
+                    for user_id, username, image_url in matches])
+
+
+@bp.route('/users/<int:user_id>')
+@read_only
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    not_modified = http_cache.conditional(
+        user.id, user.updated_at,
+        g.user and Follows.exists(g.user.id, user.id),
+        last_modified=user.updated_at)
+    if not_modified:
+        return not_modified
+
+    direction, key = cursor_from_request()
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
-
-
-@app.route('/users/<int:user_id>/following')
+    page = paginate(Message.query.filter(Message.user_id == user_id),
+                    Message.timestamp, Message.id,
+                    direction=direction, key=key,
+                    limit=current_app.config['FEED_PAGE_SIZE'])
+    return render_template('users/show.html', user=user,
+                           messages=page.items, page=page)
+
+
+def _follow_list_page(query, endpoint, user_id):
+    """One page of `query` (users), by id, paged with ?after=<id> like
+    /users. Returns (users, next_url)."""
+
+    per_page = current_app.config['USERS_PAGE_SIZE']
+    after = request.args.get('after', 0, type=int)
+    users = (query
+             .filter(User.id > after)
+             .order_by(User.id)
+             .limit(per_page + 1)
+             .all())
+    next_url = None
+    if len(users) > per_page:
+        users = users[:per_page]
+        next_url = url_for(endpoint, user_id=user_id, after=users[-1].id)
+    return users, next_url
+
+
+@bp.route('/users/<int:user_id>/following')
+@read_only
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following, a page at a time."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
-
-
-@app.route('/users/<int:user_id>/followers')
+    user = User.active().filter_by(id=user_id).first_or_404()
+    users, next_url = _follow_list_page(
+        User.active()
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user.id),
+        '.show_following', user.id)
+    following_ids = g.user.following_ids_among(u.id for u in users)
+    return render_template('users/following.html', user=user, users=users,
+                           following_ids=following_ids, next_url=next_url)
+
+
+@bp.route('/users/<int:user_id>/followers')
+@read_only
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user, a page at a time."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    users, next_url = _follow_list_page(
+        User.active()
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user.id),
+        '.users_followers', user.id)
+    following_ids = g.user.following_ids_among(u.id for u in users)
+    return render_template('users/followers.html', user=user, users=users,
+                           following_ids=following_ids, next_url=next_url)
+
+
+def _fetched():
+    """How a like / follow action was asked for: 'json' (Accept:
+    application/json), 'fragment' (X-Requested-With: fetch) or None for a
+    plain form post."""
+
+    if request.accept_mimetypes.best_match(
+            ['text/html', 'application/json']) == 'application/json':
+        return 'json'
+    if request.headers.get('X-Requested-With') == 'fetch':
+        return 'fragment'
+    return None
+
+
+def _follow_response(followed_id, following):
+    """Answer a follow / unfollow: the new state as JSON or as the follow
+    button, or else a redirect to the following page."""
+
+    fetched = _fetched()
+    if fetched == 'json':
+        # written by now unless WRITE_QUEUE is 'async'
+        followers_count = db.session.scalar(
+            select(User.followers_count).where(User.id == followed_id))
+        return jsonify(user_id=followed_id, following=following,
+                       followers_count=followers_count)
+    if fetched == 'fragment':
+        return render_template('users/follow_button.html',
+                               user_id=followed_id, following=following)
+    return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
     if not g.user:
+        if _fetched():
+            abort(401)
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    followed_id = User.active().filter_by(id=follow_id).first_or_404().id
+    write_queue.set_follow(g.user.id, followed_id)
 
-    return redirect(f"/users/{g.user.id}/following")
+    return _follow_response(followed_id, True)
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
     if not g.user:
+        if _fetched():
+            abort(401)
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    followed_id = User.active().filter_by(id=follow_id).first_or_404().id
+    write_queue.set_follow(g.user.id, followed_id, following=False)
 
-    return redirect(f"/users/{g.user.id}/following")
+    return _follow_response(followed_id, False)
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
     if g.user:
-        user = db.session.query(User).filter(User.id == g.user.id).first()
+        user = g.user.load()
         form = UserEditForm(obj = user)
         if form.validate_on_submit():
+            if not user.check_password(form.password.data):
+                form.password.errors.append('password is invalid')
+                flash('incorrect password', 'danger')
+                return redirect('/')
             user.username = form.username.data
             user.email = form.email.data
             user.header_image_url = form.image_url.data
@@ -227,11 +422,7 @@ def profile():
             user.bio = user.bio if user.bio else None
             user.location = form.location.data
             user.location = user.location if user.location else None
-            authentication = User.authenticate(user.username, form.password.data)
-            if authentication == False:
-                form.password.errors.append('password is invalid')
-                flash('incorrect password', 'danger')
-                return redirect('/')
+            profile_updated.send(_sender(), user=user)
             db.session.commit()
             return redirect(f'/users/{user.id}')
         return render_template("users/edit.html", form=form, user=user)
@@ -246,7 +437,7 @@ def profile():
     # IMPLEMENT THIS
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -256,8 +447,9 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    deletion.tombstone(g.user.load())
     db.session.commit()
+    deletion.purge_later(g.user.id)
 
     return redirect("/signup")
 
@@ -265,7 +457,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -281,6 +473,7 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        message_posted.send(_sender(), user=g.user, message=msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -288,60 +481,137 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=['GET'])
+@bp.route('/messages/trending')
+@read_only
+def messages_trending():
+    """Show the most liked messages lately."""
+
+    ids = trending.tracker().top(current_app.config['TRENDING_PAGE_SIZE'])
+    found = {msg.id: msg
+             for msg in Message.active().filter(Message.id.in_(ids))}
+    messages = [found[message_id] for message_id in ids
+                if message_id in found]
+
+    liked_ids = (g.user.liked_ids_among(msg.id for msg in messages)
+                 if g.user else None)
+    return render_template('messages/trending.html', messages=messages,
+                           liked_ids=liked_ids)
+
+
+@bp.route('/messages/<int:message_id>', methods=['GET'])
+@read_only
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = Message.active().filter(Message.id == message_id).first_or_404()
+    author = msg.user
+    not_modified = http_cache.conditional(
+        msg.id, author.updated_at,
+        g.user and Follows.exists(g.user.id, author.id),
+        last_modified=max(msg.timestamp, author.updated_at))
+    if not_modified:
+        return not_modified
+
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
-    """Delete a message."""
+    """Delete a message, if it's the logged-in user's own."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
+    msg = Message.query.get_or_404(message_id)
+    if msg.user_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    message_deleted.send(_sender(), user=g.user, message=msg)
     db.session.delete(msg)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}")
 ##############################################################################
 #LIKES
-@app.route('/users/<message_id>/add-like', methods=['POST'])
+def _like_response(message_id, liked):
+    """Answer a like / unlike: the new state as JSON or as the like
+    button, or else a redirect home."""
+
+    fetched = _fetched()
+    if fetched == 'json':
+        # written by now unless WRITE_QUEUE is 'async'
+        likes_count = db.session.scalar(
+            select(func.count()).where(Likes.message_id == message_id))
+        return jsonify(message_id=message_id, liked=liked,
+                       likes_count=likes_count)
+    if fetched == 'fragment':
+        # the button only needs the id; the committed Message would be
+        # reloaded just to read it
+        return render_template('messages/like_button.html',
+                               msg=dict(id=message_id),
+                               liked_ids={message_id} if liked else set())
+    return redirect('/')
+
+
+@bp.route('/users/<message_id>/add-like', methods=['POST'])
 def add_like(message_id):
     """Add a new like based on logged user to specified message"""
-    message = Message.query.get_or_404(message_id)
-    user = db.session.query(User).filter(User.id == g.user.id).first()
-    
-    new_like = Likes(user_id = user.id, message_id = message.id)
-    db.session.add(new_like)
-    db.session.commit()
-    user.likes.append(new_like.messages)
-    db.session.commit()
-    return redirect('/')
 
-@app.route('/users/<message_id>/un-like', methods=['POST'])
+    if not g.user:
+        if _fetched():
+            abort(401)
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    message_id = (Message.active().filter(Message.id == message_id)
+                  .first_or_404().id)
+    write_queue.set_like(g.user.id, message_id)
+    return _like_response(message_id, True)
+
+@bp.route('/users/<message_id>/un-like', methods=['POST'])
 def unlike(message_id):
     """removes like from user"""
-    message = db.session.query(Message).get(message_id)
-    user = User.query.get(g.user.id)
-    like = db.session.query(Message).filter(Message.id == message_id).first()
-    
-    # db.session.delete(like)
-    user.likes.remove(message)
-    db.session.commit()
-    return redirect('/')
+
+    if not g.user:
+        if _fetched():
+            abort(401)
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    message_id = (Message.active().filter(Message.id == message_id)
+                  .first_or_404().id)
+    write_queue.set_like(g.user.id, message_id, liked=False)
+    return _like_response(message_id, False)
     
-@app.route('/users/<user_id>/likes')
+@bp.route('/users/<user_id>/likes')
+@read_only
 def likes(user_id):
     """shows list of likes"""
-    user = User.query.get(user_id)
-    likes = user.likes
-    return render_template('users/likes.html', likes=likes, user=user, messages=likes)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    direction, key = cursor_from_request()
+
+    # deleted authors' messages are left out before the page is cut; as
+    # NOT EXISTS, so users is only probed by id and never drives the plan
+    liked = (Message
+             .query
+             .options(joinedload(Message.user))
+             .join(Likes, Likes.message_id == Message.id)
+             .filter(Likes.user_id == user.id)
+             .filter(~Message.user.has(User.deleted_at.isnot(None))))
+    page = paginate(liked, Message.timestamp, Message.id,
+                    direction=direction, key=key,
+                    limit=current_app.config['FEED_PAGE_SIZE'])
+
+    following_ids, liked_ids = set(), set()
+    if g.user:
+        following_ids = g.user.following_ids_among(m.user_id for m in page)
+        liked_ids = g.user.liked_ids_among(m.id for m in page)
+
+    return render_template('users/likes.html', likes=page.items, user=user,
+                           messages=page.items, page=page,
+                           following_ids=following_ids, liked_ids=liked_ids)
 
 
 
@@ -349,44 +619,108 @@ def likes(user_id):
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
+@read_only
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time,
+      and who-to-follow suggestions
     """
 
     if g.user:
-        user = db.session.query(User).filter(User.id == g.user.id).first()
-        following = [user.id for user in user.following]
-            
-        messages = (db.session
-                    .query(Message)
-                    .filter((Message.user_id == g.user.id)| (Message.user_id.in_(following)))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        direction, key = cursor_from_request()
+
+        page = timeline.home_feed(g.user.id, direction=direction, key=key,
+                                  limit=current_app.config['FEED_PAGE_SIZE'])
+
+        liked_ids = g.user.liked_ids_among(msg.id for msg in page)
+        # only the newest page grows
+        live_cursor = (live.start_cursor(page)
+                       if key is None
+                       and current_app.config['LIVE_UPDATES'] != 'off'
+                       else None)
+        return render_template('home.html', messages=page.items, page=page,
+                               liked_ids=liked_ids, live_cursor=live_cursor,
+                               suggested=graph.suggested_users(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
 
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+@bp.route('/timeline/updates')
+@read_only
+def timeline_updates():
+    """JSON of the home feed's messages newer than the 'after' cursor."""
+
+    if not g.user:
+        abort(401)
+    try:
+        return jsonify(live.delta(g.user, request.args.get('after', '')))
+    except ValueError:
+        abort(400)
+
+
+@bp.route('/timeline/stream')
+def timeline_stream():
+    """Server-Sent Events of the home feed's new messages.
+
+    Starts after the Last-Event-ID header's cursor when reconnecting, else
+    the 'after' param's. Reads the primary: streams are woken by commits
+    there, which a replica may not have yet.
+    """
+
+    if not g.user:
+        abort(401)
+    if current_app.config['LIVE_UPDATES'] != 'sse':
+        abort(404)
+    cursor = (request.headers.get('Last-Event-ID')
+              or request.args.get('after', ''))
+    try:
+        return live.stream(g.user, cursor)
+    except ValueError:
+        abort(400)
+
+
+@bp.app_errorhandler(UserGone)
+def user_gone(error):
+    """The logged-in account was deleted elsewhere: log it out."""
+
+    do_logout()
+    flash("Your account no longer exists.", "danger")
+    return redirect("/")
+
+
+@bp.app_errorhandler(HasherBusy)
+def hasher_busy(error):
+    """Shed sign-up/log-in load while the password hashing pool is full."""
+
+    return ("Too many sign-ins right now, please try again shortly.", 503,
+            {'Retry-After': '1'})
+
+
+@bp.app_errorhandler(live.TooManyStreams)
+def too_many_streams(error):
+    """Turn streams away past LIVE_MAX_STREAMS; the page polls instead."""
+
+    return ("Too many live streams right now.", 503, {'Retry-After': '30'})
+
+
+@bp.app_errorhandler(write_queue.QueueFull)
+def write_queue_full(error):
+    """Shed likes and follows while the write queue is backed up."""
+
+    return ("Too busy right now, please try again shortly.", 503,
+            {'Retry-After': '1'})
+
+
+@bp.app_errorhandler(write_queue.NotWritten)
+def write_not_written(error):
+    """Don't claim a like or follow was saved when its batch wasn't."""
+
+    return ("Couldn't save that just now, please try again.", 503,
+            {'Retry-After': '1'})
+
+
+app = create_app()
@@ -0,0 +1,77 @@
+"""Microbenchmark: password checks (logins) per second per core.
+
+Runs `User.authenticate`'s expensive part -- a bcrypt check -- through the
+shared hasher from many client threads at once, for a range of pool sizes,
+and reports throughput overall and per pool thread.
+
+    python benchmarks/bench_hashing.py --rounds 12 --seconds 5
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hashing import HasherBusy, PasswordHasher  # noqa: E402
+
+
+def run(rounds, workers, clients, seconds):
+    hasher = PasswordHasher(rounds=rounds, workers=workers,
+                            queue_timeout=seconds)
+    pw_hash = hasher.hash('correct horse')
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        done = busy = 0
+        while time.perf_counter() < deadline:
+            try:
+                hasher.check(pw_hash, 'correct horse')
+                done += 1
+            except HasherBusy:
+                busy += 1
+        return done, busy
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda _: client(), range(clients)))
+    elapsed = time.perf_counter() - start
+
+    logins = sum(done for done, _ in results)
+    return dict(
+        rounds=rounds,
+        workers=workers,
+        clients=clients,
+        seconds=round(elapsed, 3),
+        logins=logins,
+        rejected=sum(busy for _, busy in results),
+        logins_per_sec=round(logins / elapsed, 2),
+        logins_per_sec_per_core=round(logins / elapsed / workers, 2),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=12,
+                        help='bcrypt cost (BCRYPT_LOG_ROUNDS)')
+    parser.add_argument('--seconds', type=float, default=3.0,
+                        help='duration of each run')
+    parser.add_argument('--max-workers', type=int,
+                        default=os.cpu_count() or 1,
+                        help='largest pool size to try')
+    parser.add_argument('--clients', type=int, default=32,
+                        help='concurrent callers (simulated request threads)')
+    args = parser.parse_args()
+
+    workers = 1
+    while workers <= args.max_workers:
+        print(json.dumps(run(args.rounds, workers, args.clients,
+                             args.seconds)))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
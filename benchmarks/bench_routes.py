@@ -0,0 +1,358 @@
+"""Load test: latency, throughput and query counts for the main pages.
+
+Seeds a generated dataset of the requested size into SQLite or a local
+PostgreSQL database, then drives the real app -- in process through
+`app.test_client()`, or over HTTP against a local gunicorn -- and reports
+p50/p95/p99 latency, requests per second and SQL queries per request for
+each route. Results go to a JSON file; pass an earlier one as --compare
+to see what changed between commits.
+
+    python benchmarks/bench_routes.py --users 2000 --follows 40000
+    python benchmarks/bench_routes.py --database-url postgresql:///warbler-bench \\
+        --server gunicorn --concurrency 8 --output after.json --compare before.json
+
+Query counts are only available in process (--server client).
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# (name, method, path); {user_id} is the page's user, not the viewer
+ROUTES = [
+    ('home', 'GET', '/'),
+    ('users', 'GET', '/users'),
+    ('user_show', 'GET', '/users/{user_id}'),
+    ('followers', 'GET', '/users/{user_id}/followers'),
+    ('following', 'GET', '/users/{user_id}/following'),
+    ('likes', 'GET', '/users/{user_id}/likes'),
+    ('post_message', 'POST', '/messages/new'),
+]
+
+_CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+##############################################################################
+# Dataset
+
+
+def seed_dataset(args):
+    """Generate CSVs of the requested size and load them."""
+
+    import seed
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'generator', 'create_csvs.py'),
+             '--users', str(args.users), '--messages', str(args.messages),
+             '--follows', str(args.follows), '--likes', str(args.likes),
+             '--seed', str(args.seed), '--offline', '--out-dir', data_dir],
+            check=True, stdout=subprocess.DEVNULL)
+        started = time.perf_counter()
+        seed.seed(data_dir)
+        return round(time.perf_counter() - started, 3)
+
+
+def sample_users(rng, count):
+    """(id, username) of `count` random users to view and log in as."""
+
+    from sqlalchemy import select
+    from models import db, User
+
+    rows = db.session.execute(select(User.id, User.username)).all()
+    return [tuple(row) for row in rng.sample(rows, min(count, len(rows)))]
+
+
+##############################################################################
+# Drivers: each returns a function that makes one request and returns
+# (status, queries or None)
+
+
+class ClientDriver:
+    """Requests through the Flask test client, counting SQL statements."""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from app import app
+        from models import db
+
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.app = app
+        self.queries = 0
+
+        def count(*_):
+            self.queries += 1
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+
+    def session(self, user_id, username):
+        from user_cache import CURR_USER_KEY
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+
+        def request(method, path, data=None):
+            before = self.queries
+            resp = client.open(path, method=method, data=data)
+            return resp.status_code, self.queries - before
+
+        return request
+
+    def close(self):
+        pass
+
+
+class GunicornDriver:
+    """Requests over HTTP against a gunicorn started for the run."""
+
+    def __init__(self, database_url, workers, threads):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+        env = dict(os.environ, DATABASE_URL=database_url)
+        env.setdefault('SECRET_KEY', 'benchmark')
+        self.process = subprocess.Popen(
+            ['gunicorn', '--chdir', ROOT,
+             '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+             '--workers', str(workers),
+             '--threads', str(threads), '--bind', f'127.0.0.1:{self.port}',
+             '--log-level', 'warning', 'app:app'],
+            env=env)
+        self._wait_until_up()
+
+    def _wait_until_up(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 0.2).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise SystemExit("gunicorn did not start")
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    def session(self, user_id, username):
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+        def send(method, path, data=None):
+            body = urllib.parse.urlencode(data).encode() if data else None
+            try:
+                with opener.open(urllib.request.Request(
+                        self.url(path), data=body, method=method)) as resp:
+                    return resp.status, resp.read().decode(), resp.url
+            except urllib.error.HTTPError as exc:
+                return exc.code, '', exc.url
+
+        def csrf_token(path):
+            _, html, _ = send('GET', path)
+            match = _CSRF_TOKEN.search(html)
+            return match.group(1) if match else ''
+
+        # every generated user's password is "password"
+        status, _, landed = send('POST', '/login', dict(
+            username=username, password='password',
+            csrf_token=csrf_token('/login')))
+        if landed.endswith('/login'):
+            raise SystemExit(f"Could not log in as {username} ({status})")
+
+        def request(method, path, data=None):
+            if method == 'POST':
+                data = dict(data, csrf_token=csrf_token(path))
+            status, _, _ = send(method, path, data)
+            return status, None
+
+        return request
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+##############################################################################
+# Measuring
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+
+def run_route(driver, method, path, users, requests, concurrency, rng):
+    """Make `requests` requests spread over `concurrency` logged-in users."""
+
+    sessions = [driver.session(*rng.choice(users)) for _ in range(concurrency)]
+    jobs = [(sessions[i % concurrency],
+             path.format(user_id=rng.choice(users)[0]),
+             dict(text=f"benchmark message {i}") if method == 'POST' else None)
+            for i in range(requests)]
+
+    def one(job):
+        session, url, data = job
+        started = time.perf_counter()
+        status, queries = session(method, url, data)
+        return time.perf_counter() - started, status, queries
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        results = [one(job) for job in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, jobs))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _, _ in results)
+    queries = [count for _, _, count in results if count is not None]
+    return dict(
+        requests=len(results),
+        errors=sum(1 for _, status, _ in results if status >= 400),
+        p50_ms=round(percentile(latencies, 50), 2),
+        p95_ms=round(percentile(latencies, 95), 2),
+        p99_ms=round(percentile(latencies, 99), 2),
+        throughput_rps=round(len(results) / elapsed, 1),
+        queries_per_request=(round(sum(queries) / len(queries), 2)
+                             if queries else None),
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, report):
+    """Print each route's p95 and throughput change against `baseline`."""
+
+    print(f"\n{'route':<14}{'p95 ms':>20}{'req/s':>22}")
+    for name, now in report['routes'].items():
+        was = baseline['routes'].get(name)
+        if not was:
+            continue
+
+        def change(key):
+            if not was[key]:
+                return ''
+            return f"{(now[key] - was[key]) / was[key]:+.0%}"
+
+        print(f"{name:<14}"
+              f"{was['p95_ms']:>8} -> {now['p95_ms']:<7}{change('p95_ms'):>5}"
+              f"{was['throughput_rps']:>8} -> {now['throughput_rps']:<7}"
+              f"{change('throughput_rps'):>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None,
+                        help='database to seed and benchmark (default: a '
+                             'temporary SQLite file)')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='benchmark the database as it is')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='concurrent logged-in clients')
+    parser.add_argument('--server', choices=['client', 'gunicorn'],
+                        default='client')
+    parser.add_argument('--gunicorn-workers', type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument('--gunicorn-threads', type=int, default=1)
+    parser.add_argument('--routes', default=','.join(name for name, _, _ in ROUTES),
+                        help='comma-separated route names to run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_routes.json')
+    parser.add_argument('--compare', default=None,
+                        help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url is None:
+        scratch = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(scratch.name, 'bench.db')}"
+    # read by app at import
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from app import app
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        seed_seconds = None if args.no_seed else seed_dataset(args)
+        users = sample_users(rng, 500)
+
+    if args.server == 'gunicorn':
+        driver = GunicornDriver(args.database_url, args.gunicorn_workers,
+                                args.gunicorn_threads)
+    else:
+        driver = ClientDriver()
+
+    wanted = args.routes.split(',')
+    results = {}
+    try:
+        for name, method, path in ROUTES:
+            if name not in wanted:
+                continue
+            # warm caches and connections before timing
+            run_route(driver, method, path, users, 5, 1, rng)
+            results[name] = run_route(driver, method, path, users,
+                                      args.requests, args.concurrency, rng)
+            print(f"{name:<14}{json.dumps(results[name])}")
+    finally:
+        driver.close()
+
+    report = dict(
+        commit=git_commit(),
+        created=datetime.utcnow().isoformat(timespec='seconds'),
+        config=dict(database=args.database_url.split(':')[0],
+                    server=args.server, users=args.users,
+                    messages=args.messages, follows=args.follows,
+                    likes=args.likes, requests=args.requests,
+                    concurrency=args.concurrency, seed_seconds=seed_seconds,
+                    timeline_fanout=app.config['TIMELINE_FANOUT']),
+        routes=results,
+    )
+    with open(args.output, 'w') as out:
+        json.dump(report, out, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), report)
+
+    if scratch is not None:
+        scratch.cleanup()
+
+
+if __name__ == '__main__':
+    main()
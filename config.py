@@ -0,0 +1,114 @@
+"""Configuration profiles, chosen with the WARBLER_ENV variable.
+
+- development (default): debug toolbar available, and an app context
+  left pushed so `ipython -i app.py` sessions can query straight away.
+- testing: like development, with no toolbar.
+- production: no toolbar, no global app context (each request gets its
+  own, so g and the DB session never outlive a request), an explicitly
+  sized connection pool, and /__metrics only with a METRICS_TOKEN.
+
+Each gunicorn worker holds at most DB_POOL_SIZE + DB_MAX_OVERFLOW
+connections, so the database sees at most WEB_CONCURRENCY times that. With
+PGBOUNCER=1 the app keeps no pool of its own and opens a connection per
+checkout through PgBouncer, which does the pooling.
+"""
+
+import os
+
+from sqlalchemy.pool import NullPool
+
+
+def _env_flag(name, default=False):
+    return os.environ.get(name, '1' if default else '0') == '1'
+
+
+class Config:
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                             'postgresql:///warbler')
+    # read replicas for read-only views (see replicas.py)
+    SQLALCHEMY_REPLICA_URIS = [
+        uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if uri]
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # install flask-debugtoolbar; it only shows when running in debug mode
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    TIMELINE_FANOUT = _env_flag('TIMELINE_FANOUT')
+    FEED_PAGE_SIZE = 100
+    # 'off', 'group' or 'async' (see write_queue.py)
+    WRITE_QUEUE = os.environ.get('WRITE_QUEUE', 'off')
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # purge deleted accounts in the background (see deletion.py)
+    USER_PURGE_IN_BACKGROUND = _env_flag('USER_PURGE_IN_BACKGROUND', True)
+    # build the follow graph off the request path (see graph.py)
+    FOLLOW_GRAPH_BUILD_IN_BACKGROUND = _env_flag(
+        'FOLLOW_GRAPH_BUILD_IN_BACKGROUND', True)
+    # 'sse', 'poll' or 'off' (see live.py)
+    LIVE_UPDATES = os.environ.get('LIVE_UPDATES', 'sse')
+    # /__metrics wants this bearer token; without one it's off unless
+    # METRICS_PUBLIC (see instrumentation.py)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+
+class DevelopmentConfig(Config):
+    DEBUG_TOOLBAR = True
+    METRICS_PUBLIC = True
+
+
+class TestingConfig(Config):
+    # tests purge and build when they want to, not racing a thread
+    USER_PURGE_IN_BACKGROUND = False
+    FOLLOW_GRAPH_BUILD_IN_BACKGROUND = False
+    METRICS_PUBLIC = True
+
+
+class ProductionConfig(Config):
+    # no fallback: sessions fail loudly rather than use a known key
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    TEMPLATES_AUTO_RELOAD = False
+
+    # each open live stream holds a gunicorn thread: only stream with
+    # threads to spare, and keep one for everything else
+    _threads = int(os.environ.get('GUNICORN_THREADS', 1))
+    LIVE_UPDATES = os.environ.get('LIVE_UPDATES',
+                                  'sse' if _threads > 1 else 'poll')
+    LIVE_MAX_STREAMS = max(_threads - 1, 1)
+
+    if _env_flag('PGBOUNCER'):
+        # PgBouncer pools; holding idle connections here would pin its
+        # server connections. psycopg2 sends no server-side prepared
+        # statements, so transaction pooling mode is safe.
+        SQLALCHEMY_ENGINE_OPTIONS = dict(poolclass=NullPool)
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = dict(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 2)),
+            # seconds to wait for a free connection before erroring
+            pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            # replace connections before server/firewall idle timeouts
+            pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            pool_pre_ping=True,
+        )
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_profile(name=None):
+    """The config class for `name`, or for WARBLER_ENV if not given."""
+
+    name = name or os.environ.get('WARBLER_ENV', 'development')
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown WARBLER_ENV profile: {name!r}") from None
@@ -0,0 +1,183 @@
+"""Denormalized message / follow / like counters on User.
+
+Templates used to render `user.followers | length` and friends, which
+loads an entire relationship just to count it. Instead each count lives in
+a column on `users` and is adjusted with an in-database `x = x + 1` from
+the signal receivers below. Routes send those signals before committing,
+so a counter changes in the same transaction as the row it counts.
+
+`flask reconcile-counters` recomputes every counter from the source
+tables, for after bulk loads or if counters ever drift.
+"""
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, or_, select, update
+
+import deletion
+from models import db, Follows, Likes, Message, User
+from signals import (follow_added, follow_removed, like_added, like_removed,
+                     message_deleted, message_posted, user_deleted)
+
+
+def init_app(app):
+    """Register counter signal receivers and the reconcile CLI command."""
+
+    message_posted.connect(_on_message_posted)
+    message_deleted.connect(_on_message_deleted)
+    follow_added.connect(_on_follow_added)
+    follow_removed.connect(_on_follow_removed)
+    like_added.connect(_on_like_added)
+    like_removed.connect(_on_like_removed)
+    user_deleted.connect(_on_user_deleted)
+
+    app.cli.add_command(reconcile_counters_command)
+
+
+def _bump(user_id, **deltas):
+    """Add each of `deltas` (column name -> int) to one user's counters."""
+
+    values = {name: getattr(User, name) + delta
+              for name, delta in deltas.items()}
+    db.session.execute(update(User).where(User.id == user_id).values(values))
+
+
+def _true_counts():
+    """Correlated subqueries computing each counter for the outer user."""
+
+    return dict(
+        messages_count=(select(func.count())
+                        .where(Message.user_id == User.id)
+                        .scalar_subquery()),
+        following_count=(select(func.count())
+                         .where(Follows.user_following_id == User.id)
+                         .scalar_subquery()),
+        followers_count=(select(func.count())
+                         .where(Follows.user_being_followed_id == User.id)
+                         .scalar_subquery()),
+        likes_count=(select(func.count())
+                     .where(Likes.user_id == User.id)
+                     .scalar_subquery()),
+    )
+
+
+def reconcile(batch_size=10000, user_ids=None):
+    """Recompute counters from the source tables.
+
+    Works through users in id ranges of `batch_size`, committing each
+    range, or only `user_ids` if given. Returns how many users had at
+    least one counter that was wrong.
+    """
+
+    counts = _true_counts()
+    drifted = or_(*(getattr(User, name) != true
+                    for name, true in counts.items()))
+
+    if user_ids is not None:
+        result = db.session.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .where(drifted)
+            .values(counts)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
+
+    fixed = 0
+    max_id = db.session.scalar(select(func.max(User.id))) or 0
+
+    for low in range(0, max_id + 1, batch_size):
+        result = db.session.execute(
+            update(User)
+            .where(User.id >= low)
+            .where(User.id < low + batch_size)
+            .where(drifted)
+            .values(counts)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        fixed += result.rowcount
+
+    return fixed
+
+
+@click.command('reconcile-counters')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Users recomputed per transaction.')
+@with_appcontext
+def reconcile_counters_command(batch_size):
+    """Recompute denormalized user counters from messages, follows, likes."""
+
+    # deleted users' rows were already uncounted; purge them first so
+    # they aren't counted back in
+    deletion.purge_deleted()
+    fixed = reconcile(batch_size=batch_size)
+    click.echo(f"Fixed counters for {fixed} users.")
+
+
+##############################################################################
+# Signal receivers
+
+
+def _on_message_posted(app, user, message):
+    _bump(user.id, messages_count=1)
+
+
+def _on_message_deleted(app, user, message):
+    _bump(message.user_id, messages_count=-1)
+
+    # the message's likes are about to go with it
+    likes_of_message = (select(func.count())
+                        .where(Likes.user_id == User.id)
+                        .where(Likes.message_id == message.id)
+                        .scalar_subquery())
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(select(Likes.user_id)
+                           .where(Likes.message_id == message.id)))
+        .values(likes_count=User.likes_count - likes_of_message)
+        .execution_options(synchronize_session=False))
+
+
+def _on_follow_added(app, user, followed):
+    _bump(user.id, following_count=1)
+    _bump(followed.id, followers_count=1)
+
+
+def _on_follow_removed(app, user, followed):
+    _bump(user.id, following_count=-1)
+    _bump(followed.id, followers_count=-1)
+
+
+def _on_like_added(app, user, message):
+    _bump(user.id, likes_count=1)
+
+
+def _on_like_removed(app, user, message):
+    _bump(user.id, likes_count=-1)
+
+
+def _on_user_deleted(app, user):
+    followers = (select(Follows.user_following_id)
+                 .where(Follows.user_being_followed_id == user.id))
+    followed = (select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == user.id))
+    likers = (select(Likes.user_id)
+              .join(Message, Message.id == Likes.message_id)
+              .where(Message.user_id == user.id))
+    likes_of_user = (select(func.count())
+                     .select_from(Likes)
+                     .join(Message, Message.id == Likes.message_id)
+                     .where(Likes.user_id == User.id)
+                     .where(Message.user_id == user.id)
+                     .scalar_subquery())
+
+    for ids, values in (
+            (followers, dict(following_count=User.following_count - 1)),
+            (followed, dict(followers_count=User.followers_count - 1)),
+            (likers, dict(likes_count=User.likes_count - likes_of_user))):
+        db.session.execute(
+            update(User)
+            .where(User.id.in_(ids))
+            .where(User.id != user.id)
+            .values(values)
+            .execution_options(synchronize_session=False))
@@ -0,0 +1,172 @@
+"""Deleting accounts: tombstone now, purge in batches.
+
+`db.session.delete(user)` made the ORM load the user's likes and follows
+into memory, then delete everything the user owned in one transaction,
+which for a prolific account held a worker and a pile of row locks for
+seconds. Instead:
+
+- `tombstone(user)` sets `users.deleted_at` in the request. From then on
+  `User.active()` (lookups, lists, search, the API) skips the user, their
+  messages are left out of cards and the API, and `user_deleted`
+  receivers fix up everyone else's counters and caches.
+- `purge(user_id)` then deletes the user's timeline entries, likes,
+  messages and follows, USER_PURGE_BATCH_SIZE rows per transaction, and
+  the user row last.
+
+With USER_PURGE_IN_BACKGROUND each tombstoned user is purged on a
+background thread straight after the request. Run
+`flask purge-deleted-users` from cron to purge any left behind, e.g. by a
+restart, or all of them when background purging is off.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, select, tuple_
+
+from models import (db, Follows, FollowSuggestion, Likes, Message,
+                    TimelineEntry, User)
+from signals import user_deleted
+
+_executor = None
+_lock = Lock()
+
+
+def init_app(app):
+    """Register deletion config defaults and the purge CLI command."""
+
+    app.config.setdefault('USER_PURGE_BATCH_SIZE', 1000)
+    app.config.setdefault('USER_PURGE_IN_BACKGROUND', True)
+
+    app.cli.add_command(purge_deleted_users_command)
+
+
+def tombstone(user):
+    """Mark `user` deleted. Doesn't commit."""
+
+    user_deleted.send(current_app._get_current_object(), user=user)
+    user.deleted_at = datetime.utcnow()
+
+
+def _delete_batches(model, keys, where, batch_size):
+    """Delete `model` rows matching `where`, `batch_size` per transaction."""
+
+    key = tuple_(*keys) if len(keys) > 1 else keys[0]
+    deleted = 0
+    while True:
+        batch = select(*keys).where(where).limit(batch_size)
+        result = db.session.execute(
+            delete(model)
+            .where(key.in_(batch))
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+def purge(user_id, batch_size=None):
+    """Delete tombstoned `user_id` and everything they own.
+
+    Returns the number of rows deleted; 0 if the user isn't tombstoned.
+    """
+
+    batch_size = batch_size or current_app.config['USER_PURGE_BATCH_SIZE']
+    tombstoned = db.session.scalar(
+        select(User.id)
+        .where(User.id == user_id)
+        .where(User.deleted_at.is_not(None)))
+    if tombstoned is None:
+        return 0
+
+    # messages go last among the user's own rows: their likes and timeline
+    # entries would otherwise be deleted by ON DELETE CASCADE all at once
+    authored = select(Message.id).where(Message.user_id == user_id)
+    timeline_key = (TimelineEntry.user_id, TimelineEntry.message_id)
+    follow_key = (Follows.user_following_id, Follows.user_being_followed_id)
+    suggestion_key = (FollowSuggestion.user_id, FollowSuggestion.suggested_id)
+    steps = [
+        (TimelineEntry, timeline_key,
+         TimelineEntry.message_id.in_(authored)),
+        (TimelineEntry, timeline_key, TimelineEntry.user_id == user_id),
+        (Likes, (Likes.id,), Likes.message_id.in_(authored)),
+        (Likes, (Likes.id,), Likes.user_id == user_id),
+        (Message, (Message.id,), Message.user_id == user_id),
+        (Follows, follow_key, Follows.user_following_id == user_id),
+        (Follows, follow_key, Follows.user_being_followed_id == user_id),
+        (FollowSuggestion, suggestion_key,
+         FollowSuggestion.user_id == user_id),
+        (FollowSuggestion, suggestion_key,
+         FollowSuggestion.suggested_id == user_id),
+    ]
+
+    deleted = sum(_delete_batches(model, keys, where, batch_size)
+                  for model, keys, where in steps)
+
+    # anything added meanwhile goes with the user, by ON DELETE CASCADE
+    result = db.session.execute(
+        delete(User)
+        .where(User.id == user_id)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    return deleted + result.rowcount
+
+
+def purge_deleted(batch_size=None):
+    """Purge every tombstoned user. Returns how many were purged."""
+
+    user_ids = db.session.scalars(
+        select(User.id).where(User.deleted_at.is_not(None))).all()
+    for user_id in user_ids:
+        purge(user_id, batch_size)
+    return len(user_ids)
+
+
+def _pool():
+    # one thread: purges are background work, and one at a time keeps
+    # them from competing with requests for connections
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix='purge')
+        return _executor
+
+
+def _purge_in_context(app, user_id):
+    with app.app_context():
+        try:
+            return purge(user_id)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Purging user %d failed", user_id)
+            raise
+
+
+def purge_later(user_id):
+    """Purge tombstoned `user_id` on the background thread, if enabled.
+
+    Returns a Future of purge's result, or None.
+    """
+
+    app = current_app._get_current_object()
+    if not app.config['USER_PURGE_IN_BACKGROUND']:
+        return None
+    return _pool().submit(_purge_in_context, app, user_id)
+
+
+@click.command('purge-deleted-users')
+@click.option('--batch-size', default=None, type=int,
+              help='Rows deleted per transaction '
+                   '[default: USER_PURGE_BATCH_SIZE].')
+@with_appcontext
+def purge_deleted_users_command(batch_size):
+    """Delete the rows of accounts deleted but not purged yet."""
+
+    purged = purge_deleted(batch_size=batch_size)
+    click.echo(f"Purged {purged} deleted users.")
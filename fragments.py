@@ -0,0 +1,298 @@
+"""Cache of rendered template fragments: message cards, profile headers.
+
+A feed page renders up to FEED_PAGE_SIZE message cards, each the same
+HTML for every viewer. `message_cards(messages, ...)` and
+`profile_header(user, ...)` are template globals that render a fragment
+once and serve later renders from a cache.
+
+Keys carry a version of everything the fragment shows -- a card the
+message id and its author's username and avatar, a profile header the
+user's updated_at, which counter changes bump too -- along with a hash of
+the templates. So a cached fragment is never out of date, even in a worker
+that didn't see the change. Receivers for message deletes, profile edits,
+follows and likes also drop the affected fragments straight away (from
+this worker's cache, or everyone's with redis), so old versions don't sit
+in the cache waiting for eviction.
+
+Viewer-specific parts stay out of the shared HTML: a card's like button
+is keyed on whether the viewer likes the message, and the profile header
+has a hole its caller's follow / edit `actions` fill in.
+
+FRAGMENT_CACHE_BACKEND picks where fragments live:
+
+- 'memory' (default): a per-process LRU of FRAGMENT_CACHE_SIZE entries.
+- 'redis': a redis (or redis-protocol compatible) server at
+  FRAGMENT_CACHE_URL, shared by every worker; entries expire after
+  FRAGMENT_CACHE_TTL seconds and the server's maxmemory policy evicts.
+  Needs the `redis` package.
+- 'null': no caching.
+"""
+
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+import http_cache
+from signals import (follow_added, follow_removed, like_added, like_removed,
+                     message_deleted, message_posted, profile_updated,
+                     user_deleted)
+
+# where profile_header's `actions` go in the cached HTML
+_ACTIONS_HOLE = Markup('<!--profile-actions-->')
+
+
+def init_app(app):
+    """Set up the fragment cache backend, template globals and receivers."""
+
+    app.config.setdefault('FRAGMENT_CACHE_BACKEND', 'memory')
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 20000)
+    app.config.setdefault('FRAGMENT_CACHE_URL', 'redis://localhost:6379/0')
+    app.config.setdefault('FRAGMENT_CACHE_TTL', 24 * 60 * 60)
+
+    app.extensions['fragments'] = make_backend(app.config)
+
+    app.add_template_global(message_cards)
+    app.add_template_global(profile_header)
+
+    message_deleted.connect(_on_message_deleted)
+    profile_updated.connect(_on_profile_changed)
+    user_deleted.connect(_on_profile_changed)
+    message_posted.connect(_on_counts_changed)
+    like_added.connect(_on_counts_changed)
+    like_removed.connect(_on_counts_changed)
+    follow_added.connect(_on_follow_changed)
+    follow_removed.connect(_on_follow_changed)
+
+
+def make_backend(config):
+    kind = config['FRAGMENT_CACHE_BACKEND']
+    if kind == 'memory':
+        return MemoryBackend(config['FRAGMENT_CACHE_SIZE'])
+    if kind == 'redis':
+        return RedisBackend(config['FRAGMENT_CACHE_URL'],
+                            config['FRAGMENT_CACHE_TTL'])
+    if kind == 'null':
+        return NullBackend()
+    raise ValueError(f"Unknown FRAGMENT_CACHE_BACKEND: {kind!r}")
+
+
+def backend():
+    return current_app.extensions['fragments']
+
+
+##############################################################################
+# Backends
+#
+# Each stores HTML strings under string keys, with tags naming what a
+# fragment shows ("author:5", "message:12") so `invalidate(tag)` can drop
+# every fragment of one user or message.
+
+
+class NullBackend:
+    """Caches nothing."""
+
+    def get(self, key):
+        return None
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key, value, tags=()):
+        pass
+
+    def invalidate(self, tag):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend:
+    """Least-recently-used cache of at most `size` fragments, per process."""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = Lock()
+        # key -> (value, tags), least recently used first
+        self._entries = OrderedDict()
+        # tag -> keys
+        self._tagged = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    values.append(entry[0])
+        return values
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.size:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tagged.get(tag, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+
+class RedisBackend:
+    """Fragments in a redis server, shared by every worker."""
+
+    PREFIX = 'warbler:fragment:'
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        values = self.client.mget([self.PREFIX + key for key in keys])
+        return [value.decode() if value is not None else None
+                for value in values]
+
+    def set(self, key, value, tags=()):
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(self.PREFIX + key, value, ex=self.ttl)
+            for tag in tags:
+                pipe.sadd(self.PREFIX + 'tag:' + tag, key)
+                pipe.expire(self.PREFIX + 'tag:' + tag, self.ttl)
+            pipe.execute()
+
+    def invalidate(self, tag):
+        tag_key = self.PREFIX + 'tag:' + tag
+        keys = self.client.smembers(tag_key)
+        self.client.delete(tag_key,
+                           *(self.PREFIX + key.decode() for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.PREFIX + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+##############################################################################
+# Rendering
+
+
+def _version(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+
+
+def cached(key, tags, render):
+    """`render()`'s HTML, from the cache under `key` when it's there."""
+
+    key = f'{http_cache.templates_version()}:{key}'
+    html = backend().get(key)
+    if html is None:
+        html = str(render())
+        backend().set(key, html, tags)
+    return Markup(html)
+
+
+def message_cards(messages, liked_ids=None):
+    """Cards for `messages`, in order, fetched from the cache in one go.
+
+    With `liked_ids` each card has the viewer's like button. The button
+    only depends on whether the viewer likes the message, so a message
+    has at most three cached variants, shared by every viewer.
+    """
+
+    # authors deleted but not purged yet
+    messages = [msg for msg in messages if msg.user.deleted_at is None]
+
+    prefix = http_cache.templates_version()
+    versions = {}
+    keys = []
+    for msg in messages:
+        author = msg.user
+        if author.id not in versions:
+            versions[author.id] = _version(author.username, author.image_url)
+        liked = None if liked_ids is None else msg.id in liked_ids
+        keys.append(f'{prefix}:message:{msg.id}:{liked}:{versions[author.id]}')
+
+    cache = backend()
+    cards = cache.get_many(keys)
+    for i, (msg, card) in enumerate(zip(messages, cards)):
+        if card is None:
+            liked = None if liked_ids is None else msg.id in liked_ids
+            card = render_template('messages/card.html', msg=msg, liked=liked)
+            cache.set(keys[i], card,
+                      (f'message:{msg.id}', f'author:{msg.user_id}'))
+            cards[i] = card
+
+    return [Markup(card) for card in cards]
+
+
+def profile_header(user, actions=''):
+    """A user's header image, avatar and counts, with `actions` added."""
+
+    html = cached(
+        f'profile:{user.id}:{_version(user.updated_at)}',
+        (f'profile:{user.id}',),
+        lambda: render_template('users/profile_header.html', user=user,
+                                actions=_ACTIONS_HOLE))
+    return Markup(html.replace(_ACTIONS_HOLE, Markup(actions)))
+
+
+##############################################################################
+# Signal receivers
+
+
+def _on_message_deleted(app, user, message):
+    backend().invalidate(f'message:{message.id}')
+    backend().invalidate(f'profile:{message.user_id}')
+
+
+def _on_profile_changed(app, user):
+    backend().invalidate(f'author:{user.id}')
+    backend().invalidate(f'profile:{user.id}')
+
+
+def _on_counts_changed(app, user, message):
+    backend().invalidate(f'profile:{user.id}')
+
+
+def _on_follow_changed(app, user, followed):
+    backend().invalidate(f'profile:{user.id}')
+    backend().invalidate(f'profile:{followed.id}')
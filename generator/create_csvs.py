@@ -3,75 +3,306 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Sizes come from the command line, and everything is streamed, so the same
+script makes the small checked-in sample and load-testing datasets with
+millions of users:
+
+    python generator/create_csvs.py
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 100000000 --likes 20000000 --workers 16 --out-dir /data/big
+
+Follow edges follow a power law: how many accounts a user follows is
+log-normally distributed, and who they follow is drawn from a Zipf
+distribution over a shuffled popularity ranking, so a few users have huge
+follower counts and most have a handful. No network access is needed.
+
+With more than one shard, each table is split into `<table>-NNN.csv`
+files written by parallel worker processes; `seed.py` loads them in order.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import glob
+import math
+import os
+import random
+import sys
+from multiprocessing import Pool
+
 from faker import Faker
-from helpers import get_random_datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from helpers import get_random_datetime  # noqa: E402
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
 
-fake = Faker()
+# hash of the password "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
+# Profile image URLs; --offline uses the app's own placeholder images
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
+LOCAL_IMAGE_URL = "/static/images/default-pic.png"
+LOCAL_HEADER_IMAGE_URL = "/static/images/warbler-hero.jpg"
 
-# Generate random header image URLs to use for users
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
+##############################################################################
+# Skewed sampling
+
+
+class ZipfSampler:
+    """Draw ids in 1..n where the k-th most popular is picked ~ 1/k**s.
+
+    Ranks are mapped to ids with an affine permutation mod n, so popularity
+    isn't correlated with id (or sign-up order) and no table is needed.
+    """
+
+    def __init__(self, n, s=1.0, salt=0):
+        self.n = n
+        self.s = s
+        self.step = self._coprime(n, 2654435761 + salt)
+        self.offset = salt % n
+
+    @staticmethod
+    def _coprime(n, start):
+        step = start % n or 1
+        while math.gcd(step, n) != 1:
+            step += 1
+        return step
+
+    def rank(self, rng):
+        """A rank in 1..n by inverting the continuous power-law CDF."""
+
+        u = rng.random()
+        if self.s == 1.0:
+            rank = self.n ** u
+        else:
+            e = 1.0 - self.s
+            rank = ((self.n ** e - 1.0) * u + 1.0) ** (1.0 / e)
+        return min(int(rank), self.n)
+
+    def sample(self, rng):
+        return ((self.rank(rng) - 1) * self.step + self.offset) % self.n + 1
+
+
+def out_degree(rng, mean, sigma=1.5):
+    """Heavy-tailed (log-normal) count with the given mean."""
+
+    mu = math.log(mean) - sigma ** 2 / 2
+    return round(rng.lognormvariate(mu, sigma))
+
+
+def distinct_targets(rng, sampler, count, exclude):
+    """`count` distinct sampled ids, none equal to `exclude`."""
+
+    count = min(count, sampler.n - 1)
+    if count > (sampler.n - 1) // 2:
+        # dense: rejection sampling would thrash
+        pool = [i for i in range(1, sampler.n + 1) if i != exclude]
+        return rng.sample(pool, count)
+
+    chosen = set()
+    while len(chosen) < count:
+        target = sampler.sample(rng)
+        if target != exclude:
+            chosen.add(target)
+    return chosen
+
+
+##############################################################################
+# Shards: each task writes one file covering rows or users [start, end)
+
+
+def shard_path(out_dir, table, shard, shards):
+    if shards == 1:
+        return os.path.join(out_dir, f"{table}.csv")
+    return os.path.join(out_dir, f"{table}-{shard:03d}.csv")
+
+
+def write_users(path, start, end, seed, offline):
+    fake = Faker()
+    fake.seed_instance(seed)
+
+    with open(path, 'w', newline='') as users_csv:
+        users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
+        users_writer.writeheader()
+
+        for i in range(start, end):
+            # the id suffix keeps usernames and emails unique at any size
+            username = f"{fake.user_name()}{i}"
+            users_writer.writerow(dict(
+                email=f"{username}@{fake.free_email_domain()}",
+                username=username,
+                image_url=LOCAL_IMAGE_URL if offline else fake.random_element(image_urls),
+                password=PASSWORD,
+                bio=fake.sentence(),
+                header_image_url=LOCAL_HEADER_IMAGE_URL,
+                location=fake.city()
+            ))
+
+    return end - start
+
+
+def write_messages(path, start, end, seed, num_users):
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    random.seed(seed)  # get_random_datetime uses the global generator
+    authors = ZipfSampler(num_users, s=0.8, salt=1)
+
+    with open(path, 'w', newline='') as messages_csv:
+        messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
+        messages_writer.writeheader()
+
+        for _ in range(start, end):
+            messages_writer.writerow(dict(
+                text=fake.paragraph()[:MAX_WARBLER_LENGTH],
+                timestamp=get_random_datetime(),
+                user_id=authors.sample(rng)
+            ))
+
+    return end - start
+
+
+def write_follows(path, start, end, seed, num_users, mean_following, alpha):
+    rng = random.Random(seed)
+    popular = ZipfSampler(num_users, s=alpha, salt=2)
+    written = 0
+
+    with open(path, 'w', newline='') as follows_csv:
+        follows_writer = csv.writer(follows_csv)
+        follows_writer.writerow(FOLLOWS_CSV_HEADERS)
+
+        for follower in range(start + 1, end + 1):
+            degree = out_degree(rng, mean_following)
+            for followed_user in distinct_targets(rng, popular, degree, follower):
+                follows_writer.writerow((followed_user, follower))
+                written += 1
+
+    return written
+
+
+def write_likes(path, start, end, seed, num_messages, mean_likes):
+    rng = random.Random(seed)
+    popular = ZipfSampler(num_messages, s=1.0, salt=3)
+    written = 0
+
+    with open(path, 'w', newline='') as likes_csv:
+        likes_writer = csv.writer(likes_csv)
+        likes_writer.writerow(LIKES_CSV_HEADERS)
+
+        for user_id in range(start + 1, end + 1):
+            degree = out_degree(rng, mean_likes)
+            for message_id in distinct_targets(rng, popular, degree, None):
+                likes_writer.writerow((user_id, message_id))
+                written += 1
+
+    return written
+
+
+def _run(task):
+    writer, args = task
+    return writer(*args)
+
+
+def split(total, shards):
+    """[start, end) ranges covering 0..total in `shards` near-equal parts."""
+
+    bounds = [total * i // shards for i in range(shards + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def plan(args):
+    """One (writer, args) task per shard per table, in load order."""
+
+    tasks = []
+    seed = args.seed
+
+    for shard, (start, end) in enumerate(split(args.users, args.shards)):
+        tasks.append((write_users, (
+            shard_path(args.out_dir, 'users', shard, args.shards),
+            start, end, seed + shard, args.offline)))
+
+    for shard, (start, end) in enumerate(split(args.messages, args.shards)):
+        tasks.append((write_messages, (
+            shard_path(args.out_dir, 'messages', shard, args.shards),
+            start, end, seed + 1000 + shard, args.users)))
+
+    mean_following = max(args.follows / args.users, 1e-9)
+    for shard, (start, end) in enumerate(split(args.users, args.shards)):
+        tasks.append((write_follows, (
+            shard_path(args.out_dir, 'follows', shard, args.shards),
+            start, end, seed + 2000 + shard, args.users, mean_following,
+            args.alpha)))
+
+    if args.likes:
+        mean_likes = args.likes / args.users
+        for shard, (start, end) in enumerate(split(args.users, args.shards)):
+            tasks.append((write_likes, (
+                shard_path(args.out_dir, 'likes', shard, args.shards),
+                start, end, seed + 3000 + shard, args.messages, mean_likes)))
+
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate Warbler CSVs for seed.py.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS,
+                        help='approximate number of follow edges')
+    parser.add_argument('--likes', type=int, default=0,
+                        help='approximate number of likes (0: no likes file)')
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help='Zipf exponent of follower popularity')
+    parser.add_argument('--out-dir', default='generator')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='parallel worker processes')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='files per table (default: 1 for small '
+                             'datasets, else --workers)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed, for reproducible datasets')
+    parser.add_argument('--offline', action='store_true',
+                        help="use the app's local placeholder profile images")
+    args = parser.parse_args()
+
+    if args.shards is None:
+        args.shards = 1 if args.users * 10 < 1_000_000 else args.workers
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    # old shards would be loaded alongside the new files
+    for table in ('users', 'messages', 'follows', 'likes'):
+        for stale in glob.glob(os.path.join(args.out_dir, f"{table}*.csv")):
+            os.remove(stale)
+
+    tasks = plan(args)
+    with Pool(min(args.workers, len(tasks))) as pool:
+        counts = pool.map(_run, tasks, chunksize=1)
+
+    totals = {}
+    for (writer, _), count in zip(tasks, counts):
+        table = writer.__name__.replace('write_', '')
+        totals[table] = totals.get(table, 0) + count
+    for table, count in totals.items():
+        print(f"{table}: {count} rows")
+
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""In-memory follow graph, for who-to-follow and fast follow questions.
+
+The `follows` table is only reachable through the User.followers /
+User.following relationships, which load whole User rows. This module
+keeps every edge in memory instead, CSR style: per direction, one flat
+array of neighbour ids (4 bytes an edge) sorted within each user's run,
+and one array of where each user's run starts. A user's followees are
+`targets[offsets[id]:offsets[id + 1]]`; whether A follows B is a binary
+search in A's run.
+
+Follows and unfollows since the arrays were built go into small per-user
+added / removed sets that reads fold in, under a lock, since receivers
+change them from whichever thread made the follow. The arrays are rebuilt
+from the database every FOLLOW_GRAPH_TTL seconds, or once
+FOLLOW_GRAPH_MAX_CHANGES changes pile up, on a background thread; reads
+keep using the old copy until the new one is swapped in.
+
+Building the graph means reading all of `follows`, so with
+FOLLOW_GRAPH_BUILD_IN_BACKGROUND the first build runs on that thread too,
+started as a gunicorn worker starts (see gunicorn.conf.py) or else on
+first use; until it's done there are no suggestions. Without it the first
+use builds the graph there and then.
+
+Each worker process has its own copy. It sees its own requests' follows
+at once and other workers' at the next rebuild, so the TTL bounds how
+stale it gets. Like the other receivers, ours run before the commit; a
+follow rolled back after that lingers until the next rebuild.
+"""
+
+import bisect
+import heapq
+import random
+import time
+from array import array
+from collections import Counter
+from itertools import accumulate
+from threading import Lock, RLock, Thread
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, Follows, User
+from signals import follow_added, follow_removed, user_deleted
+
+OUT = 0  # user -> who they follow
+IN = 1   # user -> who follows them
+
+
+def init_app(app):
+    """Register follow graph config defaults and signal receivers."""
+
+    app.config.setdefault('FOLLOW_GRAPH_TTL', 300)
+    app.config.setdefault('FOLLOW_GRAPH_BUILD_IN_BACKGROUND', True)
+    app.config.setdefault('FOLLOW_GRAPH_MAX_CHANGES', 10000)
+    # followees whose follows are counted for a user's suggestions
+    app.config.setdefault('FOLLOW_GRAPH_SUGGESTION_FANOUT', 200)
+    app.config.setdefault('WHO_TO_FOLLOW_COUNT', 5)
+
+    app.extensions['follow_graph'] = _State()
+
+    follow_added.connect(_on_follow_added)
+    follow_removed.connect(_on_follow_removed)
+    user_deleted.connect(_on_user_deleted)
+
+
+class Adjacency:
+    """Every user's sorted neighbour ids, in two flat arrays."""
+
+    __slots__ = ('offsets', 'targets')
+
+    def __init__(self, nodes, others, size):
+        """Edges nodes[i] -> others[i], for node ids below `size`.
+
+        Each node's neighbours come out in the order the edges are given,
+        so give them sorted by (node, other) -- or by (other, node) for the
+        reverse direction.
+        """
+
+        counts = array('q', bytes(8 * size))
+        for node in nodes:
+            counts[node] += 1
+        self.offsets = array('q', accumulate(counts, initial=0))
+
+        self.targets = array('i', bytes(4 * len(nodes)))
+        fill = array('q', self.offsets)
+        for node, other in zip(nodes, others):
+            self.targets[fill[node]] = other
+            fill[node] += 1
+
+    def _run(self, node):
+        if node + 1 >= len(self.offsets):
+            return 0, 0
+        return self.offsets[node], self.offsets[node + 1]
+
+    def degree(self, node):
+        start, end = self._run(node)
+        return end - start
+
+    def neighbours(self, node):
+        start, end = self._run(node)
+        return self.targets[start:end]
+
+    def has(self, node, other):
+        start, end = self._run(node)
+        i = bisect.bisect_left(self.targets, other, start, end)
+        return i < end and self.targets[i] == other
+
+
+class FollowGraph:
+    """Who follows whom: arrays as built, plus changes made since."""
+
+    def __init__(self, followers=(), followed=(), size=None):
+        """Build from parallel sequences of edges, sorted by
+        (follower, followed). Users with ids from `size` up (by default,
+        above any in an edge) have no edges in the arrays."""
+
+        followers = array('i', followers)
+        followed = array('i', followed)
+        if size is None:
+            size = max(max(followers, default=0), max(followed, default=0)) + 1
+
+        self._adjacency = (Adjacency(followers, followed, size),
+                           Adjacency(followed, followers, size))
+        self._added = ({}, {})
+        self._removed = ({}, {})
+        self.changes = 0
+        # changes come from signal receivers on any thread; reads take the
+        # lock too so they never see a set mid-change or half a follow
+        self._lock = RLock()
+
+    @classmethod
+    def load(cls):
+        """Build from the follows table."""
+
+        followers, followed = array('i'), array('i')
+        rows = db.session.execute(
+            select(Follows.user_following_id, Follows.user_being_followed_id)
+            .order_by(Follows.user_following_id,
+                      Follows.user_being_followed_id)
+            # reads the whole table on purpose (see query_plans.py)
+            .execution_options(yield_per=10000, full_scan=True))
+        for follower, followee in rows:
+            followers.append(follower)
+            followed.append(followee)
+        return cls(followers, followed)
+
+    # changes
+
+    def add(self, follower, followed):
+        with self._lock:
+            self._change(OUT, follower, followed, True)
+            self._change(IN, followed, follower, True)
+
+    def remove(self, follower, followed):
+        with self._lock:
+            self._change(OUT, follower, followed, False)
+            self._change(IN, followed, follower, False)
+
+    def remove_user(self, user_id):
+        """Drop every edge to or from `user_id`."""
+
+        with self._lock:
+            for followed in self.following(user_id):
+                self.remove(user_id, followed)
+            for follower in self.followers(user_id):
+                self.remove(follower, user_id)
+
+    def _change(self, direction, node, other, present):
+        added = self._added[direction].setdefault(node, set())
+        removed = self._removed[direction].setdefault(node, set())
+        in_arrays = self._adjacency[direction].has(node, other)
+
+        if present:
+            removed.discard(other)
+            if not in_arrays:
+                added.add(other)
+        else:
+            added.discard(other)
+            if in_arrays:
+                removed.add(other)
+        self.changes += 1
+
+    # reads
+
+    def _neighbours(self, direction, node):
+        neighbours = self._adjacency[direction].neighbours(node)
+        with self._lock:
+            added = self._added[direction].get(node)
+            removed = self._removed[direction].get(node)
+            if not added and not removed:
+                return neighbours
+            return ([other for other in neighbours if other not in removed]
+                    + sorted(added))
+
+    def _has(self, direction, node, other):
+        with self._lock:
+            if other in self._added[direction].get(node, ()):
+                return True
+            if other in self._removed[direction].get(node, ()):
+                return False
+        return self._adjacency[direction].has(node, other)
+
+    def _degree(self, direction, node):
+        with self._lock:
+            return (self._adjacency[direction].degree(node)
+                    + len(self._added[direction].get(node, ()))
+                    - len(self._removed[direction].get(node, ())))
+
+    def following(self, user_id):
+        """Ids `user_id` follows, as a sequence."""
+
+        return self._neighbours(OUT, user_id)
+
+    def followers(self, user_id):
+        """Ids following `user_id`, as a sequence."""
+
+        return self._neighbours(IN, user_id)
+
+    def following_count(self, user_id):
+        return self._degree(OUT, user_id)
+
+    def followers_count(self, user_id):
+        return self._degree(IN, user_id)
+
+    def is_following(self, follower, followed):
+        return self._has(OUT, follower, followed)
+
+    def mutuals(self, user_id):
+        """Ids that follow `user_id` back, as a set."""
+
+        return {other for other in self.following(user_id)
+                if self._has(IN, user_id, other)}
+
+    def followed_by_followees(self, viewer, user_id):
+        """Ids of people `viewer` follows who follow `user_id`, as a set.
+
+        Walks whichever of the two lists is shorter.
+        """
+
+        if self.following_count(viewer) <= self.followers_count(user_id):
+            return {followee for followee in self.following(viewer)
+                    if self._has(OUT, followee, user_id)}
+        return {follower for follower in self.followers(user_id)
+                if self._has(OUT, viewer, follower)}
+
+    def within_two_hops(self, viewer, user_id):
+        """Does `viewer` follow `user_id`, or someone who does?"""
+
+        if self.is_following(viewer, user_id):
+            return True
+        if self.following_count(viewer) <= self.followers_count(user_id):
+            return any(self._has(OUT, followee, user_id)
+                       for followee in self.following(viewer))
+        return any(self._has(OUT, viewer, follower)
+                   for follower in self.followers(user_id))
+
+    def suggestions(self, user_id, limit=5, fanout=200):
+        """Ids `user_id` might follow, best first.
+
+        Ranked by how many of their followees follow each candidate
+        (counting at most `fanout` followees, picked at random), then by
+        follower count.
+        """
+
+        followees = self.following(user_id)
+        if len(followees) > fanout:
+            followees = random.sample(list(followees), fanout)
+
+        votes = Counter()
+        for followee in followees:
+            votes.update(self.following(followee))
+
+        for seen in (user_id, *self.following(user_id)):
+            votes.pop(seen, None)
+
+        return heapq.nlargest(
+            limit, votes,
+            key=lambda other: (votes[other], self.followers_count(other),
+                               -other))
+
+
+##############################################################################
+# This process's graph
+
+
+class _State:
+    def __init__(self):
+        self.lock = Lock()
+        self.graph = None
+        self.loaded_at = 0
+        # changes made during a background build, replayed onto it
+        self.replay = None
+        # bumped by reset(), so builds started before it are thrown away
+        self.generation = 0
+
+
+def follow_graph():
+    """This process's FollowGraph, rebuilt in the background when it gets
+    old. None while it's first being built in the background."""
+
+    app = current_app._get_current_object()
+    state = app.extensions['follow_graph']
+
+    with state.lock:
+        if state.graph is None:
+            if app.config['FOLLOW_GRAPH_BUILD_IN_BACKGROUND']:
+                _start_build(app, state)
+                return None
+            state.graph = FollowGraph.load()
+            state.loaded_at = time.monotonic()
+
+        stale = (time.monotonic() - state.loaded_at
+                 > app.config['FOLLOW_GRAPH_TTL']
+                 or state.graph.changes > app.config['FOLLOW_GRAPH_MAX_CHANGES'])
+        if stale:
+            _start_build(app, state)
+
+        return state.graph
+
+
+def warm():
+    """Start building this process's graph in the background, if it isn't
+    built or being built yet."""
+
+    app = current_app._get_current_object()
+    state = app.extensions['follow_graph']
+    with state.lock:
+        if state.graph is None:
+            _start_build(app, state)
+
+
+def reset():
+    """Drop this process's graph; the next use builds it afresh."""
+
+    state = current_app.extensions['follow_graph']
+    with state.lock:
+        state.graph = None
+        state.replay = None
+        state.generation += 1
+
+
+def _start_build(app, state):
+    # with state.lock held
+    if state.replay is None:
+        state.replay = []
+        Thread(target=_rebuild, args=(app, state, state.generation),
+               name='follow-graph', daemon=True).start()
+
+
+def _rebuild(app, state, generation):
+    with app.app_context():
+        try:
+            graph = FollowGraph.load()
+        except Exception:
+            app.logger.exception("Building the follow graph failed")
+            graph = None
+
+    with state.lock:
+        if state.generation != generation:
+            return
+        if graph is not None:
+            for method, args in state.replay:
+                getattr(graph, method)(*args)
+            state.graph = graph
+        # try again after another TTL either way (or, with no graph yet,
+        # on next use)
+        state.loaded_at = time.monotonic()
+        state.replay = None
+
+
+def suggested_users(user_id, limit=None):
+    """Active users `user_id` might want to follow, best first."""
+
+    config = current_app.config
+    graph = follow_graph()
+    if graph is None:
+        return []
+
+    ids = graph.suggestions(
+        user_id, limit=limit or config['WHO_TO_FOLLOW_COUNT'],
+        fanout=config['FOLLOW_GRAPH_SUGGESTION_FANOUT'])
+    if not ids:
+        return []
+
+    found = {user.id: user
+             for user in User.active().filter(User.id.in_(ids))}
+    return [found[user_id] for user_id in ids if user_id in found]
+
+
+##############################################################################
+# Signal receivers
+
+
+def _apply(app, method, *args):
+    state = app.extensions['follow_graph']
+    with state.lock:
+        if state.replay is not None:
+            state.replay.append((method, args))
+        # not built yet: the build replays it, or reads it from the database
+        if state.graph is not None:
+            getattr(state.graph, method)(*args)
+
+
+def _on_follow_added(app, user, followed):
+    _apply(app, 'add', user.id, followed.id)
+
+
+def _on_follow_removed(app, user, followed):
+    _apply(app, 'remove', user.id, followed.id)
+
+
+def _on_user_deleted(app, user):
+    _apply(app, 'remove_user', user.id)
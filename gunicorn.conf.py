@@ -0,0 +1,51 @@
+"""gunicorn settings for production.
+
+    WARBLER_ENV=production gunicorn app:app
+
+With preload (the default here) the master imports the app once and
+forks workers from it, so workers start almost instantly and share the
+imported code's memory copy-on-write. Anything holding sockets -- the
+database engine's pool -- is reset in each worker after the fork.
+
+Database connections are bounded at WEB_CONCURRENCY workers times
+DB_POOL_SIZE + DB_MAX_OVERFLOW (see config.py).
+
+Live home feed streams each hold a thread for minutes, so they're only
+on with GUNICORN_THREADS above 1; otherwise pages poll (see live.py).
+"""
+
+import gc
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# restart workers now and then, staggered, to cap slow memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+
+
+def when_ready(server):
+    # everything allocated so far lives for the life of the master; keep
+    # the collector from touching (and so un-sharing) those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+
+    from app import app
+    from models import db
+    import graph
+
+    # connections opened in the master must not be shared across workers
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+        # threads don't survive the fork: build the worker's own follow
+        # graph now, before its first request wants it
+        graph.warm()
@@ -0,0 +1,122 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow: at the default cost of 12 a hash or check
+takes a couple of hundred milliseconds of CPU. Run inline, a burst of
+logins ties up every request worker at once. Instead all hashing goes
+through `hasher`, which
+
+- runs bcrypt on a small thread pool (bcrypt releases the GIL, so the
+  pool uses real cores) of `BCRYPT_WORKERS` threads,
+- admits at most `BCRYPT_MAX_PENDING` jobs at a time; a request that can't
+  get a slot within `BCRYPT_QUEUE_TIMEOUT` seconds gets HasherBusy (the
+  app answers 503) instead of queueing without bound,
+- hashes at cost `BCRYPT_LOG_ROUNDS`, and reports hashes made at a lower
+  cost via `needs_rehash` so logins can upgrade them.
+
+The pool is created on first use, so it's never inherited across a fork.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from flask_bcrypt import Bcrypt
+
+bcrypt = Bcrypt()
+
+
+class HasherBusy(Exception):
+    """Every hashing slot stayed taken for the whole queue timeout."""
+
+
+def hash_cost(pw_hash):
+    """The cost (log2 rounds) a bcrypt hash was made with, or None."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool with backpressure."""
+
+    def __init__(self, rounds=12, workers=None, max_pending=None,
+                 queue_timeout=1.0):
+        self._lock = Lock()
+        self._executor = None
+        self.configure(rounds, workers, max_pending, queue_timeout)
+
+    def configure(self, rounds=12, workers=None, max_pending=None,
+                  queue_timeout=1.0):
+        """(Re)size the pool; running jobs finish on the old one."""
+
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 8
+        self.queue_timeout = queue_timeout
+
+        with self._lock:
+            old, self._executor = self._executor, None
+            self._slots = BoundedSemaphore(self.max_pending)
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='bcrypt')
+            return self._executor
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusy()
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+
+        future.add_done_callback(lambda _: slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """bcrypt-hash `password` at the configured cost; returns str."""
+
+        pw_hash = self._run(bcrypt.generate_password_hash,
+                            password, self.rounds)
+        return pw_hash.decode('UTF-8')
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made at a lower cost than is configured now?"""
+
+        cost = hash_cost(pw_hash)
+        return cost is not None and cost < self.rounds
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    """Size the shared hasher from app config."""
+
+    app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+    app.config.setdefault('BCRYPT_WORKERS', os.cpu_count() or 1)
+    app.config.setdefault('BCRYPT_MAX_PENDING',
+                          app.config['BCRYPT_WORKERS'] * 8)
+    app.config.setdefault('BCRYPT_QUEUE_TIMEOUT', 1.0)
+
+    bcrypt.init_app(app)
+    hasher.configure(rounds=app.config['BCRYPT_LOG_ROUNDS'],
+                     workers=app.config['BCRYPT_WORKERS'],
+                     max_pending=app.config['BCRYPT_MAX_PENDING'],
+                     queue_timeout=app.config['BCRYPT_QUEUE_TIMEOUT'])
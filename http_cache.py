@@ -0,0 +1,193 @@
+"""HTTP caching: immutable static files and conditional pages.
+
+Static files
+    `url_for('static', filename=...)` adds `?v=<content hash>` to the URL,
+    and a static response whose `v` matches the file's current hash is
+    sent with a year-long `Cache-Control: immutable`. Editing a file
+    changes its URL, so browsers never see a stale copy. Paths stored in
+    the database (the default avatar and header image) go through the
+    `asset_url` template filter to get the same treatment. Unversioned
+    static requests, such as the images style.css refers to, keep Flask's
+    default of revalidating with ETag / Last-Modified.
+
+Pages
+    A view that knows what its page depends on calls `conditional()`
+    before rendering. That sets a weak ETag (built from those parts, the
+    viewer's nav bar fields and a hash of the templates) and a
+    Last-Modified, and answers a matching If-None-Match or
+    If-Modified-Since with a 304 without rendering anything.
+
+Every other response is `private, no-cache`: browsers may keep it for
+back/forward but shared caches must not. Pages for anonymous visitors
+that went through `conditional()` are `public`. Nothing is validated
+while flashed messages are waiting, since the page would show them once.
+"""
+
+import hashlib
+import os
+
+from flask import current_app, g, request, session
+from werkzeug.security import safe_join
+
+from user_cache import CURR_USER_KEY
+
+# one year, the conventional "forever" for versioned assets
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def init_app(app):
+    """Register static URL versioning and cache headers."""
+
+    app.config.setdefault('STATIC_MAX_AGE', STATIC_MAX_AGE)
+
+    app.extensions['http_cache'] = dict(
+        hashes={}, templates=_templates_digest(app))
+
+    app.url_defaults(_version_static_url)
+    app.after_request(_cache_headers)
+    app.add_template_filter(asset_url)
+
+
+def templates_version():
+    """A hash of the templates, for keys of anything rendered from them."""
+
+    return current_app.extensions['http_cache']['templates']
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def _templates_digest(app):
+    """A hash of every template, so a deploy that changes one changes ETags."""
+
+    digest = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(app.jinja_loader.searchpath[0])):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.html'):
+                with open(os.path.join(root, name), 'rb') as file:
+                    digest.update(name.encode())
+                    digest.update(file.read())
+    return digest.hexdigest()[:12]
+
+
+##############################################################################
+# Static files
+
+
+def static_hash(filename):
+    """Content hash of a file in the static folder, or None if there's none.
+
+    Hashes are kept for the life of the process; in debug mode a changed
+    modification time or size hashes the file again.
+    """
+
+    path = safe_join(current_app.static_folder, filename)
+    if path is None:
+        return None
+
+    hashes = current_app.extensions['http_cache']['hashes']
+    entry = hashes.get(path)
+    if entry is not None and not current_app.debug:
+        return entry[1]
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size):
+        return entry[1]
+
+    with open(path, 'rb') as file:
+        digest = _digest(file.read())
+    hashes[path] = ((stat.st_mtime_ns, stat.st_size), digest)
+    return digest
+
+
+def _version_static_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = static_hash(values['filename'])
+        if digest:
+            values['v'] = digest
+
+
+def asset_url(url):
+    """Template filter: version `url` if it names a static file."""
+
+    prefix = current_app.static_url_path + '/'
+    if not url or not url.startswith(prefix):
+        return url
+
+    filename = url[len(prefix):]
+    digest = static_hash(filename)
+    return f'{url}?v={digest}' if digest else url
+
+
+##############################################################################
+# Pages
+
+
+def conditional(*parts, last_modified=None):
+    """Validate the page about to be rendered; a 304 response if unchanged.
+
+    `parts` are the values the page's content depends on besides its URL,
+    e.g. the updated_at of the rows it shows. Returns None when the page
+    has to be rendered; the validators are then added to its response.
+    """
+
+    if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return None
+
+    viewer = g.user
+    viewer_parts = ((viewer.id, viewer.username, viewer.image_url)
+                    if viewer else None)
+    etag = _digest(repr((
+        templates_version(),
+        viewer_parts,
+        parts,
+    )).encode())
+    if last_modified is not None:
+        # HTTP dates have whole seconds
+        last_modified = last_modified.replace(microsecond=0)
+
+    g._validators = (etag, last_modified)
+
+    if request.if_none_match:
+        unchanged = request.if_none_match.contains_weak(etag)
+    else:
+        unchanged = (last_modified is not None
+                     and request.if_modified_since is not None
+                     and request.if_modified_since.replace(tzinfo=None)
+                     >= last_modified)
+
+    if unchanged:
+        return current_app.response_class(status=304)
+    return None
+
+
+def _cache_headers(response):
+    if request.endpoint == 'static':
+        if request.args.get('v') and request.args['v'] == static_hash(
+                request.view_args['filename']):
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config['STATIC_MAX_AGE']
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
+
+    validators = g.pop('_validators', None)
+    if validators is not None and response.status_code in (200, 304):
+        etag, last_modified = validators
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        if CURR_USER_KEY in session:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,287 @@
+"""Per-request query counts, DB and template timings, and /__metrics.
+
+For a sampled request (a `INSTRUMENTATION_SAMPLE_RATE` fraction of them)
+SQLAlchemy cursor events and Flask's template signals record
+
+- how many statements ran and their total time,
+- how long templates took to render,
+- the slowest statements; any over `SLOW_QUERY_MS` is logged.
+
+Sampled responses carry these in a `Server-Timing` header, which browser
+dev tools show next to the request. Every request, sampled or not, is
+counted and timed for `/__metrics`, which serves the totals in the
+Prometheus text format. Unsampled requests cost a dict update and two
+clock reads; the cursor and template hooks return straight away.
+
+Metrics are per process: with several gunicorn workers, each scrape sees
+the worker that answered it. Set `METRICS_TOKEN` to require
+`Authorization: Bearer <token>` on /__metrics. Without a token it's only
+served with `METRICS_PUBLIC` (the development and testing profiles), so
+production never shows per-route timings to anyone who asks.
+"""
+
+import heapq
+import random
+import time
+from threading import Lock
+
+from flask import abort, current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds, in seconds, of the latency histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# upper bounds of the queries-per-request histogram buckets
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def init_app(app):
+    """Register instrumentation config, request hooks and /__metrics."""
+
+    app.config.setdefault('INSTRUMENTATION_ENABLED', True)
+    app.config.setdefault('INSTRUMENTATION_SAMPLE_RATE', 0.1)
+    app.config.setdefault('SERVER_TIMING', True)
+    app.config.setdefault('SLOW_QUERY_MS', 100)
+    # slowest statements kept per request
+    app.config.setdefault('SLOW_QUERIES_KEPT', 3)
+    app.config.setdefault('METRICS_TOKEN', None)
+    # serve /__metrics to anyone when there's no token
+    app.config.setdefault('METRICS_PUBLIC', False)
+
+    app.extensions['instrumentation'] = Registry()
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
+    app.add_url_rule('/__metrics', 'metrics', metrics)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor)
+
+
+def registry():
+    return current_app.extensions['instrumentation']
+
+
+##############################################################################
+# Metric types and the registry
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label value."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label, value):
+        counts, total, observed = self.series.get(
+            label, ([0] * len(self.buckets), 0.0, 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.series[label] = (counts, total + value, observed + 1)
+
+
+class Registry:
+    """Process-wide request metrics, rendered for Prometheus."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = {}
+        self.slow_queries = {}
+        self.request_seconds = Histogram(DURATION_BUCKETS)
+        self.db_seconds = Histogram(DURATION_BUCKETS)
+        self.template_seconds = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+
+    def record(self, endpoint, method, status, seconds, stats=None):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.request_seconds.observe(endpoint, seconds)
+
+            if stats is not None:
+                self.queries.observe(endpoint, stats.queries)
+                self.db_seconds.observe(endpoint, stats.db_seconds)
+                self.template_seconds.observe(endpoint, stats.template_seconds)
+                if stats.slow:
+                    self.slow_queries[endpoint] = (
+                        self.slow_queries.get(endpoint, 0) + stats.slow)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+
+        lines = []
+
+        def header(name, kind, help):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, hist, help):
+            header(name, 'histogram', help)
+            for endpoint, (counts, total, observed) in sorted(hist.series.items()):
+                label = f'endpoint="{_escape(endpoint)}"'
+                for bound, count in zip(hist.buckets, counts):
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {observed}')
+                lines.append(f'{name}_sum{{{label}}} {total:.6f}')
+                lines.append(f'{name}_count{{{label}}} {observed}')
+
+        with self._lock:
+            header('warbler_requests_total', 'counter',
+                   'Requests handled, by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'warbler_requests_total{{endpoint="{_escape(endpoint)}",'
+                    f'method="{method}",status="{status}"}} {count}')
+
+            histogram('warbler_request_duration_seconds', self.request_seconds,
+                      'Time to handle a request.')
+            histogram('warbler_db_queries', self.queries,
+                      'SQL statements per request (sampled requests).')
+            histogram('warbler_db_duration_seconds', self.db_seconds,
+                      'Time in SQL per request (sampled requests).')
+            histogram('warbler_template_duration_seconds', self.template_seconds,
+                      'Template rendering time per request (sampled requests).')
+
+            header('warbler_slow_queries_total', 'counter',
+                   'Statements slower than SLOW_QUERY_MS (sampled requests).')
+            for endpoint, count in sorted(self.slow_queries.items()):
+                lines.append(f'warbler_slow_queries_total'
+                             f'{{endpoint="{_escape(endpoint)}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+##############################################################################
+# Per-request stats
+
+
+class RequestStats:
+    """What one sampled request spent its time on."""
+
+    def __init__(self, keep, slow_seconds):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        # min-heap of the `keep` slowest (seconds, statement)
+        self.slowest = []
+        self.slow = 0
+        self._keep = keep
+        self._slow_seconds = slow_seconds
+        self._rendering = []
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        if seconds >= self._slow_seconds:
+            self.slow += 1
+
+        entry = (seconds, statement)
+        if len(self.slowest) < self._keep:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def server_timing(self, total_seconds):
+        parts = [
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_seconds * 1000:.1f}',
+            f'app;dur={total_seconds * 1000:.1f}',
+        ]
+        if self.slowest:
+            parts.insert(1, f'db-slowest;dur={max(self.slowest)[0] * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def _current_stats():
+    if has_request_context():
+        return g.get('_request_stats')
+    return None
+
+
+def _start_request():
+    g._request_started = time.perf_counter()
+
+    config = current_app.config
+    if (config['INSTRUMENTATION_ENABLED']
+            and random.random() < config['INSTRUMENTATION_SAMPLE_RATE']):
+        g._request_stats = RequestStats(config['SLOW_QUERIES_KEPT'],
+                                        config['SLOW_QUERY_MS'] / 1000)
+
+
+def _finish_request(response):
+    started = g.pop('_request_started', None)
+    stats = g.pop('_request_stats', None)
+    if (started is None or not current_app.config['INSTRUMENTATION_ENABLED']
+            or request.endpoint == 'metrics'):
+        return response
+
+    seconds = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    registry().record(endpoint, request.method, response.status_code,
+                      seconds, stats)
+
+    if stats is not None:
+        if current_app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = stats.server_timing(seconds)
+        for query_seconds, statement in sorted(stats.slowest, reverse=True):
+            if query_seconds >= current_app.config['SLOW_QUERY_MS'] / 1000:
+                current_app.logger.warning(
+                    "slow query (%.0f ms) in %s: %s", query_seconds * 1000,
+                    endpoint, ' '.join(statement.split()))
+
+    return response
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    if _current_stats() is not None:
+        conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats()
+    if stats is not None and conn.info.get('_query_started'):
+        started = conn.info['_query_started'].pop()
+        stats.add_query(statement, time.perf_counter() - started)
+
+
+def _on_before_render(app, template, context):
+    stats = _current_stats()
+    if stats is not None:
+        stats._rendering.append(time.perf_counter())
+
+
+def _on_rendered(app, template, context):
+    stats = _current_stats()
+    if stats is not None and stats._rendering:
+        started = stats._rendering.pop()
+        # nested renders (fragments) are already inside the outer one
+        if not stats._rendering:
+            stats.template_seconds += time.perf_counter() - started
+
+
+##############################################################################
+# Endpoint
+
+
+def metrics():
+    """Prometheus scrape endpoint."""
+
+    config = current_app.config
+    token = config['METRICS_TOKEN']
+    if not token and not config['METRICS_PUBLIC']:
+        abort(404)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(404)
+
+    return registry().render(), 200, {
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
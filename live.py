@@ -0,0 +1,264 @@
+"""Live home feed: new messages pushed to the page instead of reloaded.
+
+The home page used to show new messages only when reloaded, which
+re-reads and re-renders the whole 100-message first page. Now the first
+page carries the cursor of its newest message, and static/js/live.js asks
+only for what's newer than that:
+
+- LIVE_UPDATES = 'sse' (default): /timeline/stream, a Server-Sent Events
+  stream. It sends the new messages' cards whenever someone the viewer
+  follows posts, and its event ids are cursors, so a reconnecting browser
+  resumes where it left off (Last-Event-ID). A stream lasts at most
+  LIVE_STREAM_SECONDS, then the browser reconnects; past LIVE_MAX_STREAMS
+  open streams in a process new ones get a 503 and the page polls
+  instead.
+- 'poll': the page asks /timeline/updates every LIVE_POLL_INTERVAL
+  seconds. This is also the fallback when a stream can't be opened.
+- 'off': neither.
+
+Both answer with the same delta: one keyset read of the home feed after
+the cursor, usually empty.
+
+Streams sleep on a broker, which is told which authors posted once their
+messages are committed. LIVE_BROKER = 'local' wakes streams in this
+process only; messages committed by other processes are picked up every
+LIVE_HEARTBEAT seconds, when a stream also checks for new messages and
+sends a keep-alive. 'null' leaves the heartbeat as the only check.
+
+Each open stream holds a worker thread, so under gunicorn use threads
+(GUNICORN_THREADS) or an async worker class with 'sse'.
+
+A message is stamped when flushed but seen once committed, so one whose
+transaction commits late, behind a newer message already sent, can be
+missed by the streams that already sent the newer one.
+"""
+
+import json
+import time
+from collections import deque
+from datetime import datetime
+from threading import Condition, Lock
+
+from flask import current_app, render_template, stream_with_context
+from sqlalchemy import event, select
+
+import timeline
+from models import db, Follows
+from pagination import NEWER, decode_cursor, encode_cursor
+from signals import message_posted
+
+MODES = ('sse', 'poll', 'off')
+
+
+class TooManyStreams(Exception):
+    """This process already has LIVE_MAX_STREAMS open."""
+
+
+def init_app(app):
+    """Register live update config defaults, the broker and receivers."""
+
+    app.config.setdefault('LIVE_UPDATES', 'sse')
+    app.config.setdefault('LIVE_BROKER', 'local')
+    app.config.setdefault('LIVE_HEARTBEAT', 15)
+    app.config.setdefault('LIVE_STREAM_SECONDS', 300)
+    app.config.setdefault('LIVE_MAX_STREAMS', 100)
+    app.config.setdefault('LIVE_POLL_INTERVAL', 30)
+
+    if app.config['LIVE_UPDATES'] not in MODES:
+        raise ValueError(
+            f"Unknown LIVE_UPDATES: {app.config['LIVE_UPDATES']!r}")
+
+    app.extensions['live'] = _State(make_broker(app.config))
+
+    message_posted.connect(_on_message_posted)
+    if not event.contains(db.session, 'after_commit', _after_commit):
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
+
+
+def make_broker(config):
+    kind = config['LIVE_BROKER']
+    if kind == 'local':
+        return LocalBroker()
+    if kind == 'null':
+        return NullBroker()
+    raise ValueError(f"Unknown LIVE_BROKER: {kind!r}")
+
+
+def broker():
+    return current_app.extensions['live'].broker
+
+
+class _State:
+    def __init__(self, broker):
+        self.broker = broker
+        self.lock = Lock()
+        self.streams = 0
+
+
+##############################################################################
+# Brokers
+#
+# Each numbers what's published, and `wait(seq, timeout)` returns the
+# latest number and the authors published after `seq`: an empty set if
+# nothing was within `timeout`, None if too much was to say who.
+
+
+class NullBroker:
+    """Publishes nowhere; streams only check on their heartbeat."""
+
+    seq = 0
+
+    def publish(self, author_ids):
+        pass
+
+    def wait(self, seq, timeout):
+        time.sleep(timeout)
+        return seq, set()
+
+
+class LocalBroker:
+    """Wakes this process's streams."""
+
+    def __init__(self, keep=1000):
+        self._cond = Condition()
+        self.seq = 0
+        # (seq, author_id) of the latest `keep` publishes
+        self._recent = deque(maxlen=keep)
+
+    def publish(self, author_ids):
+        with self._cond:
+            for author_id in author_ids:
+                self.seq += 1
+                self._recent.append((self.seq, author_id))
+            self._cond.notify_all()
+
+    def wait(self, seq, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > seq, timeout=timeout)
+            if self.seq == seq:
+                return seq, set()
+            if not self._recent or self._recent[0][0] > seq + 1:
+                return self.seq, None
+            return self.seq, {author_id for number, author_id in self._recent
+                              if number > seq}
+
+
+##############################################################################
+# Deltas
+
+
+def start_cursor(page):
+    """The cursor live updates start from for a first page of the feed."""
+
+    if page.items:
+        newest = page.items[0]
+        return encode_cursor(newest.timestamp, newest.id)
+    return encode_cursor(datetime.utcnow(), 0)
+
+
+def delta(user, cursor):
+    """What's new in `user`'s home feed after `cursor`.
+
+    A dict of the new cursor, the new messages' list items as HTML, how
+    many there are, and `more`: whether there were more than a page (the
+    page should reload instead). Raises ValueError for a bad cursor.
+    """
+
+    key = decode_cursor(cursor)
+    limit = current_app.config['FEED_PAGE_SIZE']
+    page = timeline.home_feed(user.id, direction=NEWER, key=key, limit=limit)
+    if not page.items:
+        return dict(cursor=cursor, html='', count=0, more=False)
+
+    newest = page.items[0]
+    liked_ids = user.liked_ids_among(msg.id for msg in page)
+    return dict(
+        cursor=encode_cursor(newest.timestamp, newest.id),
+        html=render_template('messages/items.html', messages=page.items,
+                             liked_ids=liked_ids),
+        count=len(page.items),
+        more=page.prev_cursor is not None,
+    )
+
+
+def _followed(user_id):
+    return set(db.session.scalars(
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == user_id))) | {user_id}
+
+
+def stream(user, cursor):
+    """A Server-Sent Events response of `user`'s feed after `cursor`.
+
+    Raises TooManyStreams, or ValueError for a bad cursor.
+    """
+
+    decode_cursor(cursor)
+    app = current_app._get_current_object()
+    state = app.extensions['live']
+    with state.lock:
+        if state.streams >= app.config['LIVE_MAX_STREAMS']:
+            raise TooManyStreams()
+        state.streams += 1
+
+    def release():
+        with state.lock:
+            state.streams -= 1
+
+    def events(cursor):
+        heartbeat = app.config['LIVE_HEARTBEAT']
+        deadline = time.monotonic() + app.config['LIVE_STREAM_SECONDS']
+        seq = state.broker.seq
+        check = True
+        # reconnect after a second, not the browser's default three
+        yield 'retry: 1000\n\n'
+
+        while True:
+            if check:
+                update = delta(user, cursor)
+                followed = _followed(user.id)
+                # hand the connection back while we wait
+                db.session.rollback()
+                if update['count']:
+                    cursor = update['cursor']
+                    yield (f'id: {cursor}\nevent: messages\n'
+                           f'data: {json.dumps(update)}\n\n')
+                else:
+                    yield ': keep-alive\n\n'
+                # when to look for other processes' messages
+                next_check = time.monotonic() + heartbeat
+
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            seq, authors = state.broker.wait(
+                seq, min(next_check, deadline) - now)
+            check = (authors is None or bool(authors & followed)
+                     or time.monotonic() >= next_check)
+
+    response = app.response_class(stream_with_context(events(cursor)),
+                                  mimetype='text/event-stream')
+    # runs even if the stream never started
+    response.call_on_close(release)
+    # don't let a proxy hold events back to buffer them
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+##############################################################################
+# Signal receivers
+
+
+def _on_message_posted(app, user, message):
+    db.session.info.setdefault('live_authors', set()).add(user.id)
+
+
+def _after_commit(session):
+    authors = session.info.pop('live_authors', None)
+    if authors:
+        current_app.extensions['live'].broker.publish(authors)
+
+
+def _after_rollback(session):
+    session.info.pop('live_authors', None)
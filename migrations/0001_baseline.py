@@ -0,0 +1,7 @@
+"""Create any missing tables from the current models."""
+
+from models import db
+
+
+def upgrade(conn):
+    db.metadata.create_all(conn, checkfirst=True)
@@ -0,0 +1,34 @@
+"""users.messages_count, following_count, followers_count and likes_count.
+
+Added and filled from messages, follows and likes, the way `flask
+reconcile-counters` would; counters.py keeps them current from then on.
+"""
+
+from sqlalchemy import inspect, text
+
+COUNTS = {
+    'messages_count':
+        "SELECT COUNT(*) FROM messages WHERE messages.user_id = users.id",
+    'following_count':
+        "SELECT COUNT(*) FROM follows "
+        "WHERE follows.user_following_id = users.id",
+    'followers_count':
+        "SELECT COUNT(*) FROM follows "
+        "WHERE follows.user_being_followed_id = users.id",
+    'likes_count':
+        "SELECT COUNT(*) FROM likes WHERE likes.user_id = users.id",
+}
+
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+    missing = [name for name in COUNTS if name not in columns]
+    if not missing:
+        return
+
+    for name in missing:
+        conn.execute(text(
+            f"ALTER TABLE users ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text(
+        "UPDATE users SET "
+        + ", ".join(f"{name} = ({COUNTS[name]})" for name in missing)))
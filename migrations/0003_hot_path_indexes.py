@@ -0,0 +1,37 @@
+"""Indexes for feed, follow and like lookups; likes unique per user.
+
+Duplicate likes (possible before the unique index) are removed first,
+keeping the oldest, and like counters are recomputed for their owners.
+"""
+
+from sqlalchemy import text
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_messages_user_id_timestamp "
+    "ON messages (user_id, timestamp, id)",
+    "CREATE INDEX IF NOT EXISTS ix_follows_user_following_id "
+    "ON follows (user_following_id, user_being_followed_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_likes_user_id_message_id "
+    "ON likes (user_id, message_id)",
+    "CREATE INDEX IF NOT EXISTS ix_likes_message_id "
+    "ON likes (message_id)",
+    "CREATE INDEX IF NOT EXISTS ix_users_followers_count "
+    "ON users (followers_count)",
+    "CREATE INDEX IF NOT EXISTS ix_timelines_message_id "
+    "ON timelines (message_id)",
+]
+
+
+def upgrade(conn):
+    conn.execute(text(
+        "UPDATE users SET likes_count = likes_count - "
+        "(SELECT COUNT(*) - COUNT(DISTINCT message_id) FROM likes "
+        " WHERE likes.user_id = users.id) "
+        "WHERE id IN (SELECT user_id FROM likes "
+        "             GROUP BY user_id, message_id HAVING COUNT(*) > 1)"))
+    conn.execute(text(
+        "DELETE FROM likes WHERE id NOT IN "
+        "(SELECT MIN(id) FROM likes GROUP BY user_id, message_id)"))
+
+    for statement in INDEXES:
+        conn.execute(text(statement))
@@ -0,0 +1,21 @@
+"""users.updated_at, the Last-Modified time of profile pages."""
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+    if 'updated_at' in columns:
+        return
+
+    # SQLite can only add a NOT NULL column with a constant default
+    conn.execute(text(
+        "ALTER TABLE users ADD COLUMN updated_at TIMESTAMP NOT NULL "
+        "DEFAULT '1970-01-01 00:00:00'"))
+    conn.execute(text("UPDATE users SET updated_at = :now"),
+                 dict(now=datetime.utcnow()))
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            "ALTER TABLE users ALTER COLUMN updated_at SET DEFAULT now()"))
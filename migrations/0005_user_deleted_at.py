@@ -0,0 +1,13 @@
+"""users.deleted_at, the tombstone of accounts waiting to be purged."""
+
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+    if 'deleted_at' not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN deleted_at TIMESTAMP"))
+
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_deleted ON users (id) "
+        "WHERE deleted_at IS NOT NULL"))
@@ -0,0 +1,7 @@
+"""follow_suggestions, written by `flask recommend-follows`."""
+
+from models import FollowSuggestion
+
+
+def upgrade(conn):
+    FollowSuggestion.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,31 @@
+"""Indexes for user search on PostgreSQL (see search.py).
+
+The pg_trgm extension and a GIN trigram index on lower(username) for
+contains-matches, if the server has pg_trgm, and a text_pattern_ops btree
+for prefix autocomplete either way. SQLite searches with the in-process
+index, so there is nothing to do there.
+"""
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+
+def upgrade(conn):
+    if conn.dialect.name != 'postgresql':
+        return
+
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError:
+        current_app.logger.warning(
+            "pg_trgm is not available; search will rank without it")
+    else:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+            "ON users USING gin (lower(username) gin_trgm_ops)"))
+
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_prefix "
+        "ON users (lower(username) text_pattern_ops)"))
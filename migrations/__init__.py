@@ -0,0 +1,119 @@
+"""Versioned schema migrations.
+
+Each module in this package named `NNNN_description.py` is one migration
+with an `upgrade(conn)` function. `flask migrate` applies every migration
+not yet recorded in the `schema_migrations` table, in version order, each
+in its own transaction together with its bookkeeping row, so a failed
+migration leaves nothing half-applied.
+
+`0001_baseline` creates the tables from the current models, so on a fresh
+database it already builds everything later migrations add. Later
+migrations therefore have to be idempotent (`CREATE INDEX IF NOT EXISTS`
+and the like); they do the real work on databases created before them,
+back to the original schema (see test_migrations.py).
+"""
+
+import importlib
+import pkgutil
+import re
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import (Column, DateTime, Integer, MetaData, Table, Text,
+                        select)
+
+from models import db
+
+_MODULE_NAME = re.compile(r'^(\d{4})_\w+$')
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', Text, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def init_app(app):
+    """Register the migrate CLI command."""
+
+    app.cli.add_command(migrate_command)
+
+
+def discover():
+    """Every migration as (version, name, module), oldest first."""
+
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        match = _MODULE_NAME.match(info.name)
+        if match:
+            module = importlib.import_module(f'{__name__}.{info.name}')
+            found.append((int(match.group(1)), info.name, module))
+    return sorted(found, key=lambda migration: migration[0])
+
+
+def applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return set(conn.scalars(select(schema_migrations.c.version)))
+
+
+def _record(conn, version, name):
+    conn.execute(schema_migrations.insert().values(
+        version=version, name=name, applied_at=datetime.utcnow()))
+
+
+def pending(engine=None):
+    """Migrations not yet applied to the database, oldest first."""
+
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [migration for migration in discover() if migration[0] not in done]
+
+
+def upgrade(engine=None):
+    """Apply every pending migration; returns the names applied."""
+
+    engine = engine or db.engine
+    names = []
+
+    for version, name, module in pending(engine):
+        with engine.begin() as conn:
+            module.upgrade(conn)
+            _record(conn, version, name)
+        names.append(name)
+
+    return names
+
+
+def stamp(engine=None):
+    """Mark every migration applied without running it.
+
+    For databases just built from the current models by `db.create_all()`.
+    """
+
+    engine = engine or db.engine
+    for version, name, _ in pending(engine):
+        with engine.begin() as conn:
+            _record(conn, version, name)
+
+
+@click.command('migrate')
+@click.option('--status', is_flag=True,
+              help='List pending migrations instead of applying them.')
+@with_appcontext
+def migrate_command(status):
+    """Apply pending schema migrations."""
+
+    if status:
+        waiting = pending()
+        for _, name, _ in waiting:
+            click.echo(f"pending: {name}")
+        if not waiting:
+            click.echo("Schema is up to date.")
+        return
+
+    for name in upgrade():
+        click.echo(f"applied: {name}")
+    click.echo("Schema is up to date.")
@@ -2,11 +2,12 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import hasher
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Follows(db.Model):
@@ -26,6 +27,21 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key serves "who follows X"; this serves "who does X
+    # follow" and covers it, so feeds never touch the table itself
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`? One primary-key lookup."""
+
+        query = cls.query.filter_by(user_being_followed_id=followed_id,
+                                    user_following_id=follower_id)
+        return db.session.query(query.exists()).scalar()
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -49,6 +65,13 @@ class Likes(db.Model):
     
     messages = db.relationship('Message', backref='likes')
 
+    __table_args__ = (
+        # a user likes a message at most once; also serves "liked by X"
+        db.Index('uq_likes_user_id_message_id',
+                 'user_id', 'message_id', unique=True),
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -95,8 +118,64 @@ class User(db.Model):
         nullable=False,
     )
 
+    # denormalized counts, kept current by counters.py;
+    # `flask reconcile-counters` recomputes them from the source tables
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # any change to the row, counters included: a profile page's
+    # Last-Modified (see http_cache.py)
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # set when the account is deleted; reads skip the user from then on,
+    # and deletion.py purges the row and everything it owns in batches
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message', cascade="all, delete", passive_deletes=True)
 
+    __table_args__ = (
+        # finding celebrity authors for timeline reads
+        db.Index('ix_users_followers_count', 'followers_count'),
+        # finding deleted users left to purge; only ever a few rows
+        db.Index('ix_users_deleted', 'id',
+                 postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
+
     followers = db.relationship(
         "User",
         secondary="follows",
@@ -119,17 +198,51 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    @classmethod
+    def active(cls):
+        """Query of users that haven't been deleted."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(follower_id=other_user.id, followed_id=self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(follower_id=self.id, followed_id=other_user.id)
+
+    def following_ids_among(self, user_ids):
+        """Which of `user_ids` is this user following? Returns a set.
+
+        One query however many ids are asked about, so list pages can
+        answer "show Follow or Unfollow?" for every card up front.
+        """
+
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id)
+                    .filter(Follows.user_being_followed_id.in_(user_ids)))
+        return {followed_id for (followed_id,) in followed}
+
+    def liked_ids_among(self, message_ids):
+        """Which of `message_ids` has this user liked? Returns a set."""
+
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+
+        liked = (db.session
+                 .query(Likes.message_id)
+                 .filter(Likes.user_id == self.id)
+                 .filter(Likes.message_id.in_(message_ids)))
+        return {message_id for (message_id,) in liked}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -138,7 +251,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -159,16 +272,25 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+        Deleted users are not found.
+
+        A hash made at a lower cost than BCRYPT_LOG_ROUNDS is upgraded on
+        the user object; the caller commits it.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.active().filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.check_password(password):
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.hash(password)
+            return user
 
         return False
+
+    def check_password(self, password):
+        """Does `password` match this user's stored hash?"""
+
+        return hasher.check(self.password, password)
     
 
 
@@ -190,7 +312,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -201,13 +323,90 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    @classmethod
+    def active(cls):
+        """Query of messages whose author hasn't been deleted."""
+
+        return cls.query.join(cls.user).filter(User.deleted_at.is_(None))
+
+    __table_args__ = (
+        # profile and home feeds: one user's messages, newest first,
+        # keyset-paged on (timestamp, id)
+        db.Index('ix_messages_user_id_timestamp',
+                 'user_id', 'timestamp', 'id'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message fanned out to one user's precomputed home timeline."""
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # copied from the message so a timeline page is one range read
+    # on (user_id, timestamp) without touching the messages table
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        # deleting a message removes its timeline entries
+        db.Index('ix_timelines_message_id', 'message_id'),
+    )
+
+
+class FollowSuggestion(db.Model):
+    """A precomputed who-to-follow suggestion (see recommendations.py)."""
+
+    __tablename__ = 'follow_suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        # a user's suggestions, best first
+        db.Index('ix_follow_suggestions_user_id_score', 'user_id', 'score'),
+        # deleting a user removes the suggestions of them
+        db.Index('ix_follow_suggestions_suggested_id', 'suggested_id'),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
     You should call this in your Flask app.
+
+    No app context is pushed here: requests get their own, and scripts and
+    tests push one (`with app.app_context():`) before using db.
     """
 
     db.app = app
-    app.app_context().push()
     db.init_app(app)
@@ -0,0 +1,130 @@
+"""Keyset (cursor) pagination for message feeds.
+
+Feeds are ordered newest first on (timestamp, id). A cursor encodes the
+(timestamp, id) of the row a page starts or stops at, so fetching any page
+is one index range scan with a LIMIT, no matter how deep it is -- unlike
+OFFSET, which has to walk past every earlier row.
+
+`?before=<cursor>` asks for rows older than the cursor (the next page),
+`?after=<cursor>` for rows newer than it (the previous page).
+"""
+
+import base64
+import binascii
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import tuple_
+
+OLDER = 'before'
+NEWER = 'after'
+
+
+class Page:
+    """One page of a feed, newest first, with cursors to its neighbours."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(timestamp, id):
+    """Turn a (timestamp, id) sort key into an opaque URL-safe cursor."""
+
+    raw = f"{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into a (timestamp, id) sort key.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise ValueError(f"bad cursor: {cursor!r}") from exc
+
+
+def cursor_from_request():
+    """Read (direction, key) from ?before= / ?after=; 400 if malformed.
+
+    Returns (OLDER, None) when no cursor was given, meaning the first page.
+    """
+
+    for direction in (OLDER, NEWER):
+        cursor = request.args.get(direction)
+        if cursor:
+            try:
+                return direction, decode_cursor(cursor)
+            except ValueError:
+                abort(400)
+
+    return OLDER, None
+
+
+def keyset(query, timestamp_col, id_col, direction=OLDER, key=None,
+           limit=100):
+    """Apply a keyset window to `query`.
+
+    Returns (rows, has_more): up to `limit` rows ordered newest first,
+    and whether there are further rows in the direction of travel.
+    """
+
+    sort_key = tuple_(timestamp_col, id_col)
+
+    if direction == NEWER:
+        if key is not None:
+            query = query.filter(sort_key > tuple_(*key))
+        query = query.order_by(timestamp_col.asc(), id_col.asc())
+    else:
+        if key is not None:
+            query = query.filter(sort_key < tuple_(*key))
+        query = query.order_by(timestamp_col.desc(), id_col.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if direction == NEWER:
+        rows.reverse()
+
+    return rows, has_more
+
+
+def make_page(rows, has_more, direction=OLDER, key=None,
+              sort_key=lambda row: (row.timestamp, row.id)):
+    """Wrap newest-first `rows` from `keyset` in a Page with cursors."""
+
+    if not rows:
+        return Page(rows)
+
+    if direction == NEWER:
+        has_older, has_newer = True, has_more
+    else:
+        has_older, has_newer = has_more, key is not None
+
+    return Page(
+        rows,
+        next_cursor=encode_cursor(*sort_key(rows[-1])) if has_older else None,
+        prev_cursor=encode_cursor(*sort_key(rows[0])) if has_newer else None,
+    )
+
+
+def paginate(query, timestamp_col, id_col, direction=OLDER, key=None,
+             limit=100):
+    """Fetch one Page of `query` ordered by (timestamp_col, id_col) desc."""
+
+    rows, has_more = keyset(query, timestamp_col, id_col,
+                            direction=direction, key=key, limit=limit)
+    return make_page(rows, has_more, direction=direction, key=key)
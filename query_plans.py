@@ -0,0 +1,161 @@
+"""Check that every page's queries are served by indexes.
+
+`flask check-indexes` requests each hot page through the test client as
+a real user, records every SELECT the page runs, and EXPLAINs each one
+on the engine it ran on -- for `@read_only` views, a read replica.
+A query whose plan reads a whole table (a sequential scan, or an index
+scan with no index condition) is reported, and the command exits 1.
+Bulk loads that mean to read a whole table, like building graph.py's
+follow graph, say so with the `full_scan=True` execution option and are
+skipped.
+
+On PostgreSQL the plans are made with sequential scans, hash joins and
+merge joins turned off, so the check asks "is there an index that can
+serve every lookup?" rather than "is an index worth it on this (maybe
+tiny) table?". SQLite's EXPLAIN QUERY PLAN is used as is.
+"""
+
+import sys
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, select
+
+from models import db, Likes, Message, User
+from user_cache import CURR_USER_KEY
+
+ROUTES = [
+    '/',
+    '/users',
+    '/users/{user_id}',
+    '/users/{user_id}/following',
+    '/users/{user_id}/followers',
+    '/users/{user_id}/likes',
+    '/messages/{message_id}',
+    '/api/v1/timeline',
+    '/api/v1/users/{user_id}',
+    '/api/v1/users/{user_id}/following',
+    '/api/v1/users/{user_id}/followers',
+    '/api/v1/likes?message_ids={message_id}',
+]
+
+
+def init_app(app):
+    """Register the check-indexes CLI command."""
+
+    app.cli.add_command(check_indexes_command)
+
+
+def sample_ids():
+    """A busy user and one of their messages, to request pages for."""
+
+    user_id = db.session.scalar(
+        select(User.id).order_by(User.following_count.desc()).limit(1))
+    message_id = db.session.scalar(
+        select(Message.id).order_by(Message.id.desc()).limit(1))
+    liked_id = db.session.scalar(
+        select(Likes.message_id).where(Likes.user_id == user_id).limit(1))
+    return dict(user_id=user_id, message_id=liked_id or message_id)
+
+
+def capture(path, user_id):
+    """Request `path` as `user_id`.
+
+    Returns [(statement, parameters, engine)] for every SELECT run on the
+    primary or a replica.
+    """
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and context.execution_options.get('full_scan'):
+            return
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters, conn.engine))
+
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = user_id
+
+    engines = set(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        client.get(path)
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
+    return statements
+
+
+def _postgres_full_scans(plan):
+    found = []
+    if plan['Node Type'] == 'Seq Scan' or (
+            plan['Node Type'] in ('Index Scan', 'Index Only Scan')
+            and 'Index Cond' not in plan):
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found.extend(_postgres_full_scans(child))
+    return found
+
+
+def full_scans(statement, parameters, engine=None):
+    """Names of our tables that `statement`'s plan reads in full."""
+
+    engine = engine or db.engine
+    tables = set(db.metadata.tables)
+
+    with engine.connect() as conn:
+        cursor = conn.connection.driver_connection.cursor()
+
+        if engine.dialect.name == 'postgresql':
+            # SET LOCAL ends with this connection's transaction
+            for setting in ('enable_seqscan', 'enable_hashjoin',
+                            'enable_mergejoin'):
+                cursor.execute(f"SET LOCAL {setting} = off")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+            found = _postgres_full_scans(cursor.fetchone()[0][0]['Plan'])
+        else:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            found = [detail.split()[1] for *_, detail in cursor.fetchall()
+                     if detail.startswith('SCAN ') and ' USING ' not in detail]
+
+        conn.rollback()
+
+    return sorted({table for table in found if table in tables})
+
+
+def check(routes=ROUTES):
+    """EXPLAIN every route's queries; returns [(path, statement, tables)]."""
+
+    ids = sample_ids()
+    problems = []
+
+    for route in routes:
+        path = route.format(**ids)
+        for statement, parameters, engine in capture(path, ids['user_id']):
+            tables = full_scans(statement, parameters, engine)
+            if tables:
+                problems.append((path, statement, tables))
+
+    return problems
+
+
+@click.command('check-indexes')
+@with_appcontext
+def check_indexes_command():
+    """EXPLAIN each page's queries and report full table scans."""
+
+    if db.session.scalar(select(User.id).limit(1)) is None:
+        raise click.ClickException("No users to request pages as; seed first.")
+
+    problems = check()
+    for path, statement, tables in problems:
+        click.echo(f"{path}: full scan of {', '.join(tables)}")
+        click.echo(f"    {' '.join(statement.split())}")
+
+    if problems:
+        sys.exit(1)
+    click.echo(f"All queries on {len(ROUTES)} pages use indexes.")
@@ -0,0 +1,380 @@
+"""Offline who-to-follow: `flask recommend-follows` and /users/suggestions.
+
+graph.py answers "who might I follow?" live, from one user's followees.
+This job instead scores every user at once, from both tables:
+
+- friend of friend: how many of the people you follow follow them, and
+- co-like: how many messages you liked that they liked too, leaving out
+  messages with over RECOMMEND_MAX_MESSAGE_LIKES likes, which say little
+  about taste and would pair everyone with everyone,
+
+weighted by RECOMMEND_FOF_WEIGHT and RECOMMEND_COLIKE_WEIGHT. Nobody is
+suggested to themselves or to someone already following them, nor at all
+once deleted. Each user's best RECOMMEND_TOP_K land in follow_suggestions.
+
+Both tables are read once, in bulk, into flat arrays. Users are then
+scored RECOMMEND_CHUNK_SIZE at a time, on a process per core; each chunk's
+rows replace the old ones in one transaction as it comes back, so the
+table is never empty and memory holds only a chunk of scores at a time.
+
+A chunk's scores are two sparse matrix products with numpy and scipy,
+`F[chunk] @ F` and `L[chunk] @ L.T` (F: who follows whom, L: who liked
+what), which is what makes a million users feasible on one box. Where
+they can't be imported the same scores, ties broken the same way, are
+counted in pure Python from graph.Adjacency, which is fine for small
+sites.
+"""
+
+import multiprocessing
+import os
+import time
+from array import array
+from collections import Counter
+from heapq import nlargest
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from graph import Adjacency
+from models import db, Follows, FollowSuggestion, Likes, Message, User
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - optional
+    np = sparse = None
+
+# the job's data, set in the parent before forking so the workers share it
+# copy-on-write instead of each being sent a copy
+_index = None
+
+
+def init_app(app):
+    """Register recommendation config defaults and the CLI command."""
+
+    app.config.setdefault('RECOMMEND_TOP_K', 20)
+    app.config.setdefault('RECOMMEND_CHUNK_SIZE', 10000)
+    # processes scoring chunks; None: one per core
+    app.config.setdefault('RECOMMEND_WORKERS', None)
+    app.config.setdefault('RECOMMEND_FOF_WEIGHT', 1.0)
+    app.config.setdefault('RECOMMEND_COLIKE_WEIGHT', 0.5)
+    app.config.setdefault('RECOMMEND_MAX_MESSAGE_LIKES', 1000)
+
+    app.cli.add_command(recommend_follows_command)
+
+
+def suggestions_for(user_id, limit):
+    """Active users suggested to `user_id` that they don't follow yet,
+    best first."""
+
+    followed = select(Follows.user_being_followed_id).where(
+        Follows.user_following_id == user_id)
+    return (User.active()
+            .join(FollowSuggestion, FollowSuggestion.suggested_id == User.id)
+            .filter(FollowSuggestion.user_id == user_id)
+            .filter(User.id.not_in(followed))
+            .order_by(FollowSuggestion.score.desc(), User.id)
+            .limit(limit)
+            .all())
+
+
+##############################################################################
+# Loading
+
+
+def _load_pairs(first, second):
+    """Every (first, second) row, sorted, as two flat arrays."""
+
+    firsts, seconds = array('i'), array('i')
+    rows = db.session.execute(
+        select(first, second)
+        .order_by(first, second)
+        .execution_options(yield_per=50000))
+    for a, b in rows:
+        firsts.append(a)
+        seconds.append(b)
+    return firsts, seconds
+
+
+class _Index:
+    """Follows, likes and who's active, by user id."""
+
+    def __init__(self, followers, followed, likers, liked, active, size,
+                 messages, config):
+        self.size = size
+        self.active = active
+        self.top_k = config['RECOMMEND_TOP_K']
+        self.fof_weight = config['RECOMMEND_FOF_WEIGHT']
+        self.colike_weight = config['RECOMMEND_COLIKE_WEIGHT']
+
+        # drop likes of viral messages
+        most = config['RECOMMEND_MAX_MESSAGE_LIKES']
+        if np is not None:
+            message_ids = np.frombuffer(liked, dtype=np.int32)
+            like_counts = np.bincount(message_ids, minlength=messages)
+            kept = like_counts[message_ids] <= most
+            if not kept.all():
+                likers = array(
+                    'i', np.frombuffer(likers, dtype=np.int32)[kept].tobytes())
+                liked = array('i', message_ids[kept].tobytes())
+        else:
+            like_counts = Counter(liked)
+            too_popular = {message_id
+                           for message_id, count in like_counts.items()
+                           if count > most}
+            if too_popular:
+                kept = [i for i, message_id in enumerate(liked)
+                        if message_id not in too_popular]
+                likers = array('i', (likers[i] for i in kept))
+                liked = array('i', (liked[i] for i in kept))
+        self.follows = len(followed)
+        self.likes = len(liked)
+
+        if sparse is not None:
+            self._build_matrices(followers, followed, likers, liked, messages)
+        else:
+            self._build_adjacency(followers, followed, likers, liked, messages)
+
+    def _build_adjacency(self, followers, followed, likers, liked, messages):
+        self.following = Adjacency(followers, followed, self.size)
+        self.liked = Adjacency(likers, liked, self.size)
+        # by message; likes come sorted by user, so each run is too
+        self.likers = Adjacency(liked, likers, messages)
+
+    def _build_matrices(self, followers, followed, likers, liked, messages):
+        # float32 ones: counts are exact up to 2 ** 24 at half the memory
+        def matrix(rows, cols, shape):
+            rows = np.frombuffer(rows, dtype=np.int32)
+            cols = np.frombuffer(cols, dtype=np.int32)
+            return sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                shape=shape)
+
+        self.follows_matrix = matrix(followers, followed,
+                                     (self.size, self.size))
+        self.likes_matrix = matrix(likers, liked, (self.size, messages))
+        self.liked_by_matrix = self.likes_matrix.T.tocsr()
+        self.active_mask = np.frombuffer(self.active, dtype=np.bool_)
+
+    def score(self, lo, hi):
+        """[(user_id, [(suggested_id, score), ...]), ...] for ids lo..hi-1."""
+
+        if sparse is not None:
+            return self._score_matrices(lo, hi)
+        return self._score_python(lo, hi)
+
+    def _score_python(self, lo, hi):
+        results = []
+        for user_id in range(lo, hi):
+            if not self.active[user_id]:
+                continue
+
+            following = self.following.neighbours(user_id)
+            fof = Counter()
+            for followee in following:
+                fof.update(self.following.neighbours(followee))
+            colikes = Counter()
+            for message_id in self.liked.neighbours(user_id):
+                colikes.update(self.likers.neighbours(message_id))
+
+            scores = Counter()
+            for counts, weight in ((fof, self.fof_weight),
+                                   (colikes, self.colike_weight)):
+                for other, count in counts.items():
+                    scores[other] += weight * count
+            for seen in (user_id, *following):
+                scores.pop(seen, None)
+
+            best = nlargest(
+                self.top_k,
+                ((score, other) for other, score in scores.items()
+                 if score > 0 and self.active[other]),
+                key=lambda pair: (pair[0], -pair[1]))
+            if best:
+                results.append(
+                    (user_id, [(other, score) for score, other in best]))
+        return results
+
+    def _score_matrices(self, lo, hi):
+        follows = self.follows_matrix[lo:hi]
+        fof = (follows @ self.follows_matrix).astype(np.float64)
+        colikes = (self.likes_matrix[lo:hi]
+                   @ self.liked_by_matrix).astype(np.float64)
+        # weighted in float64, so scores match the pure-Python ones exactly
+        scores = self.fof_weight * fof + self.colike_weight * colikes
+        # zero out themselves and whoever they follow already
+        seen = follows + sparse.eye(hi - lo, self.size, k=lo,
+                                    dtype=np.float32, format='csr')
+        seen.data[:] = 1
+        scores = (scores - scores.multiply(seen)).tocsr()
+        scores.eliminate_zeros()
+
+        results = []
+        for row in range(hi - lo):
+            user_id = lo + row
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            if start == end or not self.active[user_id]:
+                continue
+            others = scores.indices[start:end]
+            values = scores.data[start:end]
+            keep = self.active_mask[others]
+            others, values = others[keep], values[keep]
+            if len(values) > self.top_k:
+                # everyone scoring at least the k-th best, ties included,
+                # so the lexsort below picks among ties by id
+                kth = np.partition(values, -self.top_k)[-self.top_k]
+                keep = values >= kth
+                others, values = others[keep], values[keep]
+            # best first, lower id first on ties
+            order = np.lexsort((others, -values))[:self.top_k]
+            results.append((user_id, list(zip(others[order].tolist(),
+                                              values[order].tolist()))))
+        return results
+
+
+def _score_chunk(bounds):
+    started = time.process_time()
+    results = _index.score(*bounds)
+    return bounds, results, time.process_time() - started
+
+
+##############################################################################
+# Writing
+
+
+def _write_chunk(lo, hi, results):
+    """Replace the suggestions of users lo..hi-1. Returns rows written."""
+
+    rows = [{'user_id': user_id, 'suggested_id': other, 'score': score}
+            for user_id, suggested in results
+            for other, score in suggested]
+
+    for attempt in range(2):
+        db.session.execute(
+            delete(FollowSuggestion)
+            .where(FollowSuggestion.user_id >= lo)
+            .where(FollowSuggestion.user_id < hi))
+        try:
+            if rows:
+                db.session.execute(insert(FollowSuggestion), rows)
+            db.session.commit()
+            return len(rows)
+        except IntegrityError:
+            # someone was purged since we loaded: drop them and go again
+            db.session.rollback()
+            if attempt:
+                raise
+            ids = {row['user_id'] for row in rows} | {
+                row['suggested_id'] for row in rows}
+            existing = set(db.session.scalars(
+                select(User.id).where(User.id.in_(ids))))
+            rows = [row for row in rows
+                    if row['user_id'] in existing
+                    and row['suggested_id'] in existing]
+
+
+##############################################################################
+# The job
+
+
+def recommend(workers=None, chunk_size=None, log=None):
+    """Recompute follow_suggestions for every user.
+
+    Returns a dict of counts and of seconds spent per stage.
+    """
+
+    global _index
+    config = current_app.config
+    workers = workers or config['RECOMMEND_WORKERS'] or os.cpu_count() or 1
+    chunk_size = chunk_size or config['RECOMMEND_CHUNK_SIZE']
+    log = log or (lambda message: None)
+    timings = {}
+    started = time.perf_counter()
+
+    def stage(name, since):
+        timings[name] = time.perf_counter() - since
+        return time.perf_counter()
+
+    now = time.perf_counter()
+    followers, followed = _load_pairs(Follows.user_following_id,
+                                      Follows.user_being_followed_id)
+    now = stage('load follows', now)
+    likers, liked = _load_pairs(Likes.user_id, Likes.message_id)
+    now = stage('load likes', now)
+
+    size = (db.session.scalar(select(func.max(User.id))) or 0) + 1
+    messages = (db.session.scalar(select(func.max(Message.id))) or 0) + 1
+    active = bytearray(size)
+    for (user_id,) in db.session.execute(
+            select(User.id).where(User.deleted_at.is_(None))
+            .execution_options(yield_per=50000)):
+        active[user_id] = 1
+    # the workers don't use the database; don't hold a connection meanwhile
+    db.session.commit()
+    now = stage('load users', now)
+
+    _index = _Index(followers, followed, likers, liked, active, size,
+                    messages, config)
+    del followers, followed, likers, liked
+    now = stage('index', now)
+
+    chunks = [(lo, min(lo + chunk_size, size))
+              for lo in range(0, size, chunk_size)]
+    stats = {'users': sum(active), 'follows': _index.follows,
+             'likes': _index.likes, 'suggestions': 0, 'chunks': len(chunks)}
+    score_seconds = write_seconds = 0.0
+
+    try:
+        if workers > 1 and len(chunks) > 1:
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            done = pool.imap_unordered(_score_chunk, chunks)
+        else:
+            pool = None
+            done = map(_score_chunk, chunks)
+
+        for number, ((lo, hi), results, seconds) in enumerate(done, 1):
+            score_seconds += seconds
+            write_started = time.perf_counter()
+            stats['suggestions'] += _write_chunk(lo, hi, results)
+            write_seconds += time.perf_counter() - write_started
+            log(f"chunk {number}/{len(chunks)} done")
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        _index = None
+
+    timings['score (cpu, all workers)'] = score_seconds
+    timings['write'] = write_seconds
+    timings['score + write (wall)'] = time.perf_counter() - now
+    timings['total'] = time.perf_counter() - started
+    stats['workers'] = workers if pool is not None else 1
+    stats['engine'] = 'scipy' if sparse is not None else 'python'
+    stats['timings'] = timings
+    return stats
+
+
+@click.command('recommend-follows')
+@click.option('--workers', default=None, type=int,
+              help='Scoring processes [default: RECOMMEND_WORKERS, '
+                   'or one per core].')
+@click.option('--chunk-size', default=None, type=int,
+              help='Users scored per chunk [default: RECOMMEND_CHUNK_SIZE].')
+@click.option('--verbose', is_flag=True, help='Report each chunk.')
+@with_appcontext
+def recommend_follows_command(workers, chunk_size, verbose):
+    """Recompute every user's who-to-follow suggestions."""
+
+    stats = recommend(workers=workers, chunk_size=chunk_size,
+                      log=click.echo if verbose else None)
+    click.echo(
+        f"Wrote {stats['suggestions']} suggestions for {stats['users']} "
+        f"users from {stats['follows']} follows and {stats['likes']} likes "
+        f"({stats['engine']}, {stats['workers']} workers, "
+        f"{stats['chunks']} chunks).")
+    for name, seconds in stats['timings'].items():
+        click.echo(f"  {name:<26} {seconds:8.2f}s")
@@ -0,0 +1,97 @@
+"""Send read-only views' queries to read replicas.
+
+List replica URIs in SQLALCHEMY_REPLICA_URIS (DATABASE_REPLICA_URLS in
+the environment, comma separated). Each becomes a Flask-SQLAlchemy bind,
+`replica-0`, `replica-1`, ..., with the primary's engine options.
+
+A view decorated with `@read_only` reads from one replica, picked at
+random per request; everything else -- other views, CLI commands, and
+any flush or UPDATE / INSERT / DELETE even inside a read-only view -- uses
+the primary.
+
+Replicas lag the primary, so a browser that just made a change would not
+see it on the next page. After any request that can write (anything but
+GET / HEAD / OPTIONS) the browser's session is pinned to the primary for
+REPLICA_STICKY_SECONDS, which should cover normal replication lag.
+"""
+
+import functools
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
+
+# session key: until when (epoch seconds) this browser reads the primary
+PRIMARY_UNTIL_KEY = '_primary_until'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def init_app(app):
+    """Register replica binds and the stickiness hook.
+
+    Call before `db.init_app`, which creates the engines for the binds.
+    """
+
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for index, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS']):
+        binds[f'replica-{index}'] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    app.after_request(_stick_to_primary)
+
+
+def replica_keys():
+    return [key for key in current_app.config['SQLALCHEMY_BINDS']
+            if key.startswith('replica-')]
+
+
+def read_only(view):
+    """Mark a view as safe to serve from a read replica."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g._read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def _replica_key():
+    """The bind key of this request's replica, or None for the primary."""
+
+    if not has_request_context() or not g.get('_read_only'):
+        return None
+    if session.get(PRIMARY_UNTIL_KEY, 0) > time.time():
+        return None
+
+    if '_replica' not in g:
+        keys = replica_keys()
+        g._replica = random.choice(keys) if keys else None
+    return g._replica
+
+
+def _stick_to_primary(response):
+    if request.method not in SAFE_METHODS and replica_keys():
+        session[PRIMARY_UNTIL_KEY] = (
+            time.time() + current_app.config['REPLICA_STICKY_SECONDS'])
+    return response
+
+
+class RoutingSession(Session):
+    """Session that reads from a replica inside read-only views."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing
+                and (clause is None or isinstance(clause, Select))):
+            key = _replica_key()
+            if key is not None:
+                return self._db.engines[key]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
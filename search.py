@@ -0,0 +1,307 @@
+"""User search for /users?q= and username autocomplete.
+
+Searching used to be `username LIKE '%q%'`, a full table scan every time.
+Search now goes through a backend with its own index:
+
+- PostgresTrigramBackend: a GIN trigram index (pg_trgm) on lower(username)
+  answers the contains-match, ranked by trigram similarity, and a
+  text_pattern_ops btree answers prefix autocomplete. Without pg_trgm it
+  still uses the prefix index and ranks exact > prefix > contains.
+- NgramIndexBackend: an in-process n-gram inverted index, for SQLite and
+  test runs. Each process builds its own copy on first use and keeps it
+  current from the user signals.
+
+`SEARCH_BACKEND` picks one: 'auto' (by database dialect), 'postgres' or
+'memory'. The Postgres indexes come from migration 0007 (`flask migrate`).
+
+Hits are ranked by a key that ends in the user id, and a page starts
+after the last hit of the one before (`after`), so no backend sorts and
+throws away every earlier page the way OFFSET would.
+"""
+
+import bisect
+from collections import defaultdict
+from threading import Lock
+
+from flask import current_app
+from sqlalchemy import case, func, select, text, tuple_
+from sqlalchemy.orm import aliased
+
+from models import db, User
+from signals import profile_updated, user_created, user_deleted
+
+
+def init_app(app):
+    """Register search config defaults, index receivers and CLI command."""
+
+    app.config.setdefault('SEARCH_BACKEND', 'auto')
+    app.config.setdefault('USERS_PAGE_SIZE', 30)
+    app.config.setdefault('AUTOCOMPLETE_LIMIT', 10)
+
+    user_created.connect(_on_user_changed)
+    profile_updated.connect(_on_user_changed)
+    user_deleted.connect(_on_user_deleted)
+
+
+def get_backend():
+    """The search backend for the current app, created on first use."""
+
+    backends = current_app.extensions.setdefault('search', {})
+    name = current_app.config['SEARCH_BACKEND']
+    if name == 'auto':
+        name = 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+
+    if name not in backends:
+        backends[name] = BACKENDS[name]()
+    return backends[name]
+
+
+class SearchResults:
+    """One page of ranked search hits.
+
+    `next_after` is the id to pass as `after` for the next page, or None
+    on the last one.
+    """
+
+    def __init__(self, users, next_after):
+        self.users = users
+        self.next_after = next_after
+
+
+def _escape_like(value):
+    return (value.replace('\\', '\\\\')
+                 .replace('%', '\\%')
+                 .replace('_', '\\_'))
+
+
+class PostgresTrigramBackend:
+    """Search backed by indexes inside PostgreSQL."""
+
+    def __init__(self):
+        self._has_trgm = None
+
+    def has_trgm(self):
+        """Is the pg_trgm extension installed? Checked once per process."""
+
+        if self._has_trgm is None:
+            self._has_trgm = db.session.scalar(text(
+                "SELECT EXISTS "
+                "(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"))
+        return self._has_trgm
+
+    def _rank(self, user, needle):
+        """Ascending sort key of `user`'s hits, ending in its id."""
+
+        name = func.lower(user.username)
+        if self.has_trgm():
+            return [-func.similarity(name, needle), user.id]
+        return [case((name == needle, 0),
+                     (name.like(f"{_escape_like(needle)}%", escape='\\'), 1),
+                     else_=2),
+                func.length(name),
+                user.id]
+
+    def search(self, q, after=None, per_page=30):
+        needle = q.lower()
+        rank = self._rank(User, needle)
+
+        query = (select(User)
+                 .where(func.lower(User.username)
+                        .like(f"%{_escape_like(needle)}%", escape='\\'))
+                 .where(User.deleted_at.is_(None)))
+        if after is not None:
+            last = aliased(User)
+            query = query.where(tuple_(*rank) > (
+                select(*self._rank(last, needle))
+                .where(last.id == after)
+                .scalar_subquery()))
+
+        users = db.session.scalars(
+            query.order_by(*rank).limit(per_page + 1)).all()
+
+        if len(users) > per_page:
+            return SearchResults(users[:per_page], users[per_page - 1].id)
+        return SearchResults(users, None)
+
+    def autocomplete(self, prefix, limit=10):
+        name = func.lower(User.username)
+        return db.session.execute(
+            select(User.id, User.username, User.image_url)
+            .where(name.like(f"{_escape_like(prefix.lower())}%", escape='\\'))
+            .where(User.deleted_at.is_(None))
+            .order_by(name)
+            .limit(limit)).all()
+
+    # the database keeps its own indexes current
+
+    def add(self, user_id, username):
+        pass
+
+    def remove(self, user_id):
+        pass
+
+
+def _trigrams(word):
+    """pg_trgm-style trigrams: the word padded with two leading blanks."""
+
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Share of trigrams two words have in common, as pg_trgm computes it."""
+
+    a, b = _trigrams(a), _trigrams(b)
+    return len(a & b) / len(a | b)
+
+
+class NgramIndexBackend:
+    """In-process inverted index from 1-, 2- and 3-grams to user ids.
+
+    A contains-query is answered by intersecting the postings of its
+    n-grams (or looking up the query itself when it is shorter than 3
+    characters) and then checking the few candidates left. Prefix lookups
+    bisect a sorted list of lowercased usernames.
+    """
+
+    N = 3
+
+    def __init__(self):
+        self._lock = Lock()
+        self._built = False
+        self._postings = defaultdict(set)
+        self._names = {}
+        self._sorted = []
+
+    @classmethod
+    def _grams(cls, name):
+        return {name[i:i + n]
+                for n in range(1, cls.N + 1)
+                for i in range(len(name) - n + 1)}
+
+    def rebuild(self):
+        """Rebuild the whole index from the users table."""
+
+        rows = db.session.execute(
+            select(User.id, User.username)
+            .where(User.deleted_at.is_(None))).all()
+        with self._lock:
+            self._postings.clear()
+            self._names.clear()
+            self._sorted = []
+            for user_id, username in rows:
+                self._add(user_id, username)
+            self._sorted.sort()
+            self._built = True
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def _add(self, user_id, username):
+        name = username.lower()
+        self._names[user_id] = name
+        self._sorted.append((name, user_id))
+        for gram in self._grams(name):
+            self._postings[gram].add(user_id)
+
+    def _remove(self, user_id):
+        name = self._names.pop(user_id, None)
+        if name is None:
+            return
+        self._sorted.remove((name, user_id))
+        for gram in self._grams(name):
+            self._postings[gram].discard(user_id)
+
+    def add(self, user_id, username):
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(user_id)
+            name = username.lower()
+            self._names[user_id] = name
+            bisect.insort(self._sorted, (name, user_id))
+            for gram in self._grams(name):
+                self._postings[gram].add(user_id)
+
+    def remove(self, user_id):
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(user_id)
+
+    def _candidates(self, needle):
+        if len(needle) <= self.N:
+            return set(self._postings.get(needle, ()))
+
+        grams = [needle[i:i + self.N]
+                 for i in range(len(needle) - self.N + 1)]
+        postings = sorted((self._postings.get(gram, set()) for gram in grams),
+                          key=len)
+        return {user_id for user_id in set.intersection(*postings)
+                if needle in self._names[user_id]}
+
+    def search(self, q, after=None, per_page=30):
+        self._ensure_built()
+        needle = q.lower()
+
+        start = 0
+        if after is not None:
+            # from the database: the last hit may have left the index since
+            last = db.session.scalar(
+                select(User.username).where(User.id == after))
+            if last is None:
+                return SearchResults([], None)
+
+        with self._lock:
+            ranked = sorted((-similarity(needle, self._names[user_id]), user_id)
+                            for user_id in self._candidates(needle))
+        if after is not None:
+            start = bisect.bisect_right(
+                ranked, (-similarity(needle, last.lower()), after))
+
+        ids = [user_id for _, user_id in ranked[start:start + per_page]]
+        found = {user.id: user
+                 for user in db.session.scalars(
+                     select(User).where(User.id.in_(ids)))}
+
+        # ids the index knows but the database doesn't are dropped
+        users = [found[user_id] for user_id in ids if user_id in found]
+        more = len(ranked) > start + per_page
+        return SearchResults(users, ids[-1] if more else None)
+
+    def autocomplete(self, prefix, limit=10):
+        self._ensure_built()
+        prefix = prefix.lower()
+
+        with self._lock:
+            start = bisect.bisect_left(self._sorted, (prefix,))
+            ids = []
+            for name, user_id in self._sorted[start:]:
+                if not name.startswith(prefix) or len(ids) == limit:
+                    break
+                ids.append(user_id)
+
+        rows = {row.id: row for row in db.session.execute(
+            select(User.id, User.username, User.image_url)
+            .where(User.id.in_(ids)))}
+        return [rows[user_id] for user_id in ids if user_id in rows]
+
+
+BACKENDS = {
+    'postgres': PostgresTrigramBackend,
+    'memory': NgramIndexBackend,
+}
+
+
+##############################################################################
+# Signal receivers
+
+
+def _on_user_changed(app, user):
+    db.session.flush()
+    get_backend().add(user.id, user.username)
+
+
+def _on_user_deleted(app, user):
+    get_backend().remove(user.id)
@@ -1,20 +1,312 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+Streams every `<table>*.csv` file in the data directory (generator/ by
+default) into its table a chunk at a time, so memory stays flat however
+big the dataset is:
 
+- PostgreSQL loads each chunk with COPY; other databases use a batched
+  executemany.
+- Secondary indexes, unique and foreign-key constraints are dropped
+  before loading and rebuilt once at the end, which is far cheaper than
+  maintaining them row by row.
+- Each chunk commits together with a progress row, so an interrupted
+  load picks up where it stopped with `--resume`.
 
-db.drop_all()
-db.create_all()
+    python seed.py
+    python seed.py --data-dir /data/staging --chunk-size 200000
+    python seed.py --resume
+"""
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import time
+from datetime import datetime
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+from sqlalchemy import DateTime, Integer, inspect, text
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+from app import app, db
+import counters
+import migrations
+import timeline
 
-db.session.commit()
+# in load order, parents before children
+TABLES = ['users', 'messages', 'follows', 'likes']
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+##############################################################################
+# Bookkeeping: progress and deferred DDL live in the database itself, so
+# they commit atomically with the rows they describe.
+
+
+def create_bookkeeping(conn):
+    conn.execute(text(
+        "CREATE TABLE seed_progress "
+        "(path TEXT PRIMARY KEY, rows_loaded INTEGER NOT NULL)"))
+    conn.execute(text(
+        "CREATE TABLE seed_deferred "
+        "(position INTEGER PRIMARY KEY, statement TEXT NOT NULL)"))
+
+
+def drop_bookkeeping(conn):
+    conn.execute(text("DROP TABLE IF EXISTS seed_progress"))
+    conn.execute(text("DROP TABLE IF EXISTS seed_deferred"))
+
+
+def rows_loaded(conn, path):
+    loaded = conn.execute(
+        text("SELECT rows_loaded FROM seed_progress WHERE path = :path"),
+        dict(path=path)).scalar()
+    return loaded or 0
+
+
+def record_progress(conn, path, loaded):
+    updated = conn.execute(
+        text("UPDATE seed_progress SET rows_loaded = :rows "
+             "WHERE path = :path"),
+        dict(path=path, rows=loaded))
+    if not updated.rowcount:
+        conn.execute(
+            text("INSERT INTO seed_progress (path, rows_loaded) "
+                 "VALUES (:path, :rows)"),
+            dict(path=path, rows=loaded))
+
+
+##############################################################################
+# Deferring indexes and constraints
+
+
+def _postgres_deferrable(conn, tables):
+    """(drop statements, restore statements) for FKs, uniques, indexes."""
+
+    in_schema = ("relnamespace = "
+                 "(SELECT oid FROM pg_namespace WHERE nspname = current_schema())")
+    constraints = conn.execute(text(
+        "SELECT t.relname, c.conname, pg_get_constraintdef(c.oid), c.contype "
+        "FROM pg_constraint c JOIN pg_class t ON t.oid = c.conrelid "
+        f"WHERE t.relname = ANY(:tables) AND t.{in_schema} "
+        "AND c.contype IN ('f', 'u') "
+        # foreign keys go first, since they depend on unique indexes
+        "ORDER BY c.contype, c.conname"),
+        dict(tables=tables)).all()
+    indexes = conn.execute(text(
+        "SELECT i.relname, pg_get_indexdef(i.oid) "
+        "FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid "
+        "JOIN pg_class t ON t.oid = x.indrelid "
+        f"WHERE t.relname = ANY(:tables) AND t.{in_schema} "
+        "AND NOT x.indisprimary "
+        "AND NOT EXISTS "
+        "(SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid) "
+        "ORDER BY i.relname"),
+        dict(tables=tables)).all()
+
+    drops = ([f'ALTER TABLE "{table}" DROP CONSTRAINT "{name}"'
+              for table, name, _, _ in constraints]
+             + [f'DROP INDEX "{name}"' for name, _ in indexes])
+    restores = ([definition for _, definition in indexes]
+                + [f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}'
+                   for table, name, definition, _ in reversed(constraints)])
+    return drops, restores
+
+
+def _sqlite_deferrable(conn, tables):
+    """SQLite can't drop constraints, but named indexes can go."""
+
+    indexes = conn.execute(text(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND sql IS NOT NULL "
+        "AND tbl_name IN (SELECT value FROM json_each(:tables))"),
+        dict(tables=json.dumps(tables))).all()
+    return ([f'DROP INDEX "{name}"' for name, _ in indexes],
+            [sql for _, sql in indexes])
+
+
+def defer_constraints(conn):
+    """Drop secondary indexes and constraints, saving how to restore them."""
+
+    tables = list(db.metadata.tables)
+    if is_postgres():
+        drops, restores = _postgres_deferrable(conn, tables)
+    elif db.engine.dialect.name == 'sqlite':
+        drops, restores = _sqlite_deferrable(conn, tables)
+    else:
+        drops, restores = [], []
+
+    for position, statement in enumerate(restores):
+        conn.execute(
+            text("INSERT INTO seed_deferred (position, statement) "
+                 "VALUES (:position, :statement)"),
+            dict(position=position, statement=statement))
+    for statement in drops:
+        conn.execute(text(statement))
+
+    return len(drops)
+
+
+def restore_constraints(conn):
+    statements = conn.execute(text(
+        "SELECT statement FROM seed_deferred ORDER BY position")).scalars()
+    for statement in list(statements):
+        started = time.perf_counter()
+        conn.execute(text(statement))
+        print(f"  {statement[:72]} ({time.perf_counter() - started:.1f}s)")
+
+
+##############################################################################
+# Loading
+
+
+def _converters(table, columns):
+    """Turn CSV strings into values the generic insert path accepts."""
+
+    def convert(column_type):
+        if isinstance(column_type, DateTime):
+            return lambda value: datetime.fromisoformat(value) if value else None
+        if isinstance(column_type, Integer):
+            return lambda value: int(value) if value else None
+        return lambda value: value if value != '' else None
+
+    sql_table = db.metadata.tables[table]
+    return [convert(sql_table.columns[name].type) for name in columns]
+
+
+def _copy_chunk(conn, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = conn.connection.driver_connection.cursor()
+    cursor.copy_expert(
+        f'COPY "{table}" ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)',
+        buffer)
+
+
+def _insert_chunk(conn, table, columns, rows, converters):
+    records = [{name: convert(value)
+                for name, convert, value in zip(columns, converters, row)}
+               for row in rows]
+    conn.execute(db.metadata.tables[table].insert(), records)
+
+
+def load_file(table, path, chunk_size):
+    """Stream one CSV file into `table`; returns rows loaded this run."""
+
+    with db.engine.connect() as conn:
+        skip = rows_loaded(conn, path)
+
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        columns = next(reader)
+        converters = _converters(table, columns)
+
+        for _ in range(skip):
+            next(reader)
+        if skip:
+            print(f"  {path}: resuming after {skip} rows")
+
+        loaded = skip
+        started = time.perf_counter()
+
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader)]
+            if not rows:
+                break
+
+            with db.engine.begin() as conn:
+                if is_postgres():
+                    _copy_chunk(conn, table, columns, rows)
+                else:
+                    _insert_chunk(conn, table, columns, rows, converters)
+                loaded += len(rows)
+                record_progress(conn, path, loaded)
+
+            rate = (loaded - skip) / (time.perf_counter() - started)
+            print(f"  {path}: {loaded} rows ({rate:,.0f} rows/sec)")
+
+    return loaded - skip
+
+
+def finish():
+    """Rebuild what the bulk load skipped or bypassed."""
+
+    with db.engine.begin() as conn:
+        if is_postgres():
+            for table in TABLES:
+                if 'id' in db.metadata.tables[table].columns:
+                    conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 0) + 1, "
+                        "false)"))
+        conn.execute(text("ANALYZE"))
+
+    # bulk loads bypass the counter and timeline signals
+    started = time.perf_counter()
+    counters.reconcile()
+    print(f"Reconciled counters ({time.perf_counter() - started:.1f}s)")
+
+    if timeline.is_enabled():
+        started = time.perf_counter()
+        timeline.backfill()
+        print(f"Backfilled timelines ({time.perf_counter() - started:.1f}s)")
+
+
+def seed(data_dir='generator', chunk_size=50000, resume=False):
+    started = time.perf_counter()
+
+    if resume:
+        if not inspect(db.engine).has_table('seed_progress'):
+            raise SystemExit("Nothing to resume: no interrupted load found.")
+    else:
+        db.drop_all()
+        db.create_all()
+        migrations.stamp()
+        with db.engine.begin() as conn:
+            drop_bookkeeping(conn)
+            create_bookkeeping(conn)
+            deferred = defer_constraints(conn)
+        print(f"Deferred {deferred} indexes and constraints")
+
+    total = 0
+    for table in TABLES:
+        for path in sorted(glob.glob(os.path.join(data_dir, f"{table}*.csv"))):
+            total += load_file(table, path, chunk_size)
+
+    load_seconds = time.perf_counter() - started
+    print(f"Loaded {total} rows in {load_seconds:.1f}s "
+          f"({total / max(load_seconds, 1e-9):,.0f} rows/sec)")
+
+    print("Restoring indexes and constraints")
+    with db.engine.begin() as conn:
+        restore_constraints(conn)
+        drop_bookkeeping(conn)
+
+    finish()
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load generator CSVs into the database.")
+    parser.add_argument('--data-dir', default='generator',
+                        help='directory holding <table>*.csv files')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='rows per COPY / insert batch and commit')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted load instead of '
+                             'starting over')
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.data_dir, args.chunk_size, args.resume)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Signals sent when users post, follow, like and delete things.
+
+Routes send these *before* committing, so receivers that write to the
+database take part in the same transaction as the change itself.
+
+Every signal is sent with the Flask app as sender and the acting user
+as the `user` keyword argument.
+"""
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+# kwargs: user -- sent after the user is added to the session
+user_created = _signals.signal('user-created')
+
+# kwargs: user, message
+message_posted = _signals.signal('message-posted')
+
+# kwargs: user, followed
+follow_added = _signals.signal('follow-added')
+
+# kwargs: user, followed
+follow_removed = _signals.signal('follow-removed')
+
+# kwargs: user, message -- sent before the message is deleted
+message_deleted = _signals.signal('message-deleted')
+
+# kwargs: user, message
+like_added = _signals.signal('like-added')
+
+# kwargs: user, message
+like_removed = _signals.signal('like-removed')
+
+# kwargs: user -- sent before the user is deleted
+user_deleted = _signals.signal('user-deleted')
+
+# kwargs: user -- sent after the new values are set, before commit
+profile_updated = _signals.signal('profile-updated')
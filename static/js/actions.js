@@ -0,0 +1,54 @@
+// Like / unlike and follow / unfollow in place, instead of posting the
+// form and reloading the whole page.
+
+(function () {
+  const LIKE = /^\/users\/\d+\/(add-like|un-like)$/;
+  const FOLLOW = /^\/users\/(follow|stop-following)\/(\d+)$/;
+
+  // point every follow button for `userId` on the page at the new state
+  function showFollowing(userId, following) {
+    for (const form of document.querySelectorAll("form[action]")) {
+      const match = new URL(form.action).pathname.match(FOLLOW);
+      if (!match || match[2] !== String(userId)) continue;
+
+      const button = form.querySelector("button");
+      form.action = (following ? "/users/stop-following/" : "/users/follow/") + userId;
+      button.textContent = following ? "Unfollow" : "Follow";
+      button.classList.toggle("btn-primary", following);
+      button.classList.toggle("btn-outline-primary", !following);
+    }
+  }
+
+  document.addEventListener("submit", async function (event) {
+    const form = event.target;
+    const path = new URL(form.action).pathname;
+    const isLike = LIKE.test(path);
+    if (!isLike && !FOLLOW.test(path)) return;
+
+    event.preventDefault();
+    const button = form.querySelector("button");
+    button.disabled = true;
+    try {
+      const resp = await fetch(form.action, {
+        method: "POST",
+        body: new FormData(form),
+        // the like button comes back as HTML, follows as JSON
+        headers: isLike ? { "X-Requested-With": "fetch" } : { Accept: "application/json" },
+      });
+      if (resp.status === 401) {
+        location.href = "/login";
+        return;
+      }
+      if (!resp.ok) return;
+
+      if (isLike) {
+        form.outerHTML = await resp.text();
+      } else {
+        const state = await resp.json();
+        showFollowing(state.user_id, state.following);
+      }
+    } finally {
+      button.disabled = false;
+    }
+  });
+})();
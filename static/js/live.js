@@ -0,0 +1,44 @@
+// Add new home feed messages as they're posted, without reloading.
+
+(function () {
+  document.addEventListener("DOMContentLoaded", function () {
+    const list = document.getElementById("messages");
+    if (!list || !list.dataset.liveCursor) return;
+
+    let cursor = list.dataset.liveCursor;
+    const interval = Number(list.dataset.liveInterval) * 1000;
+
+    function show(update) {
+      if (update.more) {
+        // more than a page behind: start over
+        location.reload();
+        return;
+      }
+      if (update.html) list.insertAdjacentHTML("afterbegin", update.html);
+      cursor = update.cursor;
+    }
+
+    async function poll() {
+      try {
+        const resp = await fetch("/timeline/updates?after=" + encodeURIComponent(cursor));
+        if (resp.ok) show(await resp.json());
+      } finally {
+        setTimeout(poll, interval);
+      }
+    }
+
+    if (list.dataset.liveMode !== "sse" || !window.EventSource) {
+      setTimeout(poll, interval);
+      return;
+    }
+
+    const source = new EventSource("/timeline/stream?after=" + encodeURIComponent(cursor));
+    source.addEventListener("messages", function (event) {
+      show(JSON.parse(event.data));
+    });
+    source.addEventListener("error", function () {
+      // refused (e.g. too many streams) rather than dropped: poll instead
+      if (source.readyState === EventSource.CLOSED) setTimeout(poll, interval);
+    });
+  });
+})();
@@ -0,0 +1,35 @@
+// Suggest usernames in the nav search box as the user types.
+
+(function () {
+  const DELAY_MS = 150;
+
+  document.addEventListener("DOMContentLoaded", function () {
+    const input = document.getElementById("search");
+    const list = document.getElementById("search-suggestions");
+    if (!input || !list) return;
+
+    let timer = null;
+
+    input.addEventListener("input", function () {
+      clearTimeout(timer);
+      const q = input.value.trim();
+      if (!q) {
+        list.innerHTML = "";
+        return;
+      }
+
+      timer = setTimeout(async function () {
+        const resp = await fetch("/users/autocomplete?q=" + encodeURIComponent(q));
+        if (!resp.ok) return;
+
+        const users = await resp.json();
+        list.innerHTML = "";
+        for (const user of users) {
+          const option = document.createElement("option");
+          option.value = user.username;
+          list.appendChild(option);
+        }
+      }, DELAY_MS);
+    });
+  });
+})();
@@ -0,0 +1,151 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import user_cache
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        user_cache.clear()
+
+        self.users = [User.signup(username=f"user{i}",
+                                  email=f"user{i}@test.com",
+                                  password="password", image_url=None)
+                      for i in range(4)]
+        db.session.commit()
+        self.me, self.friend, self.stranger, self.fan = self.users
+
+        db.session.add_all([
+            Follows(user_following_id=self.me.id,
+                    user_being_followed_id=self.friend.id),
+            Follows(user_following_id=self.me.id,
+                    user_being_followed_id=self.fan.id),
+            Follows(user_following_id=self.fan.id,
+                    user_being_followed_id=self.me.id),
+        ])
+        self.messages = [Message(text=f"message {i}", user_id=user.id)
+                         for i, user in enumerate(self.users)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+        db.session.add(Likes(user_id=self.me.id,
+                             message_id=self.messages[1].id))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def log_in(self):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.me.id
+
+    def test_timeline(self):
+        self.assertEqual(self.client.get('/api/v1/timeline').status_code, 401)
+
+        self.log_in()
+        data = self.client.get('/api/v1/timeline').get_json()
+        texts = {msg['text'] for msg in data['messages']}
+        self.assertEqual(texts, {'message 0', 'message 1', 'message 3'})
+
+        by_text = {msg['text']: msg for msg in data['messages']}
+        self.assertTrue(by_text['message 1']['liked'])
+        self.assertFalse(by_text['message 0']['liked'])
+        self.assertEqual(by_text['message 1']['user'],
+                         dict(id=self.friend.id, username='user1',
+                              image_url=self.friend.image_url))
+        self.assertTrue(by_text['message 1']['timestamp'].endswith('Z'))
+
+    def test_timeline_pages_and_fields(self):
+        self.log_in()
+        first = self.client.get('/api/v1/timeline?limit=2&fields=id,user'
+                                '&user_fields=username').get_json()
+        self.assertEqual(len(first['messages']), 2)
+        self.assertEqual(set(first['messages'][0]), {'id', 'user'})
+        self.assertEqual(set(first['messages'][0]['user']), {'username'})
+
+        rest = self.client.get(
+            f"/api/v1/timeline?limit=2&before={first['next']}").get_json()
+        self.assertEqual(len(rest['messages']), 1)
+        self.assertIsNone(rest['next'])
+
+        resp = self.client.get('/api/v1/timeline?fields=id,password')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('password', resp.get_json()['error'])
+
+    def test_profile(self):
+        self.log_in()
+        data = self.client.get(f'/api/v1/users/{self.friend.id}'
+                               '?message_fields=text').get_json()
+
+        self.assertEqual(data['user']['username'], 'user1')
+        self.assertEqual(data['user']['followers_count'],
+                         self.friend.followers_count)
+        self.assertNotIn('password', data['user'])
+        self.assertNotIn('email', data['user'])
+        self.assertTrue(data['following'])
+        self.assertEqual(data['messages'], [dict(text='message 1')])
+
+        resp = self.client.get('/api/v1/users/999999999')
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn('error', resp.get_json())
+
+    def test_bulk_users(self):
+        ids = f'{self.stranger.id},999999999,{self.me.id}'
+        data = self.client.get(f'/api/v1/users?ids={ids}'
+                               '&fields=username').get_json()
+        self.assertEqual(data['users'], [dict(username='user2'),
+                                         dict(username='user0')])
+
+        self.assertEqual(self.client.get('/api/v1/users?ids=1,x').status_code,
+                         400)
+        too_many = ','.join(str(i) for i in range(101))
+        self.assertEqual(
+            self.client.get(f'/api/v1/users?ids={too_many}').status_code, 400)
+
+    def test_like_state(self):
+        self.log_in()
+        ids = [msg.id for msg in self.messages[:3]]
+        data = self.client.get('/api/v1/likes?message_ids='
+                               + ','.join(map(str, ids))).get_json()
+        self.assertEqual(data['liked'], {str(ids[0]): False,
+                                         str(ids[1]): True,
+                                         str(ids[2]): False})
+
+    def test_follow_pages(self):
+        url = f'/api/v1/users/{self.me.id}/following?limit=1'
+        first = self.client.get(url).get_json()
+        self.assertEqual(first['users'], [dict(id=self.friend.id,
+                                               username='user1',
+                                               image_url=self.friend.image_url)])
+
+        rest = self.client.get(f"{url}&after={first['next']}").get_json()
+        self.assertEqual([user['id'] for user in rest['users']],
+                         [self.fan.id])
+        self.assertIsNone(rest['next'])
+
+        data = self.client.get(
+            f'/api/v1/users/{self.me.id}/followers?fields=id').get_json()
+        self.assertEqual(data['users'], [dict(id=self.fan.id)])
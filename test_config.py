@@ -0,0 +1,58 @@
+"""Configuration profile tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_config.py
+
+
+import os
+from unittest import TestCase
+
+from flask import g
+from sqlalchemy.pool import NullPool
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+import config
+from app import create_app
+from models import db
+
+
+class ConfigTestCase(TestCase):
+    """Test profile selection and the production profile."""
+
+    def test_get_profile(self):
+        self.assertIs(config.get_profile('production'), config.ProductionConfig)
+
+        os.environ['WARBLER_ENV'] = 'testing'
+        try:
+            self.assertIs(config.get_profile(), config.TestingConfig)
+        finally:
+            del os.environ['WARBLER_ENV']
+        self.assertIs(config.get_profile(), config.DevelopmentConfig)
+
+        with self.assertRaises(ValueError):
+            config.get_profile('staging')
+
+    def test_production_app(self):
+        app = create_app('production')
+
+        # no METRICS_TOKEN, no metrics
+        self.assertEqual(app.test_client().get('/__metrics').status_code, 404)
+        self.assertNotIn('debugtoolbar', app.extensions)
+        with app.app_context():
+            pool = db.engine.pool
+            self.assertNotIsInstance(pool, NullPool)
+            self.assertEqual(pool.size(), config.ProductionConfig
+                             .SQLALCHEMY_ENGINE_OPTIONS['pool_size'])
+
+    def test_requests_get_their_own_g(self):
+        """No profile leaves an app context pushed for requests to share."""
+
+        for profile in ('development', 'production'):
+            app = create_app(profile)
+            with app.test_request_context('/'):
+                g.leftover = True
+            with app.test_request_context('/'):
+                self.assertNotIn('leftover', g, profile)
+
@@ -0,0 +1,111 @@
+"""Denormalized user counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['USER_PURGE_IN_BACKGROUND'] = False
+
+
+class CountersTestCase(TestCase):
+    """Test counters follow the routes and reconcile fixes drift."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        self.user = User(email="count@test.com", username="counter",
+                         password="HASHED_PASSWORD")
+        self.other = User(email="other@test.com", username="other",
+                          password="HASHED_PASSWORD")
+        db.session.add_all([self.user, self.other])
+        db.session.commit()
+        self.user_id, self.other_id = self.user.id, self.other.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self, user_id):
+        user = db.session.get(User, user_id)
+        db.session.refresh(user)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def login(self, client, user_id):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+
+    def test_routes_keep_counters_current(self):
+        """Posting, following and liking adjust counters; undoing reverts"""
+        with self.client as client:
+            self.login(client, self.other_id)
+            client.post('/messages/new', data={'text': 'count me'})
+            msg = Message.query.filter_by(text='count me').one()
+
+            self.login(client, self.user_id)
+            client.post(f'/users/follow/{self.other_id}')
+            client.post(f'/users/{msg.id}/add-like')
+            client.post(f'/users/{msg.id}/add-like')
+
+            self.assertEqual(self.counts(self.user_id), (0, 1, 0, 1))
+            self.assertEqual(self.counts(self.other_id), (1, 0, 1, 0))
+
+            client.post(f'/users/{msg.id}/un-like')
+            client.post(f'/users/stop-following/{self.other_id}')
+
+            self.assertEqual(self.counts(self.user_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.other_id), (1, 0, 0, 0))
+
+    def test_deletes_adjust_counters(self):
+        """Deleting a message or a user fixes up everyone else's counters"""
+        with self.client as client:
+            self.login(client, self.other_id)
+            client.post('/messages/new', data={'text': 'doomed'})
+            client.post('/messages/new', data={'text': 'also doomed'})
+            doomed, also = Message.query.order_by(Message.id).all()
+
+            self.login(client, self.user_id)
+            client.post(f'/users/follow/{self.other_id}')
+            client.post(f'/users/{doomed.id}/add-like')
+            client.post(f'/users/{also.id}/add-like')
+
+            self.login(client, self.other_id)
+            client.post(f'/messages/{doomed.id}/delete')
+            self.assertEqual(self.counts(self.other_id), (1, 0, 1, 0))
+            self.assertEqual(self.counts(self.user_id), (0, 1, 0, 1))
+
+            client.post('/users/delete')
+            self.assertEqual(self.counts(self.user_id), (0, 0, 0, 0))
+
+    def test_reconcile(self):
+        """Reconcile recomputes counters that bypassed the routes"""
+        self.user.following.append(self.other)
+        msg = Message(text='direct', user_id=self.other_id)
+        db.session.add(msg)
+        db.session.commit()
+        db.session.add(Likes(user_id=self.user_id, message_id=msg.id))
+        db.session.commit()
+
+        self.assertEqual(counters.reconcile(batch_size=1), 2)
+        self.assertEqual(self.counts(self.user_id), (0, 1, 0, 1))
+        self.assertEqual(self.counts(self.other_id), (1, 0, 1, 0))
+        self.assertEqual(counters.reconcile(), 0)
@@ -0,0 +1,197 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deletion.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+import deletion
+import fragments
+import user_cache
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['USER_PURGE_IN_BACKGROUND'] = False
+
+
+class DeletionTestCase(TestCase):
+    """Test deleted accounts vanish at once and are purged in batches."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        user_cache.clear()
+        fragments.backend().clear()
+
+        self.doomed = User.signup(username="doomed", email="doomed@test.com",
+                                  password="password", image_url=None)
+        self.fan = User.signup(username="fan", email="fan@test.com",
+                               password="password", image_url=None)
+        db.session.commit()
+        self.doomed_id, self.fan_id = self.doomed.id, self.fan.id
+
+        db.session.add_all([
+            Follows(user_following_id=self.fan_id,
+                    user_being_followed_id=self.doomed_id),
+            Follows(user_following_id=self.doomed_id,
+                    user_being_followed_id=self.fan_id),
+        ])
+        self.messages = [Message(text=f"doomed {i}", user_id=self.doomed_id)
+                         for i in range(5)]
+        self.fan_message = Message(text="survivor", user_id=self.fan_id)
+        db.session.add_all(self.messages + [self.fan_message])
+        db.session.commit()
+
+        db.session.add_all(
+            [Likes(user_id=self.fan_id, message_id=msg.id)
+             for msg in self.messages]
+            + [Likes(user_id=self.doomed_id, message_id=self.fan_message.id)]
+            + [TimelineEntry(user_id=self.fan_id, message_id=msg.id,
+                             timestamp=msg.timestamp)
+               for msg in self.messages])
+        db.session.commit()
+        counters.reconcile()
+        self.message_ids = [msg.id for msg in self.messages]
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def log_in(self, user_id):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+
+    def delete_account(self):
+        self.log_in(self.doomed_id)
+        resp = self.client.post('/users/delete')
+        self.assertEqual(resp.status_code, 302)
+
+    def test_tombstone_hides_user_at_once(self):
+        """A deleted user and their messages leave every read straight away"""
+        self.log_in(self.fan_id)
+        self.assertIn('doomed 0', self.client.get('/').get_data(as_text=True))
+
+        self.delete_account()
+        self.assertIsNotNone(db.session.get(User, self.doomed_id).deleted_at)
+        self.assertEqual(Message.query.count(), 6)
+
+        self.log_in(self.fan_id)
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('doomed 0', html)
+        self.assertIn('survivor', html)
+        self.assertNotIn('@doomed', self.client.get('/users')
+                         .get_data(as_text=True))
+        self.assertNotIn('@doomed', self.client.get(
+            f'/users/{self.fan_id}/followers').get_data(as_text=True))
+        for url in (f'/users/{self.doomed_id}',
+                    f'/messages/{self.message_ids[0]}',
+                    f'/api/v1/users/{self.doomed_id}'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+        # others' counters are fixed up now, not at purge time
+        fan = db.session.get(User, self.fan_id)
+        db.session.refresh(fan)
+        self.assertEqual((fan.following_count, fan.followers_count,
+                          fan.likes_count), (0, 0, 0))
+
+        # nor can anyone like or follow what's left
+        resp = self.client.post(f'/users/{self.message_ids[1]}/un-like')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(Likes.query.count(), 6)
+
+        # the deleted account's other sessions are logged out
+        self.log_in(self.doomed_id)
+        resp = self.client.get('/messages/new')
+        self.assertEqual(resp.status_code, 302)
+
+    def test_likes_page_is_full_after_deletion(self):
+        """Deleted authors' liked messages don't use up the page"""
+        older = [Message(text=f"kept {i}", user_id=self.fan_id,
+                         timestamp=datetime(2000, 1, 1 + i))
+                 for i in range(2)]
+        db.session.add_all(older)
+        db.session.commit()
+        db.session.add_all(Likes(user_id=self.fan_id, message_id=msg.id)
+                           for msg in older)
+        db.session.commit()
+        self.delete_account()
+
+        app.config['FEED_PAGE_SIZE'] = 2
+        try:
+            html = self.client.get(
+                f'/users/{self.fan_id}/likes').get_data(as_text=True)
+        finally:
+            app.config['FEED_PAGE_SIZE'] = 100
+        self.assertIn('kept 0', html)
+        self.assertIn('kept 1', html)
+        self.assertNotIn('doomed', html)
+
+    def test_purge_in_batches(self):
+        """Purging deletes everything the user owned, a batch at a time"""
+        self.delete_account()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            if statement.startswith('DELETE'):
+                statements.append(statement)
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            deleted = deletion.purge(self.doomed_id, batch_size=2)
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+
+        # 5 timeline rows, 6 likes, 5 messages, 2 follows and the user
+        self.assertEqual(deleted, 19)
+        # no batch deleted more than 2 rows: 5 rows take 3 statements
+        self.assertEqual(len(statements),
+                         3 + 1 + 3 + 1 + 3 + 1 + 1 + 1 + 1 + 1)
+
+        self.assertIsNone(db.session.get(User, self.doomed_id))
+        self.assertEqual(Message.query.count(), 1)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+        self.assertEqual(deletion.purge(self.fan_id), 0)
+        self.assertIsNotNone(db.session.get(User, self.fan_id))
+
+    def test_purge_command(self):
+        """`flask purge-deleted-users` purges every tombstone left"""
+        self.delete_account()
+
+        result = app.test_cli_runner().invoke(args=['purge-deleted-users'])
+        self.assertIn('Purged 1 deleted users.', result.output)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_purge_in_background(self):
+        """With USER_PURGE_IN_BACKGROUND the purge runs after the request"""
+        with app.test_request_context():
+            deletion.tombstone(db.session.get(User, self.doomed_id))
+            db.session.commit()
+            app.config['USER_PURGE_IN_BACKGROUND'] = True
+            try:
+                future = deletion.purge_later(self.doomed_id)
+            finally:
+                app.config['USER_PURGE_IN_BACKGROUND'] = False
+
+        self.assertEqual(future.result(timeout=10), 19)
+        self.assertEqual(User.query.count(), 1)
@@ -0,0 +1,136 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from flask import template_rendered
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import fragments
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MemoryBackendTestCase(TestCase):
+    """Test the in-process LRU backend."""
+
+    def test_evicts_least_recently_used(self):
+        cache = fragments.MemoryBackend(2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        cache.get('a')
+        cache.set('c', 'C')
+
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), ['A', None, 'C'])
+        self.assertEqual(len(cache), 2)
+
+    def test_invalidate_tag(self):
+        cache = fragments.MemoryBackend(10)
+        cache.set('card-1', 'one', ('message:1', 'author:7'))
+        cache.set('card-2', 'two', ('message:2', 'author:7'))
+        cache.set('card-3', 'three', ('message:3', 'author:8'))
+
+        cache.invalidate('message:1')
+        self.assertEqual(cache.get_many(['card-1', 'card-2', 'card-3']),
+                         [None, 'two', 'three'])
+
+        cache.invalidate('author:7')
+        self.assertEqual(cache.get_many(['card-1', 'card-2', 'card-3']),
+                         [None, None, 'three'])
+        self.assertEqual(cache._tagged, {'message:3': {'card-3'},
+                                         'author:8': {'card-3'}})
+
+
+class FragmentViewsTestCase(TestCase):
+    """Test cards and profile headers are cached, shared and invalidated."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        fragments.backend().clear()
+
+        self.author = User.signup(username="author", email="author@test.com",
+                                  password="password", image_url=None)
+        self.reader = User.signup(username="reader", email="reader@test.com",
+                                  password="password", image_url=None)
+        db.session.commit()
+        self.message = Message(text="Fragment", user_id=self.author.id)
+        db.session.add(self.message)
+        db.session.commit()
+
+        self.client = app.test_client()
+        self.rendered = []
+        template_rendered.connect(self.record, app)
+
+    def tearDown(self):
+        template_rendered.disconnect(self.record, app)
+        db.session.rollback()
+
+    def record(self, sender, template, context):
+        self.rendered.append(template.name)
+
+    def log_in(self, user):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user.id
+
+    def test_card_rendered_once_for_every_viewer(self):
+        url = f'/users/{self.author.id}'
+
+        self.client.get(url)
+        self.log_in(self.reader)
+        html = self.client.get(url).get_data(as_text=True)
+
+        self.assertEqual(self.rendered.count('messages/card.html'), 1)
+        self.assertEqual(self.rendered.count('users/profile_header.html'), 1)
+        self.assertIn('Fragment', html)
+        # the viewer's own buttons fill the header's hole
+        self.assertIn(f'/users/follow/{self.author.id}', html)
+        self.assertNotIn('Edit Profile', html)
+
+        self.log_in(self.author)
+        html = self.client.get(url).get_data(as_text=True)
+        self.assertIn('Edit Profile', html)
+        self.assertEqual(self.rendered.count('users/profile_header.html'), 1)
+
+    def test_like_state_is_part_of_the_key(self):
+        self.client.post('/login', data=dict(username='reader',
+                                             password='password'))
+        self.client.post(f'/users/follow/{self.author.id}')
+        self.client.get('/')
+        self.client.post(f'/users/{self.message.id}/add-like')
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn(f'/users/{self.message.id}/un-like', html)
+        self.assertEqual(self.rendered.count('messages/card.html'), 2)
+
+    def test_profile_edit_and_delete_invalidate(self):
+        url = f'/users/{self.author.id}'
+        self.client.get(url)
+
+        self.log_in(self.author)
+        self.client.post('/users/profile', data=dict(
+            username='renamed', email='author@test.com',
+            image_url='', bio='', location='', password='password'))
+        self.assertEqual(len(fragments.backend()), 0)
+
+        html = self.client.get(url).get_data(as_text=True)
+        self.assertIn('@renamed', html)
+        self.assertEqual(self.rendered.count('messages/card.html'), 2)
+
+        self.client.post(f'/messages/{self.message.id}/delete')
+        self.assertEqual(
+            [key for key in fragments.backend()._entries if ':message:' in key],
+            [])
@@ -0,0 +1,169 @@
+"""Follow graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_graph.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import graph
+from graph import FollowGraph
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['USER_PURGE_IN_BACKGROUND'] = False
+app.config['FOLLOW_GRAPH_BUILD_IN_BACKGROUND'] = False
+
+
+def make_graph(edges):
+    edges = sorted(edges)
+    return FollowGraph([a for a, b in edges], [b for a, b in edges])
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the adjacency arrays and the changes layered over them."""
+
+    def setUp(self):
+        # 1 follows 2, 3, 4; 2 follows 1, 5; 3 follows 5, 6; 4 follows 5
+        self.graph = make_graph([(1, 2), (1, 3), (1, 4), (2, 1), (2, 5),
+                                 (3, 5), (3, 6), (4, 5)])
+
+    def test_lists_and_counts(self):
+        self.assertEqual(list(self.graph.following(1)), [2, 3, 4])
+        self.assertEqual(list(self.graph.followers(5)), [2, 3, 4])
+        self.assertEqual(self.graph.followers_count(5), 3)
+        self.assertEqual(self.graph.following_count(6), 0)
+        # ids past any edge are just users with none
+        self.assertEqual(list(self.graph.following(99)), [])
+        self.assertTrue(self.graph.is_following(1, 3))
+        self.assertFalse(self.graph.is_following(3, 1))
+
+    def test_relationships(self):
+        self.assertEqual(self.graph.mutuals(1), {2})
+        self.assertEqual(self.graph.followed_by_followees(1, 5), {2, 3, 4})
+        self.assertEqual(self.graph.followed_by_followees(4, 6), set())
+        self.assertTrue(self.graph.within_two_hops(1, 6))
+        self.assertTrue(self.graph.within_two_hops(1, 2))
+        self.assertFalse(self.graph.within_two_hops(4, 6))
+
+    def test_changes_fold_into_reads(self):
+        self.graph.add(6, 1)
+        self.graph.remove(1, 3)
+        self.graph.add(1, 3)
+        self.graph.remove(2, 5)
+        self.graph.add(2, 5)
+        self.graph.remove(2, 5)
+
+        self.assertEqual(list(self.graph.following(6)), [1])
+        self.assertEqual(sorted(self.graph.followers(1)), [2, 6])
+        self.assertEqual(sorted(self.graph.following(1)), [2, 3, 4])
+        self.assertEqual(self.graph.followers_count(5), 2)
+        self.assertFalse(self.graph.is_following(2, 5))
+        self.assertEqual(self.graph.mutuals(1), {2})
+
+        self.graph.remove_user(1)
+        self.assertEqual(self.graph.following_count(1), 0)
+        self.assertEqual(self.graph.followers_count(1), 0)
+        self.assertEqual(list(self.graph.following(2)), [])
+
+    def test_suggestions(self):
+        # 5 is followed by all three of 1's followees, 6 by one
+        self.assertEqual(self.graph.suggestions(1), [5, 6])
+        self.assertEqual(self.graph.suggestions(1, limit=1), [5])
+        self.assertEqual(self.graph.suggestions(6), [])
+
+        self.graph.add(1, 5)
+        self.assertEqual(self.graph.suggestions(1), [6])
+
+
+class WhoToFollowTestCase(TestCase):
+    """Test the home page suggestions and keeping the graph current."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+        self.users = [User(email=f"g{i}@test.com", username=f"graph{i}",
+                           password="HASHED_PASSWORD") for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.me, self.friend, self.pick, self.other = [u.id for u in self.users]
+        db.session.add_all([
+            Follows(user_following_id=self.me,
+                    user_being_followed_id=self.friend),
+            Follows(user_following_id=self.friend,
+                    user_being_followed_id=self.pick),
+        ])
+        db.session.commit()
+
+        with app.app_context():
+            graph.reset()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.me
+
+    def tearDown(self):
+        db.session.rollback()
+        with app.app_context():
+            graph.reset()
+
+    def test_home_suggests_friends_of_friends(self):
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn('Who to follow', html)
+        self.assertIn(f'/users/follow/{self.pick}', html)
+        self.assertNotIn(f'/users/follow/{self.other}', html)
+
+        # following them takes them out of the suggestions at once
+        self.client.post(f'/users/follow/{self.pick}')
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('Who to follow', html)
+
+    def test_first_build_in_background(self):
+        """Pages don't wait for the first build; they go without suggestions"""
+        app.config['FOLLOW_GRAPH_BUILD_IN_BACKGROUND'] = True
+        try:
+            html = self.client.get('/').get_data(as_text=True)
+            self.assertNotIn('Who to follow', html)
+            with app.app_context():
+                for _ in range(100):
+                    if graph.follow_graph() is not None:
+                        break
+                    time.sleep(0.05)
+        finally:
+            app.config['FOLLOW_GRAPH_BUILD_IN_BACKGROUND'] = False
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn(f'/users/follow/{self.pick}', html)
+
+    def test_stale_graph_rebuilds_in_background(self):
+        with app.app_context():
+            old = graph.follow_graph()
+            # a follow another worker made
+            db.session.add(Follows(user_following_id=self.other,
+                                   user_being_followed_id=self.me))
+            db.session.commit()
+            self.assertEqual(old.followers_count(self.me), 0)
+
+            app.config['FOLLOW_GRAPH_TTL'] = 0
+            try:
+                self.assertIs(graph.follow_graph(), old)
+                for _ in range(100):
+                    if graph.follow_graph() is not old:
+                        break
+                    time.sleep(0.05)
+            finally:
+                app.config['FOLLOW_GRAPH_TTL'] = 300
+
+            self.assertEqual(graph.follow_graph().followers_count(self.me), 1)
@@ -0,0 +1,88 @@
+"""Password hashing pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+
+import os
+from threading import Event
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from hashing import HasherBusy, PasswordHasher, hash_cost, hasher
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the pool on its own."""
+
+    def test_hash_and_check(self):
+        pool = PasswordHasher(rounds=4, workers=2)
+        pw_hash = pool.hash('secret')
+
+        self.assertEqual(hash_cost(pw_hash), 4)
+        self.assertTrue(pool.check(pw_hash, 'secret'))
+        self.assertFalse(pool.check(pw_hash, 'wrong'))
+
+    def test_needs_rehash(self):
+        pool = PasswordHasher(rounds=5)
+        self.assertTrue(pool.needs_rehash(PasswordHasher(rounds=4).hash('x')))
+        self.assertFalse(pool.needs_rehash(pool.hash('x')))
+        self.assertFalse(pool.needs_rehash('not a bcrypt hash'))
+
+    def test_full_queue_raises_busy(self):
+        """Callers that can't get a slot in time are turned away"""
+        pool = PasswordHasher(rounds=4, workers=1, max_pending=1,
+                              queue_timeout=0.01)
+        release = Event()
+        blocked = pool._pool().submit(release.wait)
+        pool._slots.acquire()
+
+        try:
+            with self.assertRaises(HasherBusy):
+                pool.hash('secret')
+        finally:
+            release.set()
+            blocked.result()
+            pool._slots.release()
+
+        self.assertEqual(hash_cost(pool.hash('secret')), 4)
+
+
+class RehashOnLoginTestCase(TestCase):
+    """Test logins upgrade hashes made at an outdated cost."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        self.rounds = hasher.rounds
+
+    def tearDown(self):
+        db.session.rollback()
+        hasher.rounds = self.rounds
+
+    def test_login_upgrades_cost(self):
+        hasher.rounds = 4
+        User.signup(username="rehash", email="rehash@test.com",
+                    password="password", image_url=None)
+        db.session.commit()
+
+        hasher.rounds = 5
+        resp = app.test_client().post('/login', data={
+            'username': 'rehash', 'password': 'password'})
+        self.assertEqual(resp.status_code, 302)
+
+        user = User.query.filter_by(username='rehash').one()
+        db.session.refresh(user)
+        self.assertEqual(hash_cost(user.password), 5)
+        self.assertTrue(user.check_password('password'))
@@ -0,0 +1,146 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import http_cache
+import user_cache
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HttpCacheTestCase(TestCase):
+    """Test static versioning, page validators and Cache-Control."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        user_cache.clear()
+
+        self.author = User.signup(username="author", email="author@test.com",
+                                  password="password", image_url=None)
+        self.viewer = User.signup(username="viewer", email="viewer@test.com",
+                                  password="password", image_url=None)
+        db.session.commit()
+        self.message = Message(text="Cache me", user_id=self.author.id)
+        db.session.add(self.message)
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def log_in(self, user):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user.id
+
+    def test_static_urls_are_versioned_and_immutable(self):
+        with app.test_request_context():
+            digest = http_cache.static_hash('stylesheets/style.css')
+            self.assertEqual(len(digest), 12)
+            self.assertEqual(
+                http_cache.asset_url('/static/images/default-pic.png'),
+                '/static/images/default-pic.png?v='
+                + http_cache.static_hash('images/default-pic.png'))
+            self.assertEqual(http_cache.asset_url('https://example.com/a.png'),
+                             'https://example.com/a.png')
+            self.assertIsNone(http_cache.static_hash('../app.py'))
+
+        html = self.client.get('/login').get_data(as_text=True)
+        self.assertIn(f'/static/stylesheets/style.css?v={digest}', html)
+
+        resp = self.client.get(f'/static/stylesheets/style.css?v={digest}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.immutable)
+        self.assertTrue(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age, http_cache.STATIC_MAX_AGE)
+        resp.close()
+
+        # old or missing versions must not be cached for long
+        resp = self.client.get('/static/stylesheets/style.css?v=stale')
+        self.assertIsNone(resp.cache_control.max_age)
+        self.assertTrue(resp.cache_control.no_cache)
+        resp.close()
+
+    def test_public_profile_revalidates(self):
+        url = f'/users/{self.author.id}'
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.public)
+        self.assertTrue(resp.cache_control.no_cache)
+        last_modified = resp.headers['Last-Modified']
+        etag, weak = resp.get_etag()
+        self.assertTrue(weak)
+
+        resp = self.client.get(url, headers={'If-None-Match': f'W/"{etag}"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(), b'')
+
+        resp = self.client.get(url, headers={
+            'If-Modified-Since': last_modified})
+        self.assertEqual(resp.status_code, 304)
+
+        # a new follower changes the counts the page shows
+        db.session.add(Follows(user_being_followed_id=self.author.id,
+                               user_following_id=self.viewer.id))
+        db.session.execute(db.update(User)
+                           .where(User.id == self.author.id)
+                           .values(followers_count=User.followers_count + 1))
+        db.session.commit()
+
+        resp = self.client.get(url, headers={'If-None-Match': f'W/"{etag}"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.get_etag()[0], etag)
+
+    def test_logged_in_pages_are_private(self):
+        url = f'/messages/{self.message.id}'
+        anonymous_etag = self.client.get(url).get_etag()[0]
+
+        self.log_in(self.viewer)
+        resp = self.client.get(url)
+        self.assertTrue(resp.cache_control.private)
+        self.assertIn('Cookie', resp.vary)
+        etag = resp.get_etag()[0]
+        self.assertNotEqual(etag, anonymous_etag)
+
+        resp = self.client.get(url, headers={'If-None-Match': f'W/"{etag}"'})
+        self.assertEqual(resp.status_code, 304)
+
+        # following the author changes the button on the page
+        self.client.post(f'/users/follow/{self.author.id}')
+        resp = self.client.get(url, headers={'If-None-Match': f'W/"{etag}"'})
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.get('/')
+        self.assertTrue(resp.cache_control.private)
+        self.assertTrue(resp.cache_control.no_cache)
+        self.assertIsNone(resp.get_etag()[0])
+
+    def test_pending_flash_is_not_cached(self):
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('success', 'Hello!')]
+
+        resp = self.client.get(f'/users/{self.author.id}')
+        self.assertIn('Hello!', resp.get_data(as_text=True))
+        self.assertIsNone(resp.get_etag()[0])
+        self.assertTrue(resp.cache_control.private)
+
+    def test_missing_message_is_404(self):
+        resp = self.client.get('/messages/999999999')
+        self.assertEqual(resp.status_code, 404)
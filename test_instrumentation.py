@@ -0,0 +1,103 @@
+"""Request instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import instrumentation
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+    """Test Server-Timing headers and the /__metrics endpoint."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        user = User(email="metrics@test.com", username="metrics",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        app.extensions['instrumentation'] = instrumentation.Registry()
+        app.config['INSTRUMENTATION_SAMPLE_RATE'] = 1.0
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['INSTRUMENTATION_SAMPLE_RATE'] = 0.1
+        app.config['SLOW_QUERY_MS'] = 100
+        app.config['METRICS_TOKEN'] = None
+
+    def test_server_timing(self):
+        resp = self.client.get(f'/users/{self.user_id}')
+        timing = resp.headers['Server-Timing']
+
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('app;dur=', timing)
+
+    def test_unsampled_requests_are_still_counted(self):
+        app.config['INSTRUMENTATION_SAMPLE_RATE'] = 0
+        resp = self.client.get(f'/users/{self.user_id}')
+        self.assertNotIn('Server-Timing', resp.headers)
+
+        metrics = self.client.get('/__metrics').get_data(as_text=True)
+        self.assertIn('warbler_requests_total{endpoint="warbler.users_show",'
+                      'method="GET",status="200"} 1', metrics)
+        self.assertIn('warbler_request_duration_seconds_count'
+                      '{endpoint="warbler.users_show"} 1', metrics)
+        self.assertNotIn('warbler_db_queries_count{endpoint="warbler.users_show"}',
+                         metrics)
+
+    def test_metrics(self):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_id
+        self.client.get('/')
+        self.client.get('/')
+
+        resp = self.client.get('/__metrics')
+        metrics = resp.get_data(as_text=True)
+
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('# TYPE warbler_db_queries histogram', metrics)
+        self.assertIn('warbler_db_queries_count{endpoint="warbler.homepage"} 2', metrics)
+        self.assertIn('warbler_template_duration_seconds_count'
+                      '{endpoint="warbler.homepage"} 2', metrics)
+        # scrapes don't count themselves
+        self.assertNotIn('endpoint="metrics"', metrics)
+
+    def test_slow_queries_are_logged(self):
+        app.config['SLOW_QUERY_MS'] = 0
+
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.client.get(f'/users/{self.user_id}')
+
+        self.assertIn('slow query', logs.output[0])
+        metrics = self.client.get('/__metrics').get_data(as_text=True)
+        self.assertIn('warbler_slow_queries_total{endpoint="warbler.users_show"}',
+                      metrics)
+
+    def test_metrics_token(self):
+        app.config['METRICS_TOKEN'] = 'sekrit'
+
+        self.assertEqual(self.client.get('/__metrics').status_code, 404)
+        resp = self.client.get('/__metrics',
+                               headers={'Authorization': 'Bearer sekrit'})
+        self.assertEqual(resp.status_code, 200)
@@ -0,0 +1,165 @@
+"""Live home feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_live.py
+
+
+import json
+import os
+import threading
+import time
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import live
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class BrokerTestCase(TestCase):
+    """Test the local broker says who posted since a given number."""
+
+    def test_wait(self):
+        broker = live.LocalBroker(keep=3)
+        self.assertEqual(broker.wait(0, 0.01), (0, set()))
+
+        broker.publish({5})
+        broker.publish({6, 7})
+        self.assertEqual(broker.wait(0, 1), (3, {5, 6, 7}))
+        self.assertEqual(broker.wait(1, 1), (3, {6, 7}))
+
+        # older than it keeps: could be anyone
+        broker.publish({8})
+        self.assertEqual(broker.wait(0, 1), (4, None))
+
+    def test_wakes_waiter(self):
+        broker = live.LocalBroker()
+        threading.Timer(0.05, broker.publish, [{1}]).start()
+        started = time.monotonic()
+        self.assertEqual(broker.wait(0, 5), (1, {1}))
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class LiveViewsTestCase(TestCase):
+    """Test the delta endpoint and stream send only what's new."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.users = [User(email=f"live{i}@test.com", username=f"live{i}",
+                           password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.reader, self.author, self.stranger = [u.id for u in self.users]
+        db.session.add(Follows(user_following_id=self.reader,
+                               user_being_followed_id=self.author))
+        db.session.add(Message(text="old news", user_id=self.author))
+        db.session.commit()
+
+        self.saved = {key: app.config[key]
+                      for key in ('LIVE_HEARTBEAT', 'LIVE_STREAM_SECONDS',
+                                  'LIVE_MAX_STREAMS')}
+        self.client = self.client_for(self.reader)
+
+    def tearDown(self):
+        app.config.update(self.saved)
+        db.session.rollback()
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+        return client
+
+    def post(self, user_id, text):
+        resp = self.client_for(user_id).post('/messages/new',
+                                             data={'text': text})
+        self.assertEqual(resp.status_code, 302)
+
+    def home_cursor(self):
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn('old news', html)
+        return html.split('data-live-cursor="')[1].split('"')[0]
+
+    def test_updates(self):
+        """Only followees' messages newer than the cursor come back"""
+        cursor = self.home_cursor()
+        update = self.client.get(f'/timeline/updates?after={cursor}').json
+        self.assertEqual((update['count'], update['cursor']), (0, cursor))
+
+        self.post(self.author, "hot off the press")
+        self.post(self.stranger, "not for you")
+        update = self.client.get(f'/timeline/updates?after={cursor}').json
+        self.assertEqual(update['count'], 1)
+        self.assertIn('hot off the press', update['html'])
+        self.assertNotIn('old news', update['html'])
+        self.assertFalse(update['more'])
+
+        again = self.client.get(
+            f"/timeline/updates?after={update['cursor']}").json
+        self.assertEqual(again['count'], 0)
+
+        self.assertEqual(
+            self.client.get('/timeline/updates?after=junk').status_code, 400)
+        self.assertEqual(
+            app.test_client().get(f'/timeline/updates?after={cursor}')
+            .status_code, 401)
+
+    def test_older_pages_are_not_live(self):
+        html = self.client.get('/?before=' + self.home_cursor()).get_data(
+            as_text=True)
+        self.assertNotIn('data-live-cursor', html)
+
+    def test_posting_wakes_stream(self):
+        """A followee's post is sent at once, not at the next heartbeat"""
+        app.config.update(LIVE_HEARTBEAT=30, LIVE_STREAM_SECONDS=1.5)
+        cursor = self.home_cursor()
+        seq = app.extensions['live'].broker.seq
+
+        threading.Timer(0.3, self.post, [self.author, "pushed"]).start()
+        started = time.monotonic()
+        resp = self.client.get(f'/timeline/stream?after={cursor}',
+                               buffered=False)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        chunks = iter(resp.response)
+        self.assertEqual(next(chunks), b'retry: 1000\n\n')
+        self.assertEqual(next(chunks), b': keep-alive\n\n')
+
+        event = next(chunks).decode()
+        self.assertLess(time.monotonic() - started, 1.5)
+        lines = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+        self.assertEqual(lines['event'], 'messages')
+        data = json.loads(lines['data'])
+        self.assertEqual(lines['id'], data['cursor'])
+        self.assertIn('pushed', data['html'])
+        resp.close()
+
+        self.assertEqual(app.extensions['live'].broker.seq, seq + 1)
+        self.assertEqual(app.extensions['live'].streams, 0)
+
+    def test_heartbeat_catches_other_processes(self):
+        """Messages the broker never heard of arrive on the heartbeat"""
+        app.config.update(LIVE_HEARTBEAT=0.2, LIVE_STREAM_SECONDS=0.5)
+        cursor = self.home_cursor()
+        db.session.add(Message(text="from elsewhere", user_id=self.author))
+        db.session.commit()
+
+        with self.client.get(f'/timeline/stream?after={cursor}') as resp:
+            body = resp.get_data(as_text=True)
+        self.assertEqual(body.count('from elsewhere'), 1)
+        self.assertIn(': keep-alive', body)
+
+    def test_stream_limit(self):
+        app.config.update(LIVE_MAX_STREAMS=0)
+        resp = self.client.get('/timeline/stream?after=' + self.home_cursor())
+        self.assertEqual(resp.status_code, 503)
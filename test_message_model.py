@@ -10,6 +10,7 @@ from app import app
 app.config['TESTING'] = True
 
 db.drop_all()
+app.app_context().push()
 db.create_all()
 
 class TestMessageModelTestCase(TestCase):
@@ -8,7 +8,9 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from sqlalchemy import event
+
+from models import db, connect_db, Message, User, Likes
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -26,6 +28,7 @@ from app import app, CURR_USER_KEY
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
+app.app_context().push()
 db.create_all()
 
 # Don't have WTForms use CSRF at all, since it's a pain to test
@@ -130,11 +133,103 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(log_resp.status_code, 200, self.message.id)
             self.assertEqual(log_resp.request.path, f"/users/{self.testuser.id}")
             self.assertNotIn(self.message.text, log_html, self.message.text)
-            
-    
-            
-            
-            
-            
-                
-            
+
+    def test_message_delete_others(self):
+        """Nobody can delete someone else's message, nor a missing one"""
+        other = User.signup(username="other", email="other@test.com",
+                            password="password", image_url=None)
+        db.session.commit()
+        self.testuser.messages_count = 1
+        db.session.commit()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = other.id
+
+        resp = self.client.post(f'/messages/{self.message.id}/delete',
+                                follow_redirects=True)
+        self.assertIn("Access unauthorized.", resp.get_data(as_text=True))
+        self.assertIsNotNone(db.session.get(Message, self.message.id))
+        self.assertEqual(
+            db.session.scalar(db.select(User.messages_count)
+                              .where(User.id == self.testuser.id)),
+            self.testuser.messages_count)
+
+        resp = self.client.post('/messages/999999999/delete')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_home_feed_query_count(self):
+        """Home feed cost doesn't grow with the number of authors or likes"""
+        authors = [User(email=f"author{i}@test.com", username=f"author{i}",
+                        password="HASHED_PASSWORD") for i in range(5)]
+        db.session.add_all(authors)
+        db.session.commit()
+        self.testuser.following.extend(authors)
+        messages = [Message(text=f"feed {i}", user_id=author.id)
+                    for i, author in enumerate(authors)]
+        db.session.add_all(messages)
+        db.session.commit()
+        db.session.add(Likes(user_id=self.testuser.id,
+                             message_id=messages[0].id))
+        db.session.commit()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                resp = c.get("/")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+        html = resp.get_data(as_text=True)
+        self.assertIn(f"/users/{messages[0].id}/un-like", html)
+        self.assertIn(f"/users/{messages[1].id}/add-like", html)
+        self.assertLessEqual(len(statements), 5, statements)
+
+
+    def test_fetched_like(self):
+        """A fetched like answers with the button or JSON, not a feed render"""
+        liker = User.signup(username="liker", email="liker@test.com",
+                            password="password", image_url=None)
+        db.session.commit()
+        liker_id, message_id = liker.id, self.message.id
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = liker_id
+
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                resp = c.post(f"/users/{message_id}/add-like",
+                              headers={"X-Requested-With": "fetch"})
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+            self.assertEqual(resp.status_code, 200)
+            html = resp.get_data(as_text=True)
+            self.assertIn(f"/users/{message_id}/un-like", html)
+            self.assertNotIn("<nav", html)
+            # no feed, no page: the like and its lookups
+            self.assertLessEqual(len(statements), 6, statements)
+
+            resp = c.post(f"/users/{message_id}/un-like",
+                          headers={"Accept": "application/json"})
+            self.assertEqual(resp.json, dict(message_id=message_id,
+                                             liked=False, likes_count=0))
+            resp = c.post(f"/users/{message_id}/add-like",
+                          headers={"Accept": "application/json"})
+            self.assertEqual(resp.json["likes_count"], 1)
+
+        resp = app.test_client().post(f"/users/{message_id}/add-like",
+                                      headers={"Accept": "application/json"})
+        self.assertEqual(resp.status_code, 401)
@@ -0,0 +1,144 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData,
+                        String, Table, Text, create_engine, inspect, text)
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import migrations
+
+app.app_context().push()
+db.create_all()
+
+# the tables as models.py first defined them, before any migration
+baseline = MetaData()
+Table('users', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('email', Text, nullable=False, unique=True),
+      Column('username', Text, nullable=False, unique=True),
+      Column('image_url', Text),
+      Column('header_image_url', Text),
+      Column('bio', Text),
+      Column('location', Text),
+      Column('password', Text, nullable=False))
+Table('follows', baseline,
+      Column('user_being_followed_id', Integer,
+             ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+      Column('user_following_id', Integer,
+             ForeignKey('users.id', ondelete='cascade'), primary_key=True))
+Table('messages', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('text', String(140), nullable=False),
+      Column('timestamp', DateTime, nullable=False),
+      Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'),
+             nullable=False))
+Table('likes', baseline,
+      Column('id', Integer, primary_key=True),
+      Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
+      Column('message_id', Integer,
+             ForeignKey('messages.id', ondelete='cascade')))
+
+
+class MigrationsTestCase(TestCase):
+    """Run the migrations against a scratch SQLite database."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            f"sqlite:///{os.path.join(self.dir.name, 'warbler.db')}")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.dir.cleanup()
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(self.engine).get_indexes(table)}
+
+    def test_fresh_database(self):
+        applied = migrations.upgrade(self.engine)
+
+        self.assertEqual(applied[0], '0001_baseline')
+        self.assertIn('uq_likes_user_id_message_id', self.index_names('likes'))
+        self.assertEqual(migrations.pending(self.engine), [])
+        self.assertEqual(migrations.upgrade(self.engine), [])
+
+    def test_upgrades_old_schema(self):
+        """Databases from before the migrations get counters and indexes"""
+        baseline.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO users (id, email, username, password) "
+                "VALUES (1, 'a@test.com', 'a', 'x'), (2, 'b@test.com', 'b', 'x')"))
+            conn.execute(text(
+                "INSERT INTO messages (id, text, timestamp, user_id) "
+                "VALUES (10, 'one', '2020-01-01', 2), "
+                "(11, 'two', '2020-01-02', 2)"))
+            conn.execute(text(
+                "INSERT INTO follows (user_following_id, user_being_followed_id) "
+                "VALUES (1, 2)"))
+            conn.execute(text(
+                "INSERT INTO likes (user_id, message_id) "
+                "VALUES (1, 10), (1, 10), (1, 11)"))
+
+        self.assertEqual(len(migrations.upgrade(self.engine)),
+                         len(migrations.discover()))
+
+        with self.engine.connect() as conn:
+            likes = conn.execute(text(
+                "SELECT user_id, message_id FROM likes ORDER BY id")).all()
+            counts = conn.execute(text(
+                "SELECT messages_count, following_count, followers_count, "
+                "likes_count FROM users ORDER BY id")).all()
+        self.assertEqual(likes, [(1, 10), (1, 11)])
+        self.assertEqual(counts, [(0, 1, 0, 2), (2, 0, 1, 0)])
+        self.assertIn('ix_messages_user_id_timestamp',
+                      self.index_names('messages'))
+        self.assertIn('uq_likes_user_id_message_id', self.index_names('likes'))
+        self.assertIn('ix_users_followers_count', self.index_names('users'))
+
+    def test_adds_user_updated_at(self):
+        db.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE users DROP COLUMN updated_at"))
+            conn.execute(text(
+                "INSERT INTO users (id, email, username, password) "
+                "VALUES (1, 'a@test.com', 'a', 'x')"))
+        migrations.stamp(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM schema_migrations WHERE version = 4"))
+
+        self.assertEqual(migrations.upgrade(self.engine),
+                         ['0004_user_updated_at'])
+
+        with self.engine.connect() as conn:
+            updated_at = conn.scalar(text("SELECT updated_at FROM users"))
+        self.assertFalse(updated_at.startswith('1970'))
+
+    def test_adds_user_deleted_at(self):
+        db.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_users_deleted"))
+            conn.execute(text("ALTER TABLE users DROP COLUMN deleted_at"))
+        migrations.stamp(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM schema_migrations WHERE version = 5"))
+
+        self.assertEqual(migrations.upgrade(self.engine),
+                         ['0005_user_deleted_at'])
+
+        columns = {column['name']
+                   for column in inspect(self.engine).get_columns('users')}
+        self.assertIn('deleted_at', columns)
+        self.assertIn('ix_users_deleted', self.index_names('users'))
@@ -0,0 +1,109 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from pagination import decode_cursor, encode_cursor, paginate, NEWER
+
+app.app_context().push()
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Test cursors and paging through profile, likes and home feeds."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.user = User(email="pager@test.com", username="pager",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+
+        # two messages share a timestamp so the id tie-breaker matters
+        start = datetime(2020, 1, 1)
+        stamps = [start + timedelta(minutes=i) for i in range(4)] + [start]
+        self.messages = [Message(text=f"msg {i}", user_id=self.user.id,
+                                 timestamp=stamp)
+                         for i, stamp in enumerate(stamps)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+
+        self.client = app.test_client()
+        app.config['FEED_PAGE_SIZE'] = 2
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['FEED_PAGE_SIZE'] = 100
+
+    def walk(self, query):
+        """Follow next cursors to the end, then prev cursors back."""
+
+        pages = [paginate(query, Message.timestamp, Message.id, limit=2)]
+        while pages[-1].next_cursor:
+            key = decode_cursor(pages[-1].next_cursor)
+            pages.append(paginate(query, Message.timestamp, Message.id,
+                                  key=key, limit=2))
+
+        back = paginate(query, Message.timestamp, Message.id,
+                        direction=NEWER,
+                        key=decode_cursor(pages[-1].prev_cursor), limit=2)
+        return pages, back
+
+    def test_cursor_round_trip(self):
+        """Cursors decode to the key they were made from"""
+        stamp = datetime(2021, 5, 4, 3, 2, 1, 123456)
+        self.assertEqual(decode_cursor(encode_cursor(stamp, 42)), (stamp, 42))
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_pages_cover_feed_in_order(self):
+        """Walking the cursors visits every message once, newest first"""
+        pages, back = self.walk(Message.query)
+
+        texts = [msg.text for page in pages for msg in page]
+        self.assertEqual(texts, ['msg 3', 'msg 2', 'msg 1', 'msg 4', 'msg 0'])
+        self.assertIsNone(pages[0].prev_cursor)
+        self.assertIsNone(pages[-1].next_cursor)
+        self.assertEqual([msg.text for msg in back], ['msg 1', 'msg 4'])
+
+    def test_profile_and_likes_routes(self):
+        """Profile and likes pages link to the next page with a cursor"""
+        for msg in self.messages:
+            db.session.add(Likes(user_id=self.user.id, message_id=msg.id))
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.user.id
+
+            for url in (f'/users/{self.user.id}',
+                        f'/users/{self.user.id}/likes', '/'):
+                html = client.get(url).get_data(as_text=True)
+                self.assertIn('msg 3', html)
+                self.assertNotIn('msg 1', html)
+                self.assertIn('?before=', html)
+
+                page = paginate(Message.query, Message.timestamp,
+                                Message.id, limit=2)
+                html = client.get(url, query_string={
+                    'before': page.next_cursor}).get_data(as_text=True)
+                self.assertIn('msg 1', html)
+                self.assertNotIn('msg 3', html)
+
+            resp = client.get(f'/users/{self.user.id}',
+                              query_string={'before': 'garbage'})
+            self.assertEqual(resp.status_code, 400)
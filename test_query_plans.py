@@ -0,0 +1,76 @@
+"""Query plan (index usage) tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_plans.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import query_plans
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryPlansTestCase(TestCase):
+    """Test every checked page is served by indexes."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        users = [User(email=f"u{i}@test.com", username=f"u{i}",
+                      password="HASHED_PASSWORD") for i in range(5)]
+        db.session.add_all(users)
+        db.session.flush()
+        messages = [Message(text=f"msg {i}", user_id=users[i % 5].id)
+                    for i in range(20)]
+        db.session.add_all(messages)
+        db.session.flush()
+        db.session.add_all([Follows(user_being_followed_id=user.id,
+                                    user_following_id=users[0].id)
+                            for user in users[1:]])
+        db.session.add(Likes(user_id=users[0].id, message_id=messages[1].id))
+        db.session.commit()
+
+        # enough other users' messages that reading a whole table costs
+        # more than index lookups, whatever statistics earlier tests left
+        bystanders = db.session.scalars(
+            db.insert(User).returning(User.id),
+            [dict(email=f"b{i}@test.com", username=f"b{i}",
+                  password="HASHED_PASSWORD") for i in range(200)]).all()
+        noise = db.session.scalars(
+            db.insert(Message).returning(Message.id),
+            [dict(text=f"noise {i}", user_id=bystanders[i % 200])
+             for i in range(4000)]).all()
+        db.session.execute(db.insert(Follows), [
+            dict(user_following_id=bystanders[i],
+                 user_being_followed_id=bystanders[(i + step) % 200])
+            for i in range(200) for step in range(1, 11)])
+        db.session.execute(db.insert(Likes), [
+            dict(user_id=bystanders[i % 200], message_id=noise[i])
+            for i in range(4000)])
+        db.session.commit()
+        with db.engine.connect() as conn:
+            conn.execute(db.text("ANALYZE users, messages, follows, likes"))
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_pages_use_indexes(self):
+        self.assertEqual(query_plans.check(), [])
+
+    def test_reports_full_scans(self):
+        statement = "SELECT * FROM messages WHERE text = %(text)s"
+        self.assertEqual(query_plans.full_scans(statement, {'text': 'x'}),
+                         ['messages'])
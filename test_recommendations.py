@@ -0,0 +1,178 @@
+"""Who-to-follow job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+
+import os
+import random
+from array import array
+from unittest import TestCase, skipIf
+
+from models import db, User, Message, Follows, Likes, FollowSuggestion
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import graph
+import recommendations
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['FOLLOW_GRAPH_BUILD_IN_BACKGROUND'] = False
+
+
+class RecommendationsTestCase(TestCase):
+    """Test the job scores friends of friends and co-likers."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+        names = ['me', 'friend', 'fof', 'colike', 'stranger', 'gone']
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD") for name in names]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = {name: user.id for name, user in zip(names, users)}
+        ids = self.ids
+
+        # me -> friend -> fof, gone
+        db.session.add_all(
+            Follows(user_following_id=ids[a], user_being_followed_id=ids[b])
+            for a, b in (('me', 'friend'), ('friend', 'fof'),
+                         ('friend', 'gone'), ('friend', 'me')))
+        message = Message(text="liked by two", user_id=ids['stranger'])
+        db.session.add(message)
+        db.session.commit()
+        db.session.add_all(Likes(user_id=ids[name], message_id=message.id)
+                           for name in ('me', 'colike'))
+        users[-1].deleted_at = db.func.now()
+        db.session.commit()
+
+        self.client = app.test_client()
+        with app.app_context():
+            graph.reset()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def suggested(self, name):
+        return [(row.suggested_id, row.score) for row in
+                FollowSuggestion.query
+                .filter_by(user_id=self.ids[name])
+                .order_by(FollowSuggestion.score.desc())]
+
+    def test_scores(self):
+        """Friends of friends outrank co-likers; no self, followee or deleted"""
+        with app.app_context():
+            stats = recommendations.recommend(workers=1)
+
+        self.assertEqual(stats['users'], 5)
+        self.assertEqual(stats['follows'], 4)
+        self.assertEqual(self.suggested('me'), [(self.ids['fof'], 1.0),
+                                                (self.ids['colike'], 0.5)])
+        self.assertEqual(self.suggested('colike'), [(self.ids['me'], 0.5)])
+        self.assertEqual(self.suggested('gone'), [])
+
+    def test_chunks_and_workers(self):
+        """Scoring on forked workers a chunk at a time gives the same rows"""
+        with app.app_context():
+            recommendations.recommend(workers=1)
+        expected = {name: self.suggested(name) for name in self.ids}
+
+        # stale rows for a user are replaced, not added to
+        db.session.add(FollowSuggestion(user_id=self.ids['me'],
+                                        suggested_id=self.ids['stranger'],
+                                        score=9))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(
+            args=['recommend-follows', '--workers', '2', '--chunk-size', '1'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Wrote 3 suggestions for 5 users', result.output)
+        self.assertIn('2 workers', result.output)
+        for stage in ('load follows', 'load likes', 'index', 'write', 'total'):
+            self.assertIn(stage, result.output)
+
+        self.assertEqual({name: self.suggested(name) for name in self.ids},
+                         expected)
+
+    def test_suggestions_page(self):
+        """The page lists the job's picks, less anyone followed since"""
+        with app.app_context():
+            recommendations.recommend(workers=1)
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.ids['me']
+
+        html = self.client.get('/users/suggestions').get_data(as_text=True)
+        self.assertLess(html.index('@fof'), html.index('@colike'))
+
+        self.client.post(f"/users/follow/{self.ids['fof']}")
+        html = self.client.get('/users/suggestions').get_data(as_text=True)
+        self.assertNotIn('@fof', html)
+        self.assertIn('@colike', html)
+
+    def test_suggestions_page_before_the_job(self):
+        """Users the job hasn't reached get the live graph's picks"""
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.ids['me']
+
+        html = self.client.get('/users/suggestions').get_data(as_text=True)
+        self.assertIn('@fof', html)
+        self.assertNotIn('@colike', html)
+
+
+@skipIf(recommendations.sparse is None, "needs numpy and scipy")
+class ScoringEnginesTestCase(TestCase):
+    """Test sparse matrix scoring matches the pure-Python scores."""
+
+    def test_same_suggestions(self):
+        """Same picks, scores and tie order, whatever the chunk bounds"""
+        rand = random.Random(22)
+        size, messages = 40, 30
+        follows = sorted({(rand.randrange(1, size), rand.randrange(1, size))
+                          for _ in range(200)})
+        likes = sorted({(rand.randrange(1, size), rand.randrange(1, messages))
+                        for _ in range(150)})
+        active = bytearray(b'\x01' * size)
+        active[0] = active[7] = 0
+        config = dict(RECOMMEND_TOP_K=3, RECOMMEND_FOF_WEIGHT=1.0,
+                      RECOMMEND_COLIKE_WEIGHT=0.3,
+                      RECOMMEND_MAX_MESSAGE_LIKES=1000)
+
+        pairs = [array('i', column) for column in (*zip(*follows),
+                                                   *zip(*likes))]
+        index = recommendations._Index(*pairs, active, size, messages, config)
+        index._build_adjacency(*pairs, messages)
+
+        expected = index._score_python(0, size)
+        # small top k on a dense graph: ties at the cut-off are common
+        self.assertTrue(any(
+            len(picks) == 3 and picks[1][1] == picks[2][1]
+            for _, picks in expected))
+        for chunk_size in (1, 7, size):
+            scored = [result for lo in range(0, size, chunk_size)
+                      for result in index._score_matrices(
+                          lo, min(lo + chunk_size, size))]
+            self.assertEqual(scored, expected)
+
+    def test_viral_likes_dropped(self):
+        """Likes of messages with too many likes are left out"""
+        likes = [(user_id, 1) for user_id in range(5)] + [(2, 3), (4, 3)]
+        likers, liked = (array('i', column) for column in zip(*likes))
+        config = dict(RECOMMEND_TOP_K=3, RECOMMEND_FOF_WEIGHT=1.0,
+                      RECOMMEND_COLIKE_WEIGHT=0.3,
+                      RECOMMEND_MAX_MESSAGE_LIKES=2)
+
+        index = recommendations._Index(array('i'), array('i'), likers, liked,
+                                       bytearray(b'\x01' * 5), 5, 4, config)
+
+        self.assertEqual(index.likes, 2)
+        self.assertEqual(index.likes_matrix.nonzero()[1].tolist(), [3, 3])
+        self.assertEqual(index.likes_matrix.nonzero()[0].tolist(), [2, 4])
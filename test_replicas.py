@@ -0,0 +1,106 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app
+from models import db, User
+import query_plans
+from replicas import PRIMARY_UNTIL_KEY
+from user_cache import CURR_USER_KEY
+import user_cache
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Route reads in read-only views to a replica, using two SQLite files.
+
+    Nothing replicates between them, so which one a page read from shows
+    in which users it lists.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        primary = f"sqlite:///{os.path.join(self.dir.name, 'primary.db')}"
+        replica = f"sqlite:///{os.path.join(self.dir.name, 'replica.db')}"
+
+        self.app = create_app('testing', SQLALCHEMY_DATABASE_URI=primary,
+                              SQLALCHEMY_REPLICA_URIS=[replica],
+                              WTF_CSRF_ENABLED=False,
+                              BCRYPT_LOG_ROUNDS=4)
+
+        with self.app.app_context():
+            for engine in db.engines.values():
+                db.metadata.create_all(engine)
+                with engine.begin() as conn:
+                    conn.execute(User.__table__.insert(), [
+                        dict(id=1, username='both', email='both@test.com',
+                             password='x'),
+                    ])
+            with db.engines['replica-0'].begin() as conn:
+                conn.execute(User.__table__.insert().values(
+                    id=2, username='onreplica', email='r@test.com',
+                    password='x'))
+        user_cache.clear()
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = 1
+
+    def tearDown(self):
+        with self.app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        self.dir.cleanup()
+        user_cache.clear()
+
+    def test_read_only_views_use_replica(self):
+        html = self.client.get('/users').get_data(as_text=True)
+        self.assertIn('@onreplica', html)
+
+        # autocomplete isn't marked read-only
+        resp = self.client.get('/users/autocomplete', query_string={'q': 'on'})
+        self.assertNotIn('onreplica', resp.get_data(as_text=True))
+
+    def test_writes_go_to_primary_and_stick(self):
+        resp = self.client.post('/messages/new', data=dict(text='primary!'))
+        self.assertEqual(resp.status_code, 302)
+
+        with self.app.app_context():
+            with db.engines['replica-0'].connect() as conn:
+                self.assertEqual(
+                    conn.exec_driver_sql("SELECT COUNT(*) FROM messages")
+                    .scalar(), 0)
+
+        # read-your-writes: this browser reads the primary for a while
+        html = self.client.get('/users/1').get_data(as_text=True)
+        self.assertIn('primary!', html)
+        html = self.client.get('/users').get_data(as_text=True)
+        self.assertNotIn('@onreplica', html)
+
+        with self.client.session_transaction() as session:
+            session[PRIMARY_UNTIL_KEY] = 0
+        html = self.client.get('/users').get_data(as_text=True)
+        self.assertIn('@onreplica', html)
+
+        # other browsers never stuck
+        other = self.app.test_client()
+        html = other.get('/users').get_data(as_text=True)
+        self.assertIn('@onreplica', html)
+
+    def test_index_check_sees_replica_reads(self):
+        with self.app.app_context():
+            replica = db.engines['replica-0']
+            statements = query_plans.capture('/users', 1)
+
+        on_replica = [statement for statement, _, engine in statements
+                      if engine is replica]
+        self.assertTrue(any('FROM users' in statement
+                            for statement in on_replica))
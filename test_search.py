@@ -0,0 +1,164 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import importlib
+import os
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import search
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+NAMES = ["bob", "bobby", "jimbob", "alice", "al_ice", "100%real"]
+
+
+class SearchBackendMixin:
+    """Assertions every search backend must pass."""
+
+    backend_name = None
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        db.session.add_all([User(email=f"{name}@test.com", username=name,
+                                 password="HASHED_PASSWORD")
+                            for name in NAMES])
+        db.session.commit()
+
+        app.config['SEARCH_BACKEND'] = self.backend_name
+        app.extensions['search'] = {}
+        self.backend = search.get_backend()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['SEARCH_BACKEND'] = 'auto'
+        app.extensions['search'] = {}
+
+    def names(self, results):
+        return [user.username for user in results.users]
+
+    def test_ranked_contains_match(self):
+        """Exact matches rank first, then closer matches"""
+        results = self.backend.search("bob")
+        self.assertEqual(self.names(results)[0], "bob")
+        self.assertEqual(set(self.names(results)), {"bob", "bobby", "jimbob"})
+        self.assertEqual(self.names(self.backend.search("BOBB")), ["bobby"])
+
+    def test_pages(self):
+        """Each page starts after the last hit of the one before"""
+        first = self.backend.search("b", per_page=2)
+        second = self.backend.search("b", after=first.next_after, per_page=2)
+
+        self.assertEqual(first.next_after, first.users[-1].id)
+        self.assertIsNone(second.next_after)
+        self.assertEqual(len(set(self.names(first) + self.names(second))), 3)
+
+        # the view links the next page the same way
+        app.config['USERS_PAGE_SIZE'] = 2
+        try:
+            html = self.client.get('/users', query_string={'q': 'b'}) \
+                              .get_data(as_text=True)
+        finally:
+            app.config['USERS_PAGE_SIZE'] = 30
+        self.assertIn(f'after={first.next_after}', html)
+
+    def test_like_wildcards_are_literal(self):
+        """% and _ in the query match themselves only"""
+        self.assertEqual(self.names(self.backend.search("%")), ["100%real"])
+        self.assertEqual(self.names(self.backend.search("l_i")), ["al_ice"])
+
+    def test_autocomplete(self):
+        """Autocomplete returns prefix matches in name order"""
+        resp = self.client.get('/users/autocomplete', query_string={'q': 'Bo'})
+        self.assertEqual([user['username'] for user in resp.json],
+                         ["bob", "bobby"])
+        self.assertEqual(self.client.get('/users/autocomplete').json, [])
+
+    def test_index_follows_signup_and_profile_edits(self):
+        """New and renamed users are findable straight away"""
+        self.client.post('/signup', data={
+            'username': 'zebra', 'email': 'zebra@test.com',
+            'password': 'password', 'image_url': ''})
+        self.assertEqual(self.names(self.backend.search("ebr")), ["zebra"])
+
+        zebra = User.query.filter_by(username='zebra').one()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = zebra.id
+        self.client.post('/users/profile', data={
+            'username': 'okapi', 'email': 'zebra@test.com', 'image_url': '',
+            'bio': '', 'location': '', 'password': 'password'})
+
+        self.assertEqual(self.names(self.backend.search("ebr")), [])
+        self.assertEqual(self.names(self.backend.search("kap")), ["okapi"])
+
+
+class PostgresSearchTestCase(SearchBackendMixin, TestCase):
+    backend_name = 'postgres'
+
+    def test_migration_creates_indexes(self):
+        """Migration 0007 builds the search indexes (trigram if it can)"""
+        migration = importlib.import_module(
+            'migrations.0007_user_search_indexes')
+        with db.engine.begin() as conn:
+            migration.upgrade(conn)
+            migration.upgrade(conn)
+
+        indexes = {index['name'] for index in inspect(db.engine)
+                   .get_indexes('users')}
+        self.assertIn('ix_users_username_prefix', indexes)
+        self.assertEqual('ix_users_username_trgm' in indexes,
+                         self.backend.has_trgm())
+
+
+class MemorySearchTestCase(SearchBackendMixin, TestCase):
+    backend_name = 'memory'
+
+    def test_similarity(self):
+        """Trigram similarity matches pg_trgm's definition"""
+        self.assertEqual(search.similarity("bob", "bob"), 1)
+        self.assertLess(search.similarity("bob", "jimbob"),
+                        search.similarity("bob", "bobby"))
+
+
+class ListUsersTestCase(TestCase):
+    """Test the /users page pages through users without a query."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        db.session.add_all([User(email=f"{name}@test.com", username=name,
+                                 password="HASHED_PASSWORD")
+                            for name in NAMES])
+        db.session.commit()
+        app.config['USERS_PAGE_SIZE'] = 4
+
+    def tearDown(self):
+        app.config['USERS_PAGE_SIZE'] = 30
+
+    def test_browse_pages(self):
+        client = app.test_client()
+        html = client.get('/users').get_data(as_text=True)
+        self.assertIn('@bob<', html)
+        self.assertNotIn('@al_ice<', html)
+
+        last = User.query.order_by(User.id).all()[3]
+        html = client.get('/users', query_string={'after': last.id}) \
+                     .get_data(as_text=True)
+        self.assertIn('@al_ice<', html)
+        self.assertNotIn('@bob<', html)
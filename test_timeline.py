@@ -0,0 +1,117 @@
+"""Precomputed home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+import timeline
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out on write, follow changes, hybrid reads and backfill."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+        app.config['TIMELINE_FANOUT'] = True
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 10000
+
+        self.client = app.test_client()
+
+        self.reader = User(email="reader@test.com", username="reader",
+                           password="HASHED_PASSWORD")
+        self.author = User(email="author@test.com", username="author",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.reader, self.author])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_FANOUT'] = False
+
+    def timeline_ids(self, user):
+        return {entry.message_id for entry
+                in TimelineEntry.query.filter_by(user_id=user.id)}
+
+    def test_post_fans_out_to_followers(self):
+        """Posting puts the message in the author's and followers' timelines"""
+        self.reader.following.append(self.author)
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.author.id
+            client.post('/messages/new', data={'text': 'fanned out'})
+
+        msg = Message.query.filter_by(text='fanned out').one()
+        self.assertEqual(self.timeline_ids(self.reader), {msg.id})
+        self.assertEqual(self.timeline_ids(self.author), {msg.id})
+
+    def test_follow_and_unfollow_update_timeline(self):
+        """Following copies the author's messages in, unfollowing removes them"""
+        msg = Message(text='before follow', user_id=self.author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.reader.id
+
+            client.post(f'/users/follow/{self.author.id}')
+            self.assertEqual(self.timeline_ids(self.reader), {msg.id})
+
+            resp = client.get('/')
+            self.assertIn('before follow', resp.get_data(as_text=True))
+
+            client.post(f'/users/stop-following/{self.author.id}')
+            self.assertEqual(self.timeline_ids(self.reader), set())
+
+    def test_celebrity_messages_pulled_at_read_time(self):
+        """Authors over the threshold are merged in instead of fanned out"""
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 1
+        self.reader.following.append(self.author)
+        db.session.commit()
+        counters.reconcile(user_ids=[self.author.id])
+
+        msg = Message(text='celebrity post', user_id=self.author.id)
+        db.session.add(msg)
+        timeline.fan_out_message(msg)
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.reader), set())
+        self.assertIn(msg, timeline.home_timeline(self.reader.id))
+
+    def test_backfill(self):
+        """Backfill rebuilds timelines from existing messages and follows"""
+        self.reader.following.append(self.author)
+        own = Message(text='own', user_id=self.reader.id)
+        theirs = Message(text='theirs', user_id=self.author.id)
+        db.session.add_all([own, theirs])
+        db.session.commit()
+
+        written = timeline.backfill(batch_size=1)
+
+        self.assertEqual(written, 3)
+        self.assertEqual(self.timeline_ids(self.reader), {own.id, theirs.id})
+        self.assertEqual(self.timeline_ids(self.author), {theirs.id})
+        self.assertEqual(
+            [m.text for m in timeline.home_timeline(self.reader.id)],
+            ['theirs', 'own'])
@@ -0,0 +1,147 @@
+"""Trending counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import trending
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TrendingTestCase(TestCase):
+    """Test likes decay, drop out of the window and rank at compaction."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.trending = trending.Trending(window=60, half_life=15, size=3,
+                                          compact_interval=30,
+                                          clock=self.clock)
+
+    def test_decay_and_window(self):
+        """A like's weight halves every half-life and is gone after the window"""
+        self.trending.record(1)
+        self.trending.record(1)
+        self.assertAlmostEqual(self.trending.score(1), 2.0)
+
+        self.clock.now += 15 * 60
+        self.trending.record(1)
+        self.assertAlmostEqual(self.trending.score(1), 2.0)
+
+        self.clock.now += 50 * 60
+        self.assertAlmostEqual(self.trending.score(1), 2 ** (-50 / 15))
+
+        self.trending.record(1, -1)
+        self.assertEqual(self.trending.score(1), 0.0)
+        self.trending.compact()
+        self.assertEqual(len(self.trending), 0)
+
+    def test_unlike_takes_back_its_like(self):
+        """An unlike takes back a like; expiring them adds nothing back"""
+        self.trending.record(1)
+        self.trending.record(1)
+        self.clock.now += 5 * 60
+        self.trending.record(1, -1)
+        self.assertAlmostEqual(self.trending.score(1), 2 ** (-5 / 15))
+
+        # the like's minute expires, then the unlike's
+        self.clock.now += 57 * 60
+        self.assertEqual(self.trending.score(1), 0.0)
+        self.clock.now += 4 * 60
+        self.assertEqual(self.trending.score(1), 0.0)
+        self.trending.compact()
+        self.assertEqual(self.trending.top(2), ())
+
+    def test_top_is_ranked_at_compaction(self):
+        """top() serves the last ranking until the next compaction is due"""
+        for message_id, likes in ((1, 1), (2, 3), (3, 2), (4, 1)):
+            for _ in range(likes):
+                self.trending.record(message_id)
+        self.assertEqual(self.trending.top(3), ())
+
+        self.trending.compact()
+        self.assertEqual(self.trending.top(3), (2, 3, 1))
+        self.assertEqual(self.trending.top(1), (2,))
+
+        # fresh likes beat older, more numerous ones
+        self.clock.now += 45 * 60
+        self.trending.record(4)
+        self.trending.record(4)
+        self.assertEqual(self.trending.top(2), (4, 2))
+
+        self.trending.forget(4)
+        self.assertEqual(self.trending.top(2), (2, 3))
+
+    def test_compaction_keeps_scores(self):
+        """Moving the landmark rescales scores without changing them"""
+        self.trending.record(7)
+        self.clock.now += 10 * 60
+        before = self.trending.score(7)
+        self.trending.compact()
+        self.assertAlmostEqual(self.trending.score(7), before)
+        self.trending.record(7)
+        self.assertAlmostEqual(self.trending.score(7), before + 1)
+
+
+class TrendingViewTestCase(TestCase):
+    """Test likes through the app show up on /messages/trending."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+
+        self.user = User.signup(username="liker", email="liker@test.com",
+                                password="password", image_url=None)
+        db.session.commit()
+        self.messages = [Message(text=f"warble {i}", user_id=self.user.id)
+                         for i in range(3)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+        self.message_ids = [msg.id for msg in self.messages]
+
+        app.extensions['trending'] = self.tracker = trending.Trending()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_trending_page(self):
+        """Liked messages are listed, best first; unliked ones drop out"""
+        resp = self.client.get('/messages/trending')
+        self.assertIn('Nothing is trending', resp.get_data(as_text=True))
+
+        for message_id in self.message_ids[1:]:
+            self.client.post(f'/users/{message_id}/add-like')
+        self.client.post(f'/users/{self.message_ids[2]}/un-like')
+        self.tracker.compact()
+
+        html = self.client.get('/messages/trending').get_data(as_text=True)
+        self.assertIn('warble 1', html)
+        self.assertNotIn('warble 2', html)
+        self.assertNotIn('warble 0', html)
+
+        self.client.post(f'/messages/{self.message_ids[1]}/delete')
+        self.assertEqual(self.tracker.top(10), ())
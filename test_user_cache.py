@@ -0,0 +1,108 @@
+"""Current user cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_user_cache.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import user_cache
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserCacheTestCase(TestCase):
+    """Test g.user is lazy, cached across requests and invalidated."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        user_cache.clear()
+
+        self.user = User.signup(username="cached", email="cached@test.com",
+                                password="password", image_url=None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        db.session.rollback()
+        user_cache.clear()
+
+    def count_queries(self, url):
+        """GET `url` with an empty identity map; return (response, count)."""
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.expunge_all()
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            resp = self.client.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        return resp, len(statements)
+
+    def test_cache_hit_needs_no_query(self):
+        """Identity-only pages load the user once, fields from the cache"""
+        resp, first = self.count_queries('/messages/new')
+        self.assertIn('alt="cached"', resp.get_data(as_text=True))
+        self.assertEqual(first, 1)
+
+        # only the check that the row is still there
+        resp, second = self.count_queries('/messages/new')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(second, 1)
+
+    def test_deleted_behind_the_cache(self):
+        """A user deleted by another worker is logged out, not a 500"""
+        self.client.get('/messages/new')
+        # no signal: this process's cache still holds the fields
+        db.session.execute(db.update(User).values(deleted_at=db.func.now())
+                           .where(User.id == self.user_id))
+        db.session.commit()
+
+        resp = self.client.post('/users/delete', follow_redirects=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Access unauthorized', resp.get_data(as_text=True))
+        resp = self.client.get('/messages/new')
+        self.assertEqual(resp.status_code, 302)
+
+    def test_profile_edit_invalidates(self):
+        """Editing the profile drops the cached username"""
+        self.client.get('/messages/new')
+        self.client.post('/users/profile', data={
+            'username': 'renamed', 'email': 'cached@test.com',
+            'image_url': '', 'bio': '', 'location': '',
+            'password': 'password'})
+
+        resp = self.client.get('/messages/new')
+        self.assertIn('alt="renamed"', resp.get_data(as_text=True))
+
+    def test_expired_entry_reloads(self):
+        """Entries older than the TTL are refetched"""
+        app.config['CURRENT_USER_CACHE_TTL'] = 0
+        try:
+            self.client.get('/messages/new')
+            _, count = self.count_queries('/messages/new')
+            self.assertEqual(count, 1)
+        finally:
+            app.config['CURRENT_USER_CACHE_TTL'] = 60
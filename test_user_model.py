@@ -26,6 +26,7 @@ from app import app
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
 
+app.app_context().push()
 db.create_all()
 
 
@@ -108,6 +109,22 @@ class UserModelTestCase(TestCase):
         self.assertEqual(u.is_following(self.user_test), True)
         self.assertEqual(follow.user_being_followed_id, self.user_test.id)
 
+    def test_following_ids_among(self):
+        """Batched follow check answers for many ids in one go"""
+        others = [User(email=f"other{i}@test.com", username=f"other{i}",
+                       password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(others)
+        db.session.commit()
+
+        self.user_test.following.extend(others[:2])
+        db.session.commit()
+
+        ids = [other.id for other in others]
+        self.assertEqual(self.user_test.following_ids_among(ids), set(ids[:2]))
+        self.assertEqual(self.user_test.following_ids_among([]), set())
+        self.assertFalse(self.user_test.is_following(others[2]))
+        self.assertFalse(self.user_test.is_followed_by(others[0]))
+
     def test_user_likes(self):
         """Test user.likes"""
         u = User(
@@ -166,4 +183,16 @@ class UserModelTestCase(TestCase):
         self.assertNotEqual(User.authenticate(u.username, "HasHeD-test"), u)
         self.assertNotEqual(User.authenticate("tesuser", u.password), u)
         
-    
\ No newline at end of file
+    
+    def test_deleted_user_authenticate(self):
+        """Deleted users can't log in, even before they're purged"""
+        u = User.signup(
+            email="test@test.com",
+            username="testuser",
+            password="HASHED_PASSWORD",
+            image_url= User.image_url.default.arg
+        )
+        u.deleted_at = db.func.now()
+        db.session.commit()
+
+        self.assertFalse(User.authenticate(u.username, "HASHED_PASSWORD"))
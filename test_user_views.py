@@ -1,16 +1,18 @@
 import os
 
 from unittest import TestCase
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Follows
 from forms import UserEditForm
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
-from app import app, CURR_USER_KEY
+from app import app, create_app, CURR_USER_KEY
 
+app.app_context().push()
 db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['USER_PURGE_IN_BACKGROUND'] = False
 
 class UserViewsTestCase(TestCase):
     def setUp(self):
@@ -117,6 +119,38 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(len(self.testuser.followers), 1)
             self.assertIn(new_user.username, log_html)
             
+    def test_following_pages(self):
+        """Long follow lists come a page at a time, by id"""
+        others = [User(email=f"paged{i}@test.com", username=f"paged{i}",
+                       password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(others)
+        db.session.commit()
+        db.session.add_all(Follows(user_following_id=self.testuser.id,
+                                   user_being_followed_id=other.id)
+                           for other in others)
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+
+            app.config['USERS_PAGE_SIZE'] = 2
+            try:
+                html = client.get(f'/users/{self.testuser.id}/following'
+                                  ).get_data(as_text=True)
+                self.assertIn('@paged0', html)
+                self.assertIn('@paged1', html)
+                self.assertNotIn('@paged2', html)
+                self.assertIn(f'after={others[1].id}', html)
+
+                html = client.get(f'/users/{self.testuser.id}/following'
+                                  f'?after={others[1].id}').get_data(as_text=True)
+                self.assertNotIn('@paged1', html)
+                self.assertIn('@paged2', html)
+                self.assertNotIn('More users', html)
+            finally:
+                app.config['USERS_PAGE_SIZE'] = 30
+
     def test_add_follow(self):
         """test should add a follow when g.user"""
         new_user = User.signup(username="abbytest",
@@ -164,6 +198,31 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(log_resp.request.path, f'/users/{self.testuser.id}/following')
             self.assertNotIn(new_user.username, log_html)
             
+    def test_fetched_follow(self):
+        """Fetched follows answer with the new state, not the following page"""
+        new_user = User.signup(username="abbytest",
+                email="test1@test.com",
+                password="testuser",
+                image_url=None)
+        db.session.commit()
+        new_id = new_user.id
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+
+            resp = client.post(f'/users/follow/{new_id}',
+                               headers={'Accept': 'application/json'})
+            self.assertEqual(resp.json, dict(user_id=new_id, following=True,
+                                             followers_count=1))
+
+            resp = client.post(f'/users/stop-following/{new_id}',
+                               headers={'X-Requested-With': 'fetch'})
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'action="/users/follow/{new_id}"', html)
+            self.assertNotIn('<nav', html)
+            self.assertEqual(Follows.query.count(), 0)
+
     def test_user_profile(self):
         """Test for updating and showing user profile"""
         form = UserEditForm(obj = self.testuser)
@@ -202,7 +261,7 @@ class UserViewsTestCase(TestCase):
             
             log_resp = client.post('/users/delete', follow_redirects=True)
             # log_html = log_resp.get_data(as_text=True)
-            user = User.query.filter(User.id == self.testuser.id).first()
+            user = User.active().filter(User.id == self.testuser.id).first()
             
             self.assertEqual(log_resp.status_code, 200)
             self.assertEqual(log_resp.request.path, '/signup')
@@ -210,4 +269,19 @@ class UserViewsTestCase(TestCase):
 
             
             
-            
\ No newline at end of file
+            
+    def test_login_with_csrf_from_separate_browsers(self):
+        """Each browser gets its own CSRF token, so logins don't cross"""
+        # an app of its own, so its requests don't share this module's
+        # app context (and g) the way requests to app do
+        csrf_app = create_app('testing', WTF_CSRF_ENABLED=True,
+                              BCRYPT_LOG_ROUNDS=4)
+        for _ in range(2):
+            client = csrf_app.test_client()
+            html = client.get('/login').get_data(as_text=True)
+            token = html.split('name="csrf_token" type="hidden" value="')[1] \
+                        .split('"')[0]
+            resp = client.post('/login', data={'username': 'testuser',
+                                               'password': 'testuser',
+                                               'csrf_token': token})
+            self.assertEqual(resp.status_code, 302)
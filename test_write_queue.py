@@ -0,0 +1,172 @@
+"""Write queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_write_queue.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import write_queue
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class WriteQueueTestCase(TestCase):
+    """Test queued likes and follows coalesce, batch and keep counters."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+        self.queue = app.extensions['write_queue']
+        self.saved = {key: app.config[key]
+                      for key in ('WRITE_QUEUE', 'WRITE_QUEUE_INTERVAL',
+                                  'WRITE_QUEUE_MAX_PENDING',
+                                  'WRITE_QUEUE_TIMEOUT')}
+        # nothing is written until the test flushes
+        app.config.update(WRITE_QUEUE='async', WRITE_QUEUE_INTERVAL=60)
+
+        self.users = [User(email=f"q{i}@test.com", username=f"queued{i}",
+                           password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.reader, self.author, self.other = [u.id for u in self.users]
+
+        self.message = Message(text="queue me", user_id=self.author)
+        db.session.add(self.message)
+        db.session.commit()
+        self.message_id = self.message.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.reader
+
+    def tearDown(self):
+        self.queue.flush()
+        app.config.update(self.saved)
+        db.session.rollback()
+
+    def user(self, user_id):
+        user = db.session.get(User, user_id)
+        db.session.refresh(user)
+        return user
+
+    def test_async_coalesces(self):
+        """Like, unlike, like is one row; follow then unfollow is none"""
+        for action in ('add-like', 'un-like', 'add-like'):
+            resp = self.client.post(f'/users/{self.message_id}/{action}')
+            self.assertEqual(resp.status_code, 302)
+        self.client.post(f'/users/follow/{self.author}')
+        self.client.post(f'/users/stop-following/{self.author}')
+        self.client.post(f'/users/follow/{self.other}')
+
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual(Likes.query.count(), 0)
+
+        self.assertTrue(self.queue.flush())
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(
+            [(like.user_id, like.message_id) for like in Likes.query],
+            [(self.reader, self.message_id)])
+        self.assertEqual(
+            [follow.user_being_followed_id for follow in Follows.query],
+            [self.other])
+
+        reader = self.user(self.reader)
+        self.assertEqual((reader.likes_count, reader.following_count), (1, 1))
+        self.assertEqual(self.user(self.author).followers_count, 0)
+        self.assertEqual(self.user(self.other).followers_count, 1)
+
+    def test_batch_skips_unchanged_and_missing_rows(self):
+        """Rows already in the wanted state or gone send no signals"""
+        with app.test_request_context():
+            write_queue.apply({(write_queue.LIKE, self.reader,
+                                self.message_id): True})
+            db.session.commit()
+
+            write_queue.apply({
+                (write_queue.LIKE, self.reader, self.message_id): True,
+                (write_queue.LIKE, self.other, self.message_id): False,
+                (write_queue.LIKE, self.other, 999999999): True,
+                (write_queue.FOLLOW, self.reader, 999999999): True,
+            })
+            db.session.commit()
+
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(self.user(self.reader).likes_count, 1)
+        self.assertEqual(self.user(self.other).likes_count, 0)
+
+    def test_group_waits_for_commit(self):
+        """In group mode the like is written when the request returns"""
+        app.config.update(WRITE_QUEUE='group', WRITE_QUEUE_INTERVAL=0.01)
+
+        self.client.post(f'/users/{self.message_id}/add-like')
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(Likes.query.count(), 1)
+
+        self.client.post(f'/users/{self.message_id}/un-like')
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(self.user(self.reader).likes_count, 0)
+
+    def test_group_timeout_is_an_error(self):
+        """A like whose batch isn't written in time gets a 503"""
+        app.config.update(WRITE_QUEUE='group', WRITE_QUEUE_TIMEOUT=0.1)
+
+        resp = self.client.post(f'/users/{self.message_id}/add-like')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(Likes.query.count(), 0)
+
+        # it's still queued, and written later
+        self.assertTrue(self.queue.flush())
+        self.assertEqual(Likes.query.count(), 1)
+
+    def test_flush_waits_for_batch_in_flight(self):
+        """An empty queue isn't flushed until the batch it handed off is"""
+        app.config.update(WRITE_QUEUE_INTERVAL=0.01)
+        with db.engine.connect() as blocker:
+            # the like's foreign key check waits on this row lock
+            blocker.execute(db.select(Message.id).where(
+                Message.id == self.message_id).with_for_update())
+
+            self.client.post(f'/users/{self.message_id}/add-like')
+            for _ in range(100):
+                if not len(self.queue):
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(self.queue), 0)
+            self.assertFalse(self.queue.flush(timeout=0.2))
+            blocker.rollback()
+
+        self.assertTrue(self.queue.flush())
+        self.assertEqual(Likes.query.count(), 1)
+
+    def test_full_queue_sheds_load(self):
+        """Past WRITE_QUEUE_MAX_PENDING, new pairs get a 503"""
+        app.config.update(WRITE_QUEUE_MAX_PENDING=1, WRITE_QUEUE_TIMEOUT=0)
+        # the full queue would otherwise be written at once
+        with self.queue._cond:
+            self.queue._pending[(write_queue.FOLLOW, self.reader,
+                                 self.other)] = True
+
+            resp = self.client.post(f'/users/{self.message_id}/add-like')
+            self.assertEqual(resp.status_code, 503)
+
+            # a pair already queued just changes its wanted state
+            resp = self.client.post(f'/users/stop-following/{self.other}')
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.queue._pending, {
+                (write_queue.FOLLOW, self.reader, self.other): False})
@@ -0,0 +1,247 @@
+"""Precomputed (fan-out-on-write) home timelines.
+
+When `TIMELINE_FANOUT` is on, every new message is copied into the
+`timelines` table for its author and each of the author's followers, and
+following / unfollowing someone adds or removes that author's messages.
+The home page then becomes a single indexed range read on
+(user_id, timestamp) instead of an IN-query over everyone the user follows.
+
+Authors with at least `TIMELINE_CELEBRITY_FOLLOWERS` followers are not
+fanned out (that would mean one insert per follower for every message they
+post); their messages are pulled at read time and merged in instead.
+
+Run `flask backfill-timelines` after turning the feature on, or after
+changing the celebrity threshold, to rebuild the stored timelines.
+"""
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, literal, select, union, union_all
+from sqlalchemy.orm import joinedload
+
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import NEWER, OLDER, keyset, make_page, paginate
+from signals import follow_added, follow_removed, message_posted
+
+
+def init_app(app):
+    """Register timeline config defaults, signal receivers and CLI command."""
+
+    app.config.setdefault('TIMELINE_FANOUT', False)
+    app.config.setdefault('TIMELINE_CELEBRITY_FOLLOWERS', 10000)
+    # how many of an author's latest messages land in a timeline on follow
+    app.config.setdefault('TIMELINE_FOLLOW_BACKFILL', 100)
+
+    message_posted.connect(_on_message_posted)
+    follow_added.connect(_on_follow_added)
+    follow_removed.connect(_on_follow_removed)
+
+    app.cli.add_command(backfill_timelines_command)
+
+
+def is_enabled():
+    return current_app.config['TIMELINE_FANOUT']
+
+
+def is_celebrity(user_id):
+    """Is `user_id` followed by too many users to fan out on write?"""
+
+    threshold = current_app.config['TIMELINE_CELEBRITY_FOLLOWERS']
+    followers = db.session.scalar(
+        select(User.followers_count).where(User.id == user_id))
+    return followers >= threshold
+
+
+def _celebrity_ids():
+    """Select ids of every user at or over the celebrity threshold."""
+
+    threshold = current_app.config['TIMELINE_CELEBRITY_FOLLOWERS']
+    return select(User.id).where(User.followers_count >= threshold)
+
+
+def fan_out_message(message):
+    """Copy `message` into its author's timeline and their followers'."""
+
+    db.session.flush()
+
+    own = select(literal(message.user_id), literal(message.id),
+                 literal(message.timestamp))
+    rows = own
+    if not is_celebrity(message.user_id):
+        followers = (select(Follows.user_following_id,
+                            literal(message.id),
+                            literal(message.timestamp))
+                     .where(Follows.user_being_followed_id == message.user_id)
+                     .where(Follows.user_following_id != message.user_id))
+        rows = union_all(own, followers)
+
+    db.session.execute(
+        insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'timestamp'], rows))
+
+
+def add_author(user_id, author_id):
+    """Put `author_id`'s latest messages into `user_id`'s timeline."""
+
+    if is_celebrity(author_id):
+        return
+
+    already = (select(TimelineEntry.message_id)
+               .where(TimelineEntry.user_id == user_id))
+    latest = (select(literal(user_id), Message.id, Message.timestamp)
+              .where(Message.user_id == author_id)
+              .where(Message.id.not_in(already))
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(current_app.config['TIMELINE_FOLLOW_BACKFILL']))
+
+    db.session.execute(
+        insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'timestamp'], latest))
+
+
+def remove_author(user_id, author_id):
+    """Drop every message by `author_id` from `user_id`'s timeline."""
+
+    authored = select(Message.id).where(Message.user_id == author_id)
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+        .where(TimelineEntry.message_id.in_(authored)))
+
+
+def home_feed(user_id, direction=OLDER, key=None, limit=100):
+    """Return a Page of `user_id`'s home feed: their and their followees'
+    messages, from stored timelines when fan-out is on."""
+
+    if is_enabled():
+        return home_timeline(user_id, direction=direction, key=key,
+                             limit=limit)
+
+    # one IN over a union (not `= me OR IN (...)`) so each author is an
+    # index range read on (user_id, timestamp)
+    authors = union(
+        select(literal(user_id)),
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == user_id))
+    return paginate(Message
+                    .query
+                    .options(joinedload(Message.user))
+                    .filter(Message.user_id.in_(authors)),
+                    Message.timestamp, Message.id,
+                    direction=direction, key=key, limit=limit)
+
+
+def home_timeline(user_id, direction=OLDER, key=None, limit=100):
+    """Return a Page of `user_id`'s home timeline.
+
+    Reads the stored timeline and merges in messages from any followed
+    celebrity authors, which were never fanned out. `direction` and `key`
+    come from `pagination.cursor_from_request()`.
+    """
+
+    stored, more_stored = keyset(
+        Message
+        .query
+        .options(joinedload(Message.user))
+        .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+        .filter(TimelineEntry.user_id == user_id),
+        TimelineEntry.timestamp, TimelineEntry.message_id,
+        direction=direction, key=key, limit=limit)
+
+    celebrities = (select(Follows.user_being_followed_id)
+                   .where(Follows.user_following_id == user_id)
+                   .where(Follows.user_being_followed_id.in_(_celebrity_ids())))
+    pulled, more_pulled = keyset(
+        Message
+        .query
+        .options(joinedload(Message.user))
+        .filter(Message.user_id.in_(celebrities)),
+        Message.timestamp, Message.id,
+        direction=direction, key=key, limit=limit)
+
+    if not pulled:
+        return make_page(stored, more_stored, direction=direction, key=key)
+
+    # an author who crossed the threshold can be in both lists
+    merged = sorted({msg.id: msg for msg in stored + pulled}.values(),
+                    key=lambda msg: (msg.timestamp, msg.id),
+                    reverse=True)
+    has_more = more_stored or more_pulled or len(merged) > limit
+    # keep the rows nearest the cursor
+    rows = merged[-limit:] if direction == NEWER else merged[:limit]
+
+    return make_page(rows, has_more, direction=direction, key=key)
+
+
+def backfill(batch_size=500):
+    """Rebuild every stored timeline, `batch_size` users at a time.
+
+    Returns the number of timeline rows written.
+    """
+
+    celebrities = _celebrity_ids()
+    written = 0
+    last_id = 0
+
+    while True:
+        user_ids = db.session.scalars(
+            select(User.id)
+            .where(User.id > last_id)
+            .order_by(User.id)
+            .limit(batch_size)).all()
+        if not user_ids:
+            return written
+
+        own = (select(Message.user_id, Message.id, Message.timestamp)
+               .where(Message.user_id.in_(user_ids)))
+        followed = (select(Follows.user_following_id,
+                           Message.id,
+                           Message.timestamp)
+                    .join(Message,
+                          Message.user_id == Follows.user_being_followed_id)
+                    .where(Follows.user_following_id.in_(user_ids))
+                    .where(Follows.user_following_id
+                           != Follows.user_being_followed_id)
+                    .where(Follows.user_being_followed_id.not_in(celebrities)))
+
+        db.session.execute(
+            delete(TimelineEntry).where(TimelineEntry.user_id.in_(user_ids)))
+        result = db.session.execute(
+            insert(TimelineEntry)
+            .from_select(['user_id', 'message_id', 'timestamp'],
+                         union_all(own, followed)))
+        db.session.commit()
+
+        written += result.rowcount
+        last_id = user_ids[-1]
+
+
+@click.command('backfill-timelines')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Users rebuilt per transaction.')
+@with_appcontext
+def backfill_timelines_command(batch_size):
+    """Rebuild the precomputed home timelines from messages and follows."""
+
+    written = backfill(batch_size=batch_size)
+    click.echo(f"Wrote {written} timeline entries.")
+
+
+##############################################################################
+# Signal receivers
+
+
+def _on_message_posted(app, user, message):
+    if is_enabled():
+        fan_out_message(message)
+
+
+def _on_follow_added(app, user, followed):
+    if is_enabled():
+        add_author(user.id, followed.id)
+
+
+def _on_follow_removed(app, user, followed):
+    if is_enabled():
+        remove_author(user.id, followed.id)
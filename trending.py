@@ -0,0 +1,218 @@
+"""Trending messages: likes per message, decayed over time, in memory.
+
+"Most liked lately" as a GROUP BY over `likes` per request doesn't scale
+(and `likes` has no timestamps to window by anyway). Instead the like
+signals feed a counter per message: a ring of TRENDING_WINDOW_MINUTES
+minute buckets, so likes older than the window drop out, and a score in
+which each like counts for less as it ages, halving every
+TRENDING_HALF_LIFE_MINUTES.
+
+Scores use forward decay: a like in minute m adds 2 ** ((m - landmark) /
+half_life) rather than 1 decayed by its age, so a like is O(1) and the
+order of scores doesn't change just because time passes. Every
+TRENDING_COMPACT_INTERVAL seconds `compact()` moves the landmark up (so
+weights stay small), expires old buckets, forgets messages with nothing
+left in the window, and ranks the rest. `top(n)` is a slice of that
+ranking, so the trending page never counts anything.
+
+Each worker process counts the likes it handles, starting from nothing
+when it starts, so with several workers each ranks a sample of the
+likes. Like graph.py's receivers, ours run before the commit; a like
+rolled back after that still counts.
+"""
+
+import heapq
+import math
+import time
+from array import array
+from threading import Lock
+
+from flask import current_app
+
+from signals import like_added, like_removed, message_deleted
+
+
+def init_app(app):
+    """Register trending config defaults, the counters and receivers."""
+
+    app.config.setdefault('TRENDING_WINDOW_MINUTES', 60)
+    app.config.setdefault('TRENDING_HALF_LIFE_MINUTES', 15)
+    app.config.setdefault('TRENDING_COMPACT_INTERVAL', 30)
+    # messages ranked at each compaction
+    app.config.setdefault('TRENDING_SIZE', 100)
+    app.config.setdefault('TRENDING_PAGE_SIZE', 20)
+
+    app.extensions['trending'] = Trending(
+        window=app.config['TRENDING_WINDOW_MINUTES'],
+        half_life=app.config['TRENDING_HALF_LIFE_MINUTES'],
+        size=app.config['TRENDING_SIZE'],
+        compact_interval=app.config['TRENDING_COMPACT_INTERVAL'])
+
+    like_added.connect(_on_like_added)
+    like_removed.connect(_on_like_removed)
+    message_deleted.connect(_on_message_deleted)
+
+
+def tracker():
+    return current_app.extensions['trending']
+
+
+class _Counter:
+    """One message's likes per minute, and its forward-decayed score."""
+
+    __slots__ = ('buckets', 'newest', 'score')
+
+    def __init__(self, window, minute):
+        self.buckets = array('i', bytes(4 * window))
+        self.newest = minute
+        self.score = 0.0
+
+
+class Trending:
+    """Time-decayed like counts for every recently liked message."""
+
+    def __init__(self, window=60, half_life=15, size=100,
+                 compact_interval=30, clock=time.time):
+        self.window = window
+        self.size = size
+        self.compact_interval = compact_interval
+        self.clock = clock
+        self._rate = math.log(2) / half_life
+        self._lock = Lock()
+        self._counters = {}
+        self._landmark = self._minute()
+        self._compacted_at = self.clock()
+        # message ids, best first, as of the last compaction
+        self._top = ()
+
+    def __len__(self):
+        return len(self._counters)
+
+    def _minute(self):
+        return int(self.clock() // 60)
+
+    def _weight(self, minute):
+        return math.exp(self._rate * (minute - self._landmark))
+
+    def _advance(self, counter, minute):
+        """Expire the buckets `counter` reuses to reach `minute`."""
+
+        if minute <= counter.newest:
+            return
+        if minute - counter.newest >= self.window:
+            counter.buckets = array('i', bytes(4 * self.window))
+            counter.score = 0.0
+        else:
+            for old in range(counter.newest + 1 - self.window,
+                             minute + 1 - self.window):
+                slot = old % self.window
+                if counter.buckets[slot]:
+                    counter.score -= counter.buckets[slot] * self._weight(old)
+                    counter.buckets[slot] = 0
+            counter.score = max(counter.score, 0.0)
+        counter.newest = minute
+
+    def record(self, message_id, delta=1):
+        """Count a like (or, with -1, an unlike) of `message_id` now.
+
+        An unlike takes back the newest like still in the window, from
+        the minute it was counted in, so no bucket ever goes negative; one
+        with no like left to take back (liked before we started counting,
+        or too long ago) is ignored.
+        """
+
+        with self._lock:
+            minute = self._minute()
+            counter = self._counters.get(message_id)
+            if counter is None:
+                if delta < 0:
+                    return
+                counter = self._counters[message_id] = _Counter(
+                    self.window, minute)
+            self._advance(counter, minute)
+            if delta > 0:
+                counter.buckets[minute % self.window] += delta
+                counter.score += delta * self._weight(minute)
+            else:
+                self._take_back(counter, minute, -delta)
+            self._compact_if_due()
+
+    def _take_back(self, counter, minute, likes):
+        for old in range(minute, minute - self.window, -1):
+            if not likes:
+                break
+            slot = old % self.window
+            taken = min(counter.buckets[slot], likes)
+            if taken:
+                counter.buckets[slot] -= taken
+                counter.score -= taken * self._weight(old)
+                likes -= taken
+        counter.score = max(counter.score, 0.0)
+
+    def forget(self, message_id):
+        with self._lock:
+            self._counters.pop(message_id, None)
+            if message_id in self._top:
+                self._top = tuple(m for m in self._top if m != message_id)
+
+    def score(self, message_id):
+        """`message_id`'s likes in the window, each decayed by its age."""
+
+        with self._lock:
+            counter = self._counters.get(message_id)
+            if counter is None:
+                return 0.0
+            self._advance(counter, self._minute())
+            return counter.score / self._weight(self._minute())
+
+    def top(self, n):
+        """The `n` best message ids, best first, as of the last compaction."""
+
+        if self.clock() - self._compacted_at >= self.compact_interval:
+            with self._lock:
+                self._compact_if_due()
+        return self._top[:n]
+
+    def compact(self):
+        """Expire old likes, rescale scores and rank messages afresh."""
+
+        with self._lock:
+            self._compact()
+
+    def _compact_if_due(self):
+        if self.clock() - self._compacted_at >= self.compact_interval:
+            self._compact()
+
+    def _compact(self):
+        minute = self._minute()
+        scale = math.exp(-self._rate * (minute - self._landmark))
+
+        for message_id, counter in list(self._counters.items()):
+            self._advance(counter, minute)
+            if not any(counter.buckets) or counter.score <= 0:
+                del self._counters[message_id]
+            else:
+                counter.score *= scale
+        self._landmark = minute
+
+        best = heapq.nlargest(
+            self.size, self._counters.items(),
+            key=lambda item: (item[1].score, -item[0]))
+        self._top = tuple(message_id for message_id, _ in best)
+        self._compacted_at = self.clock()
+
+
+##############################################################################
+# Signal receivers
+
+
+def _on_like_added(app, user, message):
+    app.extensions['trending'].record(message.id)
+
+
+def _on_like_removed(app, user, message):
+    app.extensions['trending'].record(message.id, -1)
+
+
+def _on_message_deleted(app, user, message):
+    app.extensions['trending'].forget(message.id)
@@ -0,0 +1,155 @@
+"""Cache of the logged-in user's identity fields for `g.user`.
+
+Nearly every page needs the current user's id, username and avatar for
+the nav bar, but few need the whole row. `g.user` is a CurrentUser: a
+lazy stand-in that costs nothing until read, answers identity fields from
+a short-lived cross-request cache, and only loads the real User row (at
+most once per request) when something asks for anything else -- or asks
+whether anyone is logged in at all, since the row may have been deleted
+by another worker whose cache invalidation never reached this one.
+
+Entries live for `CURRENT_USER_CACHE_TTL` seconds and are dropped straight
+away when the user edits their profile or deletes their account. Each
+worker process has its own cache, so the TTL bounds how stale another
+worker's copy can get.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app
+
+from models import db, User
+from signals import profile_updated, user_deleted
+
+# session key holding the logged-in user's id
+CURR_USER_KEY = "curr_user"
+
+class UserGone(LookupError):
+    """The logged-in user's row is gone or deleted."""
+
+
+IDENTITY_FIELDS = ('id', 'username', 'email', 'image_url',
+                   'header_image_url', 'bio', 'location')
+
+_cache = OrderedDict()
+_lock = Lock()
+
+
+def init_app(app):
+    """Register cache config defaults and invalidation receivers."""
+
+    app.config.setdefault('CURRENT_USER_CACHE_TTL', 60)
+    app.config.setdefault('CURRENT_USER_CACHE_SIZE', 10000)
+
+    profile_updated.connect(_on_user_changed)
+    user_deleted.connect(_on_user_changed)
+
+
+def invalidate(user_id):
+    """Forget any cached identity fields for `user_id`."""
+
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def _get(user_id):
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return None
+        expires, fields = entry
+        if expires < time.monotonic():
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+        return fields
+
+
+def _put(user_id, fields):
+    ttl = current_app.config['CURRENT_USER_CACHE_TTL']
+    if ttl <= 0:
+        return
+
+    with _lock:
+        _cache[user_id] = (time.monotonic() + ttl, fields)
+        _cache.move_to_end(user_id)
+        while len(_cache) > current_app.config['CURRENT_USER_CACHE_SIZE']:
+            _cache.popitem(last=False)
+
+
+class CurrentUser:
+    """Lazy stand-in for the logged-in User, stored on `g.user`.
+
+    Identity fields (see IDENTITY_FIELDS) come from the cache when
+    possible. Any other attribute -- relationships, counters, methods --
+    is read from the real User row, loaded on first use. Use `load()`
+    where the User instance itself is needed, e.g. `db.session.delete`.
+
+    It's false if the user has been deleted, even while their identity
+    fields are still cached; reading any other attribute then raises
+    UserGone (the app logs them out).
+    """
+
+    def __init__(self, user_id):
+        self._user_id = user_id
+        self._fields = None
+        self._from_cache = False
+        self._instance = None
+
+    def _identity(self):
+        if self._fields is None:
+            fields = _get(self._user_id)
+            self._from_cache = fields is not None
+            if fields is None:
+                user = self.load()
+                if user is None:
+                    return None
+                fields = {name: getattr(user, name)
+                          for name in IDENTITY_FIELDS}
+                _put(self._user_id, fields)
+            self._fields = fields
+        return self._fields
+
+    def load(self):
+        """The real User row (one query per request at most), or None
+        if the user is gone or deleted."""
+
+        if self._instance is None:
+            user = db.session.get(User, self._user_id)
+            if user is None or user.deleted_at is not None:
+                invalidate(self._user_id)
+                return None
+            self._instance = user
+        return self._instance
+
+    def __bool__(self):
+        if self._identity() is None:
+            return False
+        # cached fields don't say whether the row is still there
+        if self._from_cache and self._instance is None:
+            return self.load() is not None
+        return True
+
+    def __getattr__(self, name):
+        if name in IDENTITY_FIELDS:
+            fields = self._identity()
+            if fields is not None:
+                return fields[name]
+        user = self.load()
+        if user is None:
+            raise UserGone(self._user_id)
+        return getattr(user, name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self._user_id}>"
+
+
+def _on_user_changed(app, user):
+    invalidate(user.id)
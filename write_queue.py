@@ -0,0 +1,335 @@
+"""Likes and follows, written inline or from a write-behind queue.
+
+Routes call `set_like` / `set_follow` with the state the user asked for.
+Every change is written the same way, by `apply`: one DELETE and one
+INSERT ... ON CONFLICT DO NOTHING per table, both RETURNING the rows they
+actually changed, and the usual signals (counters, timelines, fragment
+cache) sent only for those rows.
+
+`WRITE_QUEUE` picks when that happens:
+
+- 'off' (default): inside the request, committed before it returns.
+- 'group': the change is queued and the request waits until the batch
+  holding it commits. Every change made within WRITE_QUEUE_INTERVAL
+  shares one transaction, so a burst of likes on one message is one
+  write instead of a queue of requests contending for the same rows.
+  If the batch isn't written within WRITE_QUEUE_TIMEOUT, or the change
+  is dropped because writing it failed, the request gets NotWritten (the
+  app answers 503) rather than claiming it was saved.
+- 'async': the change is queued and the request returns at once. Up to
+  WRITE_QUEUE_INTERVAL of changes are lost if the process dies, and the
+  user's next page can come before their change is written.
+
+Queued changes coalesce per (user, target): like, unlike, like within one
+interval writes a single row, like then unlike writes nothing. At most
+WRITE_QUEUE_MAX_PENDING distinct changes wait at once; past that a
+request waits for room, and gets QueueFull (the app answers 503) if none
+frees up within WRITE_QUEUE_TIMEOUT seconds.
+
+The worker thread starts on first use, so it's never inherited across a
+fork, and drains the queue when the process exits.
+"""
+
+import atexit
+from threading import Condition, Thread
+
+from flask import current_app
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Follows, Likes, Message, User
+from signals import follow_added, follow_removed, like_added, like_removed
+
+LIKE = 'like'
+FOLLOW = 'follow'
+
+MODES = ('off', 'group', 'async')
+
+# dropped changes remembered for 'group' waiters
+_KEEP_DROPPED = 1000
+
+
+class QueueFull(Exception):
+    """The queue stayed full for the whole timeout."""
+
+
+class NotWritten(Exception):
+    """A change waited for wasn't committed: timed out, or dropped."""
+
+
+def init_app(app):
+    """Register write queue config defaults and the app's queue."""
+
+    app.config.setdefault('WRITE_QUEUE', 'off')
+    # seconds a queued change waits for others to share its transaction
+    app.config.setdefault('WRITE_QUEUE_INTERVAL', 0.05)
+    app.config.setdefault('WRITE_QUEUE_MAX_PENDING', 10000)
+    app.config.setdefault('WRITE_QUEUE_TIMEOUT', 5.0)
+
+    if app.config['WRITE_QUEUE'] not in MODES:
+        raise ValueError(f"Unknown WRITE_QUEUE: {app.config['WRITE_QUEUE']!r}")
+
+    app.extensions['write_queue'] = WriteQueue(app)
+
+
+def queue():
+    return current_app.extensions['write_queue']
+
+
+def set_like(user_id, message_id, liked=True):
+    """Make `user_id` like (or not) `message_id`."""
+
+    _change((LIKE, user_id, message_id), liked)
+
+
+def set_follow(user_id, followed_id, following=True):
+    """Make `user_id` follow (or not) `followed_id`."""
+
+    _change((FOLLOW, user_id, followed_id), following)
+
+
+def _change(change, wanted):
+    mode = current_app.config['WRITE_QUEUE']
+    if mode == 'off':
+        apply({change: wanted})
+        db.session.commit()
+        return
+
+    # give this request's connection back first: waiting on the worker
+    # while holding it could leave the worker none to write with
+    db.session.commit()
+    batch = queue().put(change, wanted)
+    if mode == 'group' and not queue().wait(batch, change):
+        raise NotWritten()
+
+
+##############################################################################
+# Writing
+
+
+# kind -> (table, acting user's column, target's column, target model)
+TABLES = {
+    LIKE: (Likes.__table__, 'user_id', 'message_id', Message),
+    FOLLOW: (Follows.__table__, 'user_following_id',
+             'user_being_followed_id', User),
+}
+
+SIGNALS = {
+    LIKE: (like_added, like_removed, 'message'),
+    FOLLOW: (follow_added, follow_removed, 'followed'),
+}
+
+
+def _insert(table):
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+def _load(model, ids):
+    """Active (not deleted) `model` rows by id."""
+
+    if not ids:
+        return {}
+    return {obj.id: obj for obj in model.active().filter(model.id.in_(ids))}
+
+
+def apply(changes):
+    """Write `changes`, {(kind, user_id, target_id): wanted}, in the session.
+
+    Pairs already in the wanted state, or whose user or target no longer
+    exists or is deleted, are left alone (deletion.py takes care of a
+    deleted user's rows). Signals are sent for the rest. Doesn't commit.
+    """
+
+    users = _load(User, {user_id for (_, user_id, _) in changes})
+    sender = current_app._get_current_object()
+
+    for kind, (table, own, other, target_model) in TABLES.items():
+        wanted = [(user_id, target_id)
+                  for (k, user_id, target_id), on in changes.items()
+                  if k == kind and on]
+        unwanted = [(user_id, target_id)
+                    for (k, user_id, target_id), on in changes.items()
+                    if k == kind and not on]
+        if not wanted and not unwanted:
+            continue
+
+        targets = _load(target_model,
+                        {target_id for (_, target_id) in wanted + unwanted})
+        wanted, unwanted = (
+            [(user_id, target_id) for user_id, target_id in pairs
+             if user_id in users and target_id in targets]
+            for pairs in (wanted, unwanted))
+        own_column, other_column = table.c[own], table.c[other]
+
+        removed = []
+        if unwanted:
+            removed = db.session.execute(
+                delete(table)
+                .where(tuple_(own_column, other_column).in_(unwanted))
+                .returning(own_column, other_column)).all()
+        added = []
+        if wanted:
+            added = db.session.execute(
+                _insert(table)
+                .values([{own: user_id, other: target_id}
+                         for user_id, target_id in wanted])
+                .on_conflict_do_nothing()
+                .returning(own_column, other_column)).all()
+
+        on_added, on_removed, target_arg = SIGNALS[kind]
+        for signal, rows in ((on_added, added), (on_removed, removed)):
+            for user_id, target_id in rows:
+                signal.send(sender, user=users[user_id],
+                            **{target_arg: targets[target_id]})
+
+
+##############################################################################
+# The queue
+
+
+class WriteQueue:
+    """Coalesces changes and writes them in batches from a worker thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._cond = Condition()
+        self._pending = {}
+        # batches are numbered; `_filling` takes new changes, `_writing`
+        # is being written, and every batch up to `_written` has been
+        self._filling = 0
+        self._writing = -1
+        self._written = -1
+        self._flush_now = False
+        self._stopping = False
+        self._thread = None
+        # (batch, change) of the latest changes whose writes failed, for
+        # waiters to find; oldest first
+        self._dropped = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, change, wanted):
+        """Queue a change, replacing any queued one for the same pair.
+
+        Returns the number of the batch it will be written in.
+        """
+
+        config = self.app.config
+        with self._cond:
+            self._start()
+            has_room = self._cond.wait_for(
+                lambda: (change in self._pending
+                         or len(self._pending)
+                         < config['WRITE_QUEUE_MAX_PENDING']),
+                timeout=config['WRITE_QUEUE_TIMEOUT'])
+            if not has_room:
+                raise QueueFull()
+
+            self._pending[change] = wanted
+            self._cond.notify_all()
+            return self._filling
+
+    def wait(self, batch, change=None, timeout=None):
+        """Wait until `batch` is written. Returns False on timeout, or if
+        `change` was in it but dropped."""
+
+        if timeout is None:
+            timeout = self.app.config['WRITE_QUEUE_TIMEOUT']
+        with self._cond:
+            written = self._cond.wait_for(lambda: self._written >= batch,
+                                          timeout=timeout)
+            return written and (batch, change) not in self._dropped
+
+    def flush(self, timeout=None):
+        """Write everything queued so far now, and wait for it."""
+
+        with self._cond:
+            if self._pending:
+                batch = self._filling
+                self._flush_now = True
+                self._cond.notify_all()
+            else:
+                # the worker may still be writing the last batch it took
+                batch = max(self._filling - 1, self._writing)
+        return self.wait(batch, timeout=timeout)
+
+    def stop(self):
+        """Drain the queue and stop the worker."""
+
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(self.app.config['WRITE_QUEUE_TIMEOUT'])
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self._thread is None:
+            atexit.register(self.stop)
+        self._stopping = False
+        self._thread = Thread(target=self._run, name='write-queue',
+                              daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        config = self.app.config
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    return
+
+                # let other changes join this batch
+                self._cond.wait_for(
+                    lambda: (self._flush_now or self._stopping
+                             or len(self._pending)
+                             >= config['WRITE_QUEUE_MAX_PENDING']),
+                    timeout=config['WRITE_QUEUE_INTERVAL'])
+
+                changes, self._pending = self._pending, {}
+                batch = self._writing = self._filling
+                self._filling += 1
+                self._flush_now = False
+                # there's room again
+                self._cond.notify_all()
+
+            dropped = self._write(changes)
+
+            with self._cond:
+                for change in dropped:
+                    self._dropped[(batch, change)] = True
+                while len(self._dropped) > _KEEP_DROPPED:
+                    del self._dropped[next(iter(self._dropped))]
+                self._written = batch
+                self._cond.notify_all()
+
+    def _write(self, changes):
+        """Write `changes`; returns those that couldn't be."""
+
+        dropped = []
+        with self.app.app_context():
+            try:
+                apply(changes)
+                db.session.commit()
+                return dropped
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception(
+                    "Write queue batch of %d failed; retrying one by one",
+                    len(changes))
+
+            for change, wanted in changes.items():
+                try:
+                    apply({change: wanted})
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception(
+                        "Write queue dropped %r -> %r", change, wanted)
+                    dropped.append(change)
+        return dropped